@@ -61,7 +61,18 @@ TEXTENCODER_CONFIG = {
     'model': f'BAAI/bge-base-{LANGUAGE}',
     'device': -1, # -1 will use cpu
     'norm': True,
-    'dim': 768
+    'dim': 768,
+    'query_cache_size': int(os.getenv('QUERY_CACHE_SIZE', '0')),  # 0 will disable query embedding cache
+    'cache_path': os.getenv('EMBEDDING_CACHE_PATH', None),  # sqlite file to persist doc embeddings, None will disable
+    'batch_tokens': int(os.getenv('EMBEDDING_BATCH_TOKENS', '8192')),  # padded tokens per batch of texts sorted by length, 0 will disable
+    'max_batch_size': int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '128')),
+    'backend': os.getenv('EMBEDDING_BACKEND', 'torch'),  # options: torch, onnx (ONNX Runtime on cpu, exported to onnx_dir on first use)
+    'quantize': os.getenv('EMBEDDING_QUANTIZE', 'True').lower() == 'true',  # int8 dynamic quantization of onnx backend
+    'onnx_dir': os.getenv('EMBEDDING_ONNX_DIR', './onnx_models'),
+    'num_threads': int(os.getenv('EMBEDDING_NUM_THREADS', '0')),  # intra-op threads of onnx backend, 0 for all cores
+    'coalesce': os.getenv('EMBEDDING_COALESCE', 'False').lower() == 'true',  # batch query embeddings of concurrent requests
+    'coalesce_max_batch': int(os.getenv('EMBEDDING_COALESCE_MAX_BATCH', '32')),
+    'coalesce_max_wait': float(os.getenv('EMBEDDING_COALESCE_MAX_WAIT', '0.005'))  # seconds to wait for more queries to batch
 }
 
 
@@ -71,12 +82,27 @@ USE_SCALAR = True if os.getenv('USE_SCALAR', 'False').lower() == 'true' else Fal
 
 # Vector db configs
 VECTORDB_CONFIG = {
+    'backend': os.getenv('VECTOR_BACKEND', 'milvus'),  # options: milvus, local (numpy index saved in data_dir)
+    'data_dir': os.getenv('VECTOR_DATA_DIR', './vector_data'),
+    'ivf_threshold': int(os.getenv('VECTOR_IVF_THRESHOLD', '50000')),  # rows to train an IVF index for local backend
+    'shared_collection': os.getenv('MILVUS_SHARED_COLLECTION', None),  # one collection for all projects, partitioned by project
+    'num_partitions': int(os.getenv('MILVUS_NUM_PARTITIONS', '64')),
+    'auto_tune': os.getenv('VECTOR_AUTO_TUNE', 'False').lower() == 'true',  # tune nprobe/ef per collection for target_recall
+    'auto_index': os.getenv('VECTOR_AUTO_INDEX', 'False').lower() == 'true',  # start with FLAT, warn when an index rebuilt by offline_tools/rebuild_index.py fits size better
+    'target_recall': float(os.getenv('VECTOR_TARGET_RECALL', '0.95')),  # recall@top_k against exhaustive search
+    'tune_sample': 50,  # stored vectors sampled as queries to measure recall
+    'retune_growth': 2.0,  # tune again when entity count grows by this times
+    'flat_threshold': 10000,  # entities below which auto index keeps FLAT
     'connection_args': {
         'uri': os.getenv('ZILLIZ_URI', 'http://localhost:19530'),
         'token': os.getenv('ZILLIZ_TOKEN')
         },
     'top_k': 5,
     'threshold': 0,
+    'pool_size': int(os.getenv('MILVUS_POOL_SIZE', '1')),
+    'health_check_interval': 30,
+    'insert_ack': os.getenv('MILVUS_INSERT_ACK', 'count'),  # count: count inserted pks; flush: flush and count entities
+    'flush_interval': float(os.getenv('MILVUS_FLUSH_INTERVAL', '60')),  # min seconds between background flushes, < 0 to disable
     'index_params': {
         'metric_type': 'IP',
         'index_type': 'IVF_FLAT',
@@ -86,10 +112,27 @@ VECTORDB_CONFIG = {
 
 # Scalar db configs
 SCALARDB_CONFIG = {
+    'backend': os.getenv('SCALAR_BACKEND', 'elasticsearch'),  # options: elasticsearch, bm25 (in-process index saved in data_dir)
+    'data_dir': os.getenv('SCALAR_DATA_DIR', './scalar_data'),
     'connection_args': {
         'hosts': os.getenv('ES_HOSTS', 'http://localhost:9200'),
         },
-    'top_k': 3
+    'top_k': 3,
+    'bulk_chunk_size': int(os.getenv('ES_BULK_CHUNK_SIZE', '500')),  # docs per bulk request
+    'bulk_workers': int(os.getenv('ES_BULK_WORKERS', '4')),  # parallel bulk requests, 1 for streaming bulk with retries
+    'bulk_max_retries': 3,  # retries of docs rejected with 429 in streaming bulk
+    'bm25_k1': 1.2,
+    'bm25_b': 0.75,
+    'max_segments': 8  # segments of in-process bm25 index are merged when exceeding this
+}
+
+# Hybrid search configs to fuse results of vector db & scalar db, only work when USE_SCALAR is True
+HYBRID_CONFIG = {
+    'fusion': 'rrf',  # options: rrf, weighted, append
+    'weights': [1.0, 1.0],  # weights of [vector db, scalar db]
+    'rrf_k': 60,
+    'top_k': None,  # final top k after fusion, None will keep all
+    'max_workers': 8  # threads shared by all projects to search vector db & scalar db concurrently
 }
 
 if os.getenv('ES_CLOUD_ID'):
@@ -102,7 +145,30 @@ if os.getenv('ES_CA_CERTS'):
 
 # Memory db configs
 MEMORYDB_CONFIG = {
-    'connect_str': os.getenv('SQL_URI', 'sqlite:///./sqlite.db')
+    'connect_str': os.getenv('SQL_URI', 'sqlite:///./sqlite.db'),
+    'history_turns': int(os.getenv('HISTORY_TURNS', '10')),  # recent turns passed to chat, 0 for all
+    'history_tokens': int(os.getenv('HISTORY_TOKENS', '0')),  # approximate token budget of recent turns, 0 for no limit
+    'memory_mode': os.getenv('MEMORY_MODE', 'window'),  # options: window, summary (rolling summary + last summary_turns turns)
+    'summary_turns': int(os.getenv('SUMMARY_TURNS', '3')),
+    'summary_tokens': int(os.getenv('SUMMARY_TOKENS', '200')),  # approximate token budget of the summary
+    'cache_sessions': 1024,  # history of recent sessions cached in memory
+    'cache_bytes': 16 * 1024 * 1024,
+    'write_behind': True,  # append history in batches by a background thread
+    'flush_interval': 1,
+    'batch_size': 100,
+    'flush_retries': 3,  # flushes to retry messages failed to write before dropping them
+    'pool_size': int(os.getenv('SQL_POOL_SIZE', '5')),  # connections kept by the engine shared per connect_str
+    'max_overflow': int(os.getenv('SQL_MAX_OVERFLOW', '10')),  # extra connections opened under bursts
+    'pool_recycle': 3600,
+    'pool_pre_ping': True
+}
+
+# Cache configs for store handles & chains reused across requests
+CACHE_CONFIG = {
+    'max_projects': int(os.getenv('CACHE_MAX_PROJECTS', '64')),  # 0 will disable cache
+    'max_sessions': int(os.getenv('CACHE_MAX_SESSIONS', '1024')),
+    'max_pipelines': int(os.getenv('CACHE_MAX_PIPELINES', '8')),  # built towhee pipelines kept in memory
+    'catalog_ttl': float(os.getenv('CACHE_CATALOG_TTL', '30'))  # seconds to trust cached project existence & metadata
 }
 
 
@@ -1,12 +1,15 @@
 import os
+import json
 import argparse
 import uuid
+from typing import List
 
 import uvicorn
 from functools import partial
 from fastapi import FastAPI, UploadFile
+from pydantic import BaseModel
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
 from config import TEMP_DIR
 
@@ -40,10 +43,17 @@ assert (USE_LANGCHAIN and not USE_TOWHEE ) or (USE_TOWHEE and not USE_LANGCHAIN)
     'The service should start with either "--langchain" or "--towhee".'
 
 if USE_LANGCHAIN:
-    from src.langchain.operations import chat, insert, drop, check, get_history, clear_history, count  # pylint: disable=C0413
+    from src.langchain.operations import (  # pylint: disable=C0413
+        chat, achat, astream_chat, abatch_chat, insert, sync, drop, check, get_history, clear_history, count
+    )
     chat = partial(chat, enable_agent=ENABLE_AGENT)
+    achat = partial(achat, enable_agent=ENABLE_AGENT)
+    astream_chat = partial(astream_chat, enable_agent=ENABLE_AGENT)
+    abatch_chat = partial(abatch_chat, enable_agent=ENABLE_AGENT)
 if USE_TOWHEE:
-    from src.towhee.operations import chat, insert, drop, check, get_history, clear_history, count  # pylint: disable=C0413
+    from src.towhee.operations import (  # pylint: disable=C0413
+        chat, achat, astream_chat, abatch_chat, insert, sync, drop, check, get_history, clear_history, count
+    )
 if ENABLE_MONITER:
     from moniter import enable_moniter  # pylint: disable=C0413
     from prometheus_client import generate_latest, REGISTRY  # pylint: disable=C0413
@@ -64,9 +74,9 @@ def check_api():
 
 
 @app.get('/answer')
-def do_answer_api(session_id: str, project: str, question: str):
+async def do_answer_api(session_id: str, project: str, question: str):
     try:
-        new_question, final_answer = chat(session_id=session_id, project=project, question=question)
+        new_question, final_answer = await achat(session_id=session_id, project=project, question=question)
         assert isinstance(final_answer, str)
         return jsonable_encoder({
             'status': True,
@@ -81,6 +91,43 @@ def do_answer_api(session_id: str, project: str, question: str):
         return jsonable_encoder({'status': False, 'msg': f'Failed to answer question:\n{e}', 'code': 400}), 400
 
 
+def format_sse(event: str, data) -> str:
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+@app.get('/answer/stream')
+async def do_answer_stream_api(session_id: str, project: str, question: str):
+    async def event_stream():
+        try:
+            async for event in astream_chat(session_id=session_id, project=project, question=question):
+                yield format_sse(event['event'], event['data'])
+        except Exception as e:  # pylint: disable=W0703
+            yield format_sse('error', f'Failed to answer question:\n{e}')
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+
+class Question(BaseModel):
+    session_id: str
+    project: str
+    question: str
+
+
+@app.post('/answer/batch')
+async def do_answer_batch_api(questions: List[Question]):
+    try:
+        results = await abatch_chat([q.dict() for q in questions])
+        return jsonable_encoder({
+            'status': True,
+            'msg': [
+                {'original question': q.question, 'modified question': new_question, 'answer': final_answer}
+                for q, (new_question, final_answer) in zip(questions, results)
+            ]
+            }), 200
+    except Exception as e:  # pylint: disable=W0703
+        return jsonable_encoder({'status': False, 'msg': f'Failed to answer questions:\n{e}', 'code': 400}), 400
+
+
 @app.post('/project/add')
 def do_project_add_api(project: str, url: str = None, file: UploadFile = None):
     assert url or file, 'You need to upload file or enter url of document to add data.'
@@ -101,6 +148,24 @@ def do_project_add_api(project: str, url: str = None, file: UploadFile = None):
         return jsonable_encoder({'status': False, 'msg': f'Failed to load data:\n{e}'}), 400
 
 
+@app.post('/project/sync')
+def do_project_sync_api(project: str, url: str = None, file: UploadFile = None):
+    assert url or file, 'You need to upload file or enter url of document to sync data.'
+    try:
+        changes = []
+        if url:
+            changes.append(sync(data_src=url, project=project, source_type='url'))
+        if file:
+            temp_file = os.path.join(TEMP_DIR, file.filename)
+            with open(temp_file, 'wb') as f:
+                content = file.file.read()
+                f.write(content)
+            changes.append(sync(data_src=temp_file, project=project, source_type='file'))
+        return jsonable_encoder({'status': True, 'msg': changes}), 200
+    except Exception as e:  # pylint: disable=W0703
+        return jsonable_encoder({'status': False, 'msg': f'Failed to sync data:\n{e}'}), 400
+
+
 @app.post('/project/drop')
 def do_project_drop_api(project: str):
     # Drop data in vector db
@@ -130,9 +195,9 @@ def do_project_count_api(project: str):
 
 
 @app.get('/history/get')
-def do_history_get_api(project: str, session_id: str = None):
+def do_history_get_api(project: str, session_id: str = None, limit: int = None, offset: int = 0):
     try:
-        history = get_history(project=project, session_id=session_id)
+        history = get_history(project=project, session_id=session_id, limit=limit, offset=offset)
         return jsonable_encoder({'status': True, 'msg': history}), 200
     except Exception as e:  # pylint: disable=W0703
         return jsonable_encoder({'status': False, 'msg': f'Failed to get history:\n{e}'}), 400
@@ -8,9 +8,9 @@ import time
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from src.langchain.embedding import TextEncoder  # pylint: disable=C0413
-from offline_tools.generator_questions import get_output_csv  # pylint: disable=C0413
 from offline_tools.utils.stackoverflow_json2csv import stackoverflow_json2csv  # pylint: disable=C0413
 from offline_tools.utils.load_npy import langchain_load  # pylint: disable=C0413
+from offline_tools.utils.embedding_pool import EmbeddingPool  # pylint: disable=C0413
 
 
 def split_df_by_row(df, n):
@@ -31,23 +31,29 @@ def get_named_col_names(df):
     return named_col_names
 
 
-def get_embedding_array(df, enable_qa=True, batch_size=64):
-    encoder = TextEncoder()
+def get_embedding_array(df, enable_qa=True, batch_size=64, cache_path=None, chunk_size=10000, workers=1):
+    # Texts are batched by token length inside the encoder, batch_size limits texts per forward pass
+    encoder_kwargs = {'max_batch_size': batch_size}
+    if cache_path:
+        encoder_kwargs['cache_path'] = cache_path
     original_col = get_named_col_names(df)
     print('original_col = ', original_col)
-    q_list = []
     embeddings = []
     t1 = time.time()
     if enable_qa:
         emb_col = 'question'
     else:
         emb_col = 'doc_chunk'
-    for i, question in enumerate(tqdm(df[emb_col])):
-        q_list.append(question)
-        if (i + 1) % batch_size == 0 or i == len(df) - 1:
-            batch_embeddings = encoder.embed_documents(q_list)
-            embeddings.extend(batch_embeddings)
-            q_list = []
+    texts = df[emb_col].tolist()
+    if workers > 1:
+        worker_chunk = min(chunk_size, max(1, len(texts) // (workers * 4)))
+        with EmbeddingPool(workers, chunk_size=worker_chunk, **encoder_kwargs) as pool:
+            for batch_embeddings in tqdm(pool.imap(texts), total=int(np.ceil(len(texts) / worker_chunk))):
+                embeddings.extend(batch_embeddings)
+    else:
+        encoder = TextEncoder(**encoder_kwargs)
+        for i in tqdm(range(0, len(texts), chunk_size)):
+            embeddings.extend(encoder.embed_documents_array(texts[i:i + chunk_size]))
     t2 = time.time()
     print('time = ', t2 - t1)
     df['embedding'] = embeddings
@@ -57,7 +63,7 @@ def get_embedding_array(df, enable_qa=True, batch_size=64):
     return embeddings_array
 
 
-def save_embedding(csv_file, enable_qa=True, batch_size=64):
+def save_embedding(csv_file, enable_qa=True, batch_size=64, cache_path=None, workers=1):
     if '|' in os.path.basename(csv_file):
         dst_csv_path = os.path.join(os.path.dirname(
             csv_file), os.path.basename(csv_file).replace('|', '-'))
@@ -69,21 +75,21 @@ def save_embedding(csv_file, enable_qa=True, batch_size=64):
     if 'like' in df.columns:
         df = df.drop(labels='like', axis=1)
     embedding_array = get_embedding_array(
-        df, enable_qa=enable_qa, batch_size=batch_size)
+        df, enable_qa=enable_qa, batch_size=batch_size, cache_path=cache_path, workers=workers)
     output_npy_path = f'{csv_file[:-4]}_embedding.npy'
     np.save(output_npy_path, embedding_array)
     print('combined_array.shape = ', embedding_array.shape)
     return output_npy_path
 
 
-def embed_questions(csv_path, enable_qa=True, batch_size=64):
+def embed_questions(csv_path, enable_qa=True, batch_size=64, cache_path=None, workers=1):
     npy_path = f'{csv_path[:-4]}_embedding.npy'
     if os.path.exists(npy_path):
         print('exist...')
         return npy_path
     try:
         npy_path = save_embedding(
-            csv_path, enable_qa=enable_qa, batch_size=batch_size)
+            csv_path, enable_qa=enable_qa, batch_size=batch_size, cache_path=cache_path, workers=workers)
         return npy_path
     except Exception as e:  # pylint: disable=W0703
         print('save_embedding failed. ', e)
@@ -91,11 +97,13 @@ def embed_questions(csv_path, enable_qa=True, batch_size=64):
 
 
 def run_loading(project_root_or_file, project_name, mode, url_domain=None, emb_batch_size=64, load_batch_size=256,
-                enable_qa=True, qa_num_parallel=8, platform='towhee'):
+                enable_qa=True, qa_num_parallel=8, platform='towhee', embedding_cache=None, embedding_workers=1):
     is_root = os.path.exists(
         project_root_or_file) and os.path.isdir(project_root_or_file)
     if mode != 'custom' and not is_root:
         raise Exception('`project_root_or_file` must be a directory.')
+    # Question generator needs its LLM config only when docs are loaded from projects
+    from offline_tools.generator_questions import get_output_csv  # pylint: disable=C0415
     if mode == 'project':
         if url_domain is None:
             url_domain = os.path.basename(project_root_or_file)
@@ -114,7 +122,7 @@ def run_loading(project_root_or_file, project_name, mode, url_domain=None, emb_b
     #
     # # output_csv: 'file_or_repo', 'question', 'doc_chunk', 'url', 'embedding'
     output_npy = embed_questions(
-        output_csv, enable_qa=enable_qa, batch_size=emb_batch_size)
+        output_csv, enable_qa=enable_qa, batch_size=emb_batch_size, cache_path=embedding_cache, workers=embedding_workers)
     print(f'finish embed_questions, output_npy =\n{output_npy}')
 
     if platform == 'langchain':
@@ -152,7 +160,7 @@ When mode == 'stackoverflow', `project_root_or_file` can be a project folder con
 When the mode is github, there is no need to specify the url, the url path is the url of your github repo.
 When the mode is stackoverflow, there is no need to specify the url, because the url can be obtained in the answer json.''')
     parser.add_argument('--emb_batch_size', type=int, required=False, default=64,
-                        help='Batch size when extracting embedding.')
+                        help='Max number of texts per batch when extracting embedding, texts are batched by token length.')
     parser.add_argument('--load_batch_size', type=int, required=False, default=256,
                         help='Batch size when loading to vector db.')
     parser.add_argument('--enable_qa', type=int, required=False, default=1,
@@ -162,16 +170,19 @@ When the mode is stackoverflow, there is no need to specify the url, because the
                         help='The number of concurrent request when generating problems. \
                             If your openai account does not support high request rates, I suggest you set this value very small, such as 1, \
                                 else you can use a higher num such as 8, or 16. When the mode is stackoverflow, no need to specify it.')
-    # parser.add_argument("--embedding_devices", type=str, default='0,1', required=False)
+    parser.add_argument('--embedding_cache', type=str, required=False, default=None,
+                        help='SQLite file to persist chunk embeddings, so unchanged chunks are not re-embedded next time.')
+    parser.add_argument('--embedding_workers', type=int, required=False, default=1,
+                        help='Number of processes to extract embedding, each loads the model once and uses cpu_count / workers threads.')
     args = parser.parse_args()
 
     test_enable_qa = bool(args.enable_qa == 0)
     t0 = time.time()
     if args.project_root_or_file.endswith('/'):
         args.project_root_or_file = args.project_root_or_file[:-1]
-    # embedding_devices = [int(device_id) for device_id in args.embedding_devices.split(',')]
     run_loading(args.project_root_or_file, args.project_name, args.mode, args.url_domain, args.emb_batch_size,
-                args.load_batch_size, test_enable_qa, args.qa_num_parallel, args.platform)
+                args.load_batch_size, test_enable_qa, args.qa_num_parallel, args.platform, args.embedding_cache,
+                args.embedding_workers)
     test_t1 = time.time()
     total_sec = test_t1 - t0
     print(f'total time = {total_sec} (s) = {total_sec / 3600} (h).')
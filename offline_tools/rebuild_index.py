@@ -0,0 +1,43 @@
+import sys
+import os
+import json
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def rebuild_index(project_name, platform='towhee', index_params=None):
+    '''Rebuild the index of the project collection with index_params, or the one recommended for its size.
+    Searches of the collection fail while building, so run it when the project is not served.'''
+    if platform == 'langchain':
+        from src.langchain.store.vector_store.milvus import VectorStore  # pylint: disable=C0415
+
+        store = VectorStore(table_name=project_name)
+        res = store.rebuild_index(index_params)
+        print('tuned search params:', res)
+    elif platform == 'towhee':
+        from src.towhee.pipelines import TowheePipelines  # pylint: disable=C0415
+
+        index_params = TowheePipelines().rebuild_index(project_name, index_params)
+        print('index params:', index_params)
+    print('finish rebuild_index')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--platform', type=str, default='towhee', choices=['towhee', 'langchain'],
+                        help='It is your option of platform to build the system.')
+    parser.add_argument('--project_name', type=str, required=True,
+                        help='It is your project name. It is also the collection_name in the vector database. \
+                            With a shared collection, the index of the shared collection is rebuilt for all projects.')
+    parser.add_argument('--index_params', type=str, required=False, default=None,
+                        help='Index params in json, eg. \'{"metric_type": "IP", "index_type": "IVF_FLAT", "params": {"nlist": 1024}}\'. \
+                            If not given, FLAT or IVF_FLAT is chosen by the collection size.')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    rebuild_index(args.project_name, args.platform, json.loads(args.index_params) if args.index_params else None)
+    total_sec = time.time() - t0
+    print(f'total time = {total_sec} (s).')
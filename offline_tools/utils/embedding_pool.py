@@ -0,0 +1,82 @@
+import os
+import sys
+import multiprocessing
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from src.langchain.embedding import TextEncoder  # pylint: disable=C0413
+
+
+# Text encoder loaded once in each worker process
+encoder = None
+
+
+def _init_worker(num_threads: int, encoder_cls: type, encoder_kwargs: dict):
+    global encoder  # pylint: disable=W0603
+    # Pin intra-op threads, so workers do not oversubscribe cores
+    try:
+        import torch  # pylint: disable=C0415
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+    encoder = encoder_cls(**encoder_kwargs)
+
+
+def _embed(texts: List[str]) -> np.ndarray:
+    return encoder.embed_documents_array(texts)
+
+
+class EmbeddingPool:
+    '''Embed texts with a pool of worker processes, each loads the text encoder once.
+
+    Texts are fed to workers in chunks as they free up, and embeddings of chunks come back in input order.
+    Workers are spawned instead of forked, as forking a process with torch threads running can hang.
+    '''
+
+    def __init__(
+            self,
+            workers: int,
+            num_threads: Optional[int] = None,
+            chunk_size: int = 1024,
+            encoder_cls: type = TextEncoder,
+            **encoder_kwargs
+            ):
+        self.workers = workers
+        self.num_threads = num_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.chunk_size = chunk_size
+        ctx = multiprocessing.get_context('spawn')
+        self.pool = ctx.Pool(workers, initializer=_init_worker, initargs=(self.num_threads, encoder_cls, encoder_kwargs))
+
+    def _chunks(self, texts: Iterable[str]) -> Iterator[List[str]]:
+        chunk = []
+        for text in texts:
+            chunk.append(text)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def imap(self, texts: Iterable[str]) -> Iterator[np.ndarray]:
+        '''Yield embedding arrays of texts chunk by chunk, in the order of texts.'''
+        return self.pool.imap(_embed, self._chunks(texts))
+
+    def embed(self, texts: Iterable[str]) -> np.ndarray:
+        '''Embed all texts into one float32 array.'''
+        arrays = list(self.imap(texts))
+        if not arrays:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(arrays)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,129 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    '''Thread-safe LRU cache bounded by item count, with hit/miss counters.
+
+    on_evict will be called with (key, value) for every entry pushed out by the size bound.
+    If ttl (seconds) is given, entries older than ttl are treated as missing.
+    If maxweight is given, entries are also evicted until the total weigh(value) is no more than maxweight.
+    '''
+
+    def __init__(
+            self,
+            maxsize: int = 128,
+            on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+            ttl: Optional[float] = None,
+            maxweight: Optional[int] = None,
+            weigh: Callable[[Any], int] = len
+            ):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._expires = {}
+        self._weights = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self._expire(key)
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        evicted = []
+        with self._lock:
+            self._remove(key)
+            self._data[key] = value
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            if self.maxweight is not None:
+                self._weights[key] = self.weigh(value)
+                self.weight += self._weights[key]
+            while len(self._data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+                old_key = next(iter(self._data))
+                evicted.append((old_key, self._remove(old_key)))
+        self._evict(evicted)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        '''Return the cached value or build one with factory.
+        The factory runs outside of the lock, so concurrent misses may build twice but only one value is kept.'''
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+        value = factory()
+        if self.maxsize <= 0:
+            return value
+        with self._lock:
+            self._expire(key)
+            if key in self._data:
+                return self._data[key]
+        self.put(key, value)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def pop_if(self, predicate: Callable[[Hashable], bool]) -> list:
+        '''Remove all entries whose key matches predicate, return removed (key, value) pairs.'''
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            return [(k, self._remove(k)) for k in keys]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize,
+                'weight': self.weight, 'maxweight': self.maxweight
+            }
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            self._expire(key)
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def _expire(self, key: Hashable):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+
+    def _remove(self, key: Hashable) -> Any:
+        self._expires.pop(key, None)
+        self.weight -= self._weights.pop(key, 0)
+        return self._data.pop(key, None)
+
+    def _evict(self, items: list):
+        if self.on_evict:
+            for key, value in items:
+                self.on_evict(key, value)
@@ -0,0 +1,57 @@
+import os
+import sys
+import threading
+from typing import Any, Callable, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import CACHE_CONFIG  # pylint: disable=C0413
+from src.cache import LRUCache  # pylint: disable=C0413
+
+
+class ProjectCatalog:
+    '''Cache of project metadata, eg. existence of doc store & memory, schema, dim, index type & params.
+
+    Operations update it explicitly when they create, insert into or drop a project,
+    and entries expire after ttl seconds since created to pick up changes made outside of this process.
+    '''
+
+    def __init__(self, maxsize: int = CACHE_CONFIG.get('max_projects', 64), ttl: float = CACHE_CONFIG.get('catalog_ttl', 30)):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        # Entries are updated in place, guarded by the lock
+        self._lock = threading.Lock()
+
+    def get(self, project: str, field: str, loader: Optional[Callable[[], Any]] = None) -> Any:
+        '''Get a field of the project, load and cache it by loader if missing.
+        The loader runs outside of the lock, so its value is dropped if the field is set meanwhile, eg. by drop.'''
+        with self._lock:
+            entry = self._cache.get(project, {})
+            if field in entry or loader is None:
+                return entry.get(field)
+        value = loader()
+        return self.update(project, only_missing=True, **{field: value}).get(field, value)
+
+    def update(self, project: str, only_missing: bool = False, **fields) -> dict:
+        '''Set fields of the project atomically, or only the missing ones if only_missing.
+        Updating an entry does not extend its expiry. Return a copy of the entry.'''
+        with self._lock:
+            entry = self._cache.get(project)
+            if entry is None:
+                entry = dict(fields)
+                self._cache.put(project, entry)
+            else:
+                for key, value in fields.items():
+                    if not only_missing or key not in entry:
+                        entry[key] = value
+            return dict(entry)
+
+    def invalidate(self, project: Optional[str] = None):
+        '''Remove cached metadata of the project, or of all projects if project is None.'''
+        if project is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(project)
+
+
+# Shared by operations and stores in process
+catalog = ProjectCatalog()
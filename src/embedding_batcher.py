@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import TEXTENCODER_CONFIG  # pylint: disable=C0413
+
+
+logger = logging.getLogger('embedding_batcher')
+
+COALESCE = TEXTENCODER_CONFIG.get('coalesce', False)
+MAX_BATCH_SIZE = TEXTENCODER_CONFIG.get('coalesce_max_batch', 32)
+MAX_WAIT = TEXTENCODER_CONFIG.get('coalesce_max_wait', 0.005)
+
+
+class EmbeddingBatcher:
+    '''Coalesce texts submitted by concurrent callers into batched forward passes.
+
+    A background thread takes the first waiting text, then collects more for up to max_wait seconds
+    or until max_batch_size texts, and embeds them in one call of embed_batch.
+    Each caller gets a future of its own embedding. It can be called with a text as a Towhee operator.
+    '''
+
+    def __init__(
+            self,
+            embed_batch: Callable[[List[str]], np.ndarray],
+            max_batch_size: int = MAX_BATCH_SIZE,
+            max_wait: float = MAX_WAIT
+            ):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._batches = 0
+        self._requests = 0
+
+    def submit(self, text: str) -> Future:
+        '''Queue text to embed, return a future of its embedding.'''
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Embedding batcher is closed.')
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='embedding_batcher', daemon=True)
+                self._thread.start()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def __call__(self, text: str) -> np.ndarray:
+        return self.embed(text)
+
+    def __deepcopy__(self, memo):
+        # Shared by copies of configs holding it as an operator
+        return self
+
+    def _collect(self) -> Optional[list]:
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Embed what is collected, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embeds = self.embed_batch([text for text, _ in batch])
+                for (_, future), embed in zip(batch, embeds):
+                    future.set_result(embed)
+            except Exception as e:  # pylint: disable=W0703
+                logger.error('Failed to embed a batch of %s texts:\n%s', len(batch), e)
+                for _, future in batch:
+                    future.set_exception(e)
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+
+    def close(self):
+        '''Embed texts already queued, then stop the background thread.'''
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'batches': self._batches,
+                'requests': self._requests,
+                'mean_batch_size': self._requests / self._batches if self._batches else 0.0
+            }
+
+
+batchers: Dict[str, EmbeddingBatcher] = {}
+batchers_lock = threading.Lock()
+
+
+def get_batcher(name: str, make_embed_batch: Callable[[], Callable[[List[str]], np.ndarray]], **kwargs) -> EmbeddingBatcher:
+    '''Get the batcher of name shared in process, make_embed_batch is called once to load the model on creation.'''
+    with batchers_lock:
+        if name not in batchers:
+            batchers[name] = EmbeddingBatcher(make_embed_batch(), **kwargs)
+        return batchers[name]
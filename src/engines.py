@@ -0,0 +1,45 @@
+import os
+import sys
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import MEMORYDB_CONFIG  # pylint: disable=C0413
+
+
+POOL_CONFIG = {
+    'pool_size': MEMORYDB_CONFIG.get('pool_size', 5),
+    'max_overflow': MEMORYDB_CONFIG.get('max_overflow', 10),
+    'pool_recycle': MEMORYDB_CONFIG.get('pool_recycle', 3600),
+    'pool_pre_ping': MEMORYDB_CONFIG.get('pool_pre_ping', True)
+}
+
+engines = {}
+lock = threading.Lock()
+
+
+def get_engine(connect_str: str) -> Engine:
+    '''Get the pooled SQLAlchemy engine shared by all stores using the same connection string.'''
+    engine = engines.get(connect_str)
+    if engine is None:
+        with lock:
+            engine = engines.get(connect_str)
+            if engine is None:
+                kwargs = {}
+                # SQLite pools connections per thread or file, sizes are only for client/server databases
+                if make_url(connect_str).get_backend_name() != 'sqlite':
+                    kwargs = POOL_CONFIG
+                engine = create_engine(connect_str, echo=False, **kwargs)
+                engines[connect_str] = engine
+    return engine
+
+
+def dispose_engines():
+    '''Close connections of all shared engines.'''
+    with lock:
+        for engine in engines.values():
+            engine.dispose()
+        engines.clear()
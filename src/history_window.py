@@ -0,0 +1,28 @@
+from typing import Callable, List, Optional, TypeVar
+
+
+T = TypeVar('T')
+
+
+def window_size(max_turns: Optional[int]) -> Optional[int]:
+    '''Number of messages in the last max_turns turns, each turn has a question and an answer.'''
+    return 2 * max_turns if max_turns else None
+
+
+def count_tokens(text: str) -> int:
+    '''Approximate token count by words, without loading a tokenizer for every turn.'''
+    return len(text.split())
+
+
+def trim_by_tokens(items: List[T], max_tokens: Optional[int], get_text: Callable[[T], str]) -> List[T]:
+    '''Drop the oldest items (messages or turns) until the rest have no more than max_tokens tokens in texts by get_text.'''
+    if not max_tokens:
+        return items
+    total = 0
+    start = len(items)
+    while start > 0:
+        total += count_tokens(get_text(items[start - 1]))
+        if total > max_tokens:
+            break
+        start -= 1
+    return items[start:]
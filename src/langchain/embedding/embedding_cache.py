@@ -0,0 +1,63 @@
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List
+
+import numpy
+
+
+class EmbeddingCache:
+    '''Disk-backed embedding store using SQLite, keyed by hash of (text, model, norm).
+    Embeddings are saved as float32 bytes, so unchanged chunks can skip the model when re-ingested.
+    The file is opened in WAL mode with a busy timeout, so processes embedding in parallel can share it.'''
+
+    def __init__(self, path: str, batch_size: int = 500, timeout: float = 60):
+        self.path = path
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL)')
+
+    @staticmethod
+    def make_key(text: str, model: str, norm: bool) -> str:
+        return hashlib.sha256(json.dumps([model, bool(norm), text]).encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, numpy.ndarray]:
+        '''Return embeddings found in cache by keys.'''
+        res = {}
+        keys = list(set(keys))
+        conn = self._connect()
+        for i in range(0, len(keys), self.batch_size):
+            batch = keys[i: i + self.batch_size]
+            query = f'SELECT key, embedding FROM embeddings WHERE key IN ({",".join("?" * len(batch))})'
+            for key, blob in conn.execute(query, batch):
+                res[key] = numpy.frombuffer(blob, dtype=numpy.float32)
+        return res
+
+    def put_many(self, items: Dict[str, List[float]]):
+        '''Save embeddings by keys.'''
+        rows = [(k, numpy.asarray(v, dtype=numpy.float32).tobytes()) for k, v in items.items()]
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)', rows)
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def close(self):
+        '''Close the connection of current thread.'''
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections can not be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            # Readers do not block the writer, and concurrent writers wait for the lock instead of failing
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
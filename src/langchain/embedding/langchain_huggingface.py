@@ -1,37 +1,214 @@
 import sys
 import os
-from typing import List
+from concurrent.futures import Future
+from functools import partial
+from typing import Any, List, Optional
 import numpy
 
+from pydantic import PrivateAttr
 from langchain.embeddings.base import Embeddings
 from langchain.embeddings import HuggingFaceEmbeddings
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
 
 from config import TEXTENCODER_CONFIG  # pylint: disable=C0413
+from src.cache import LRUCache  # pylint: disable=C0413
+from src.embedding_batcher import EmbeddingBatcher, COALESCE  # pylint: disable=C0413
+from src.langchain.embedding.embedding_cache import EmbeddingCache  # pylint: disable=C0413
 
 MODEL = TEXTENCODER_CONFIG.get('model', 'multi-qa-mpnet-base-cos-v1')
 NORM = TEXTENCODER_CONFIG.get('norm', False)
+QUERY_CACHE_SIZE = TEXTENCODER_CONFIG.get('query_cache_size', 0)
+CACHE_PATH = TEXTENCODER_CONFIG.get('cache_path', None)
+BATCH_TOKENS = TEXTENCODER_CONFIG.get('batch_tokens', 0)
+MAX_BATCH_SIZE = TEXTENCODER_CONFIG.get('max_batch_size', 32)
+BACKEND = TEXTENCODER_CONFIG.get('backend', 'torch')
+QUANTIZE = TEXTENCODER_CONFIG.get('quantize', True)
+
+
+def normalize(embeds: numpy.ndarray) -> numpy.ndarray:
+    '''L2 normalize rows of embeddings in place, rows of zeros are kept as they are.'''
+    norms = numpy.linalg.norm(embeds, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    embeds /= norms
+    return embeds
+
+
+def token_batches(lengths: List[int], max_tokens: int, max_batch_size: int) -> List[List[int]]:
+    '''Group indices of texts by token length, so each batch pads to at most max_tokens tokens in total.
+
+    Texts are sorted by length in descending order, then cut into batches whose size times the length of
+    the first (longest) text stays within max_tokens, and no more than max_batch_size texts.
+    A text longer than max_tokens gets a batch of its own.
+    '''
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * lengths[batch[0]] > max_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
 
 
 class TextEncoder(HuggingFaceEmbeddings):
     '''Text encoder converts text input(s) into embedding(s)'''
+    query_cache_size: int = QUERY_CACHE_SIZE
+    cache_path: Optional[str] = CACHE_PATH
+    batch_tokens: int = BATCH_TOKENS
+    max_batch_size: int = MAX_BATCH_SIZE
+    backend: str = BACKEND
+    quantize: bool = QUANTIZE
+    coalesce: bool = COALESCE
+    _onnx: Any = PrivateAttr(default=None)
+    _batchers: dict = PrivateAttr(default_factory=dict)
+    _query_cache: LRUCache = PrivateAttr()
+    _embedding_cache: Optional[EmbeddingCache] = PrivateAttr(default=None)
 
     def __init__(self, *args, **kwargs):
         assert isinstance(
             self, Embeddings), 'Invalid text encoder. Only accept LangChain embeddings.'
         kwargs['model_name'] = kwargs.get('model_name', MODEL)
-        super().__init__(*args, **kwargs)
+        if kwargs.get('backend', BACKEND) == 'onnx':
+            # Skip loading the torch model by HuggingFaceEmbeddings
+            super(HuggingFaceEmbeddings, self).__init__(*args, **kwargs)  # pylint: disable=E1003
+            from src.onnx_embedding import get_encoder  # pylint: disable=C0415
+            self._onnx = get_encoder(self.model_name, quantize=self.quantize)
+        else:
+            super().__init__(*args, **kwargs)
+        self._query_cache = LRUCache(maxsize=self.query_cache_size)
+        if self.cache_path:
+            self._embedding_cache = EmbeddingCache(self.cache_path)
+
+    @property
+    def model_tag(self) -> str:
+        '''Model name with the backend, as embeddings of ONNX int8 models differ slightly from the fp32 model.'''
+        if self._onnx is None:
+            return self.model_name
+        return f'{self.model_name}@onnx' + ('-int8' if self.quantize else '')
 
     def embed_documents(self, texts: List[str], norm: bool = NORM) -> List[List[float]]:
-        embeds = super().embed_documents(texts)
+        return self.embed_documents_array(texts, norm=norm).tolist()
+
+    def embed_documents_array(self, texts: List[str], norm: bool = NORM) -> numpy.ndarray:
+        '''Embed texts into a contiguous float32 array of shape (len(texts), dim).'''
+        if self._embedding_cache is None:
+            return self._embed_documents(texts, norm=norm)
+
+        keys = [EmbeddingCache.make_key(text, self.model_tag, norm) for text in texts]
+        cached = self._embedding_cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing[key] = text
+        if missing:
+            embeds = self._embed_documents(list(missing.values()), norm=norm)
+            new = dict(zip(missing.keys(), embeds))
+            self._embedding_cache.put_many(new)
+            cached.update(new)
+        if len(keys) == 0:
+            return numpy.empty((0, 0), dtype=numpy.float32)
+        return numpy.stack([cached[key] for key in keys]).astype(numpy.float32, copy=False)
+
+    def _embed_documents(self, texts: List[str], norm: bool = NORM) -> numpy.ndarray:
+        embeds = self._encode([x.replace('\n', ' ') for x in texts])
         if norm:
-            embeds = [(x / numpy.linalg.norm(x)).tolist() for x in embeds]
+            embeds = normalize(embeds)
         return embeds
 
+    def _encode(self, texts: List[str]) -> numpy.ndarray:
+        '''Same as HuggingFaceEmbeddings.embed_documents, but keep the numpy output of sentence transformers.'''
+        if len(texts) == 0:
+            return numpy.empty((0, 0), dtype=numpy.float32)
+        if self._onnx is not None:
+            embeds = self._encode_batches(texts) if self.batch_tokens > 0 else self._onnx.encode(texts, self.max_batch_size)
+        elif self.multi_process:
+            import sentence_transformers  # pylint: disable=C0415
+            pool = self.client.start_multi_process_pool()
+            embeds = self.client.encode_multi_process(texts, pool)
+            sentence_transformers.SentenceTransformer.stop_multi_process_pool(pool)
+        elif self.batch_tokens > 0 and len(texts) > 1:
+            embeds = self._encode_batches(texts)
+        else:
+            embeds = self.client.encode(texts, **self.encode_kwargs)
+        return numpy.ascontiguousarray(embeds, dtype=numpy.float32)
+
+    def _encode_batches(self, texts: List[str]) -> numpy.ndarray:
+        '''Encode texts in batches of similar token lengths sized by batch_tokens, then restore the input order.'''
+        embeds = None
+        for batch in token_batches(self._token_lengths(texts), self.batch_tokens, self.max_batch_size):
+            batch_texts = [texts[i] for i in batch]
+            if self._onnx is not None:
+                res = self._onnx.encode(batch_texts, batch_size=len(batch))
+            else:
+                kwargs = {**self.encode_kwargs, 'batch_size': len(batch), 'show_progress_bar': False}
+                res = numpy.asarray(self.client.encode(batch_texts, **kwargs), dtype=numpy.float32)
+            if embeds is None:
+                embeds = numpy.empty((len(texts), res.shape[1]), dtype=numpy.float32)
+            embeds[batch] = res
+        return embeds
+
+    def _token_lengths(self, texts: List[str]) -> List[int]:
+        '''Token lengths of texts truncated by the model, including special tokens.'''
+        if self._onnx is not None:
+            max_length = self._onnx.max_length
+            tokenizer = self._onnx.tokenizer
+        else:
+            max_length = getattr(self.client, 'max_seq_length', None) or 512
+            tokenizer = getattr(self.client, 'tokenizer', None)
+        if tokenizer is None:
+            return [min(len(x.split()) + 2, max_length) for x in texts]
+        input_ids = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=max_length)['input_ids']
+        return [len(x) for x in input_ids]
+
     def embed_query(self, text: str, norm: bool = NORM) -> List[float]:
-        embed = super().embed_query(text)
-        if norm:
-            embed /= numpy.linalg.norm(embed)
-            embed = embed.tolist()
-        return embed
+        if self.query_cache_size <= 0:
+            return self._embed_query(text, norm=norm)
+        key = (self.model_tag, norm, ' '.join(text.split()))
+        embed = self._query_cache.get(key)
+        if embed is None:
+            embed = self._embed_query(text, norm=norm)
+            self._query_cache.put(key, embed)
+        return list(embed)
+
+    def embed_queries(self, texts: List[str], norm: bool = NORM) -> List[List[float]]:
+        '''Embed a batch of queries in one pass. Like embed_query, they go through the query cache
+        and are kept out of the persistent doc embedding cache.'''
+        keys = [(self.model_tag, norm, ' '.join(text.split())) for text in texts]
+        embeds = {}
+        if self.query_cache_size > 0:
+            for key in keys:
+                embed = self._query_cache.get(key)
+                if embed is not None:
+                    embeds[key] = embed
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in embeds:
+                missing.setdefault(key, text)
+        if missing:
+            for key, embed in zip(missing, self._embed_documents(list(missing.values()), norm=norm).tolist()):
+                embeds[key] = embed
+                if self.query_cache_size > 0:
+                    self._query_cache.put(key, embed)
+        return [list(embeds[key]) for key in keys]
+
+    def query_cache_info(self) -> dict:
+        '''Hits, misses & size of the query embedding cache.'''
+        return self._query_cache.stats()
+
+    def embed_query_future(self, text: str, norm: bool = NORM) -> Future:
+        '''Embed the query in one forward pass with queries of concurrent callers, return a future of its float32 embedding.'''
+        batcher = self._batchers.get(norm)
+        if batcher is None:
+            batcher = self._batchers.setdefault(norm, EmbeddingBatcher(partial(self._embed_documents, norm=norm)))
+        return batcher.submit(text)
+
+    def _embed_query(self, text: str, norm: bool = NORM) -> List[float]:
+        if self.coalesce:
+            return self.embed_query_future(text, norm=norm).result().tolist()
+        # Keep queries out of the persistent doc embedding cache
+        return self._embed_documents([text], norm=norm)[0].tolist()
@@ -1,6 +1,7 @@
 from typing import List
 import sys
 import os
+import numpy
 
 from langchain.embeddings.base import Embeddings
 from langchain.embeddings import OpenAIEmbeddings
@@ -23,16 +24,23 @@ class TextEncoder(OpenAIEmbeddings):
         super().__init__(*args, **kwargs)
 
     def embed_documents(self, texts: List[str], norm: bool = NORM, chunk_size: int = 1000) -> List[List[float]]:
-        embeds = super().embed_documents(texts, chunk_size=chunk_size)
-        if norm:
-            import numpy  # pylint: disable=C0415
-            embeds = [(x / numpy.linalg.norm(x)).tolist() for x in embeds]
+        return self.embed_documents_array(texts, norm=norm, chunk_size=chunk_size).tolist()
+
+    def embed_documents_array(self, texts: List[str], norm: bool = NORM, chunk_size: int = 1000) -> numpy.ndarray:
+        '''Embed texts into a contiguous float32 array of shape (len(texts), dim).'''
+        embeds = numpy.asarray(super().embed_documents(texts, chunk_size=chunk_size), dtype=numpy.float32)
+        if norm and len(embeds) > 0:
+            norms = numpy.linalg.norm(embeds, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            embeds /= norms
         return embeds
 
     def embed_query(self, text: str, norm: bool = NORM) -> List[float]:
         embed = super().embed_query(text)
         if norm:
-            import numpy  # pylint: disable=C0415
-            embed /= numpy.linalg.norm(embed)
-            embed = embed.tolist()
-        return embed
+            embed = (numpy.asarray(embed) / numpy.linalg.norm(embed)).tolist()
+        return list(embed)
+
+    def embed_queries(self, texts: List[str], norm: bool = NORM) -> List[List[float]]:
+        '''Embed a batch of queries in one request.'''
+        return self.embed_documents(texts, norm=norm)
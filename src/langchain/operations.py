@@ -1,36 +1,81 @@
 import os
 import sys
+import asyncio
 import logging
+from functools import partial
 from typing import List
 
 from langchain.agents import Tool, AgentExecutor
+from langchain.callbacks.base import AsyncCallbackHandler
 from langchain.chains import ConversationalRetrievalChain
 
 sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
 from agent import ChatAgent  # pylint: disable=C0413
 from llm import ChatLLM  # pylint: disable=C0413
 from embedding import TextEncoder  # pylint: disable=C0413
 from store import MemoryStore, DocStore  # pylint: disable=C0413
 from data_loader import DataParser  # pylint: disable=C0413
+from config import CACHE_CONFIG, MEMORYDB_CONFIG  # pylint: disable=C0413
+from src.cache import LRUCache  # pylint: disable=C0413
+from src.catalog import catalog  # pylint: disable=C0413
+from src.manifest import Manifest  # pylint: disable=C0413
+from src.summary import ConversationSummary  # pylint: disable=C0413
 
 logger = logging.getLogger(__name__)
 
+MEMORY_MODE = MEMORYDB_CONFIG.get('memory_mode', 'window')
+SUMMARY_TURNS = MEMORYDB_CONFIG.get('summary_turns', 3)
+
 encoder = TextEncoder()
 chat_llm = ChatLLM()
 load_data = DataParser()
+manifest = Manifest()
+summaries = ConversationSummary(summarize=chat_llm.predict) if MEMORY_MODE == 'summary' else None
 
+# Store handles & chain templates reused across requests, invalidated by insert & drop
+doc_stores = LRUCache(maxsize=CACHE_CONFIG.get('max_projects', 64))
+chain_templates = LRUCache(maxsize=CACHE_CONFIG.get('max_projects', 64))
+memory_stores = LRUCache(maxsize=CACHE_CONFIG.get('max_sessions', 1024))
+
+
+def get_doc_store(project):
+    '''Get doc store of the project. It is cached only if the project table already exists.'''
+    doc_db = doc_stores.get(project)
+    if doc_db is None:
+        doc_db = DocStore(table_name=project, embedding_func=encoder)
+        if doc_db.vector_db.exists:
+            doc_stores.put(project, doc_db)
+            catalog.update(project, store=True, **doc_db.vector_db.describe())
+    return doc_db
+
+
+def get_memory_store(project, session_id):
+    '''Get memory store of the session in project. The memory table is created if not exists.'''
+    def _create():
+        if summaries is None:
+            memory_db = MemoryStore(table_name=project, session_id=session_id)
+        else:
+            memory_db = MemoryStore(
+                table_name=project, session_id=session_id, max_turns=SUMMARY_TURNS,
+                summary_loader=lambda: summaries.get(project, session_id)[0]
+            )
+        catalog.update(project, memory=True)
+        return memory_db
+
+    return memory_stores.get_or_create((project, session_id), _create)
 
-def chat(session_id, project, question, enable_agent=False):
-    '''Chat API'''
-    doc_db = DocStore(
-        table_name=project,
-        embedding_func=encoder,
-    )
-    memory_db = MemoryStore(table_name=project, session_id=session_id)
 
+def get_chain(project, enable_agent=False):
+    '''Get the chain (or agent executor) template of the project without memory.'''
+    key = (project, enable_agent)
+    chain = chain_templates.get(key)
+    if chain is not None:
+        return chain
+
+    doc_db = get_doc_store(project)
     if enable_agent:  # use agent
-        memory_db.memory.output_key = None
         tools = [
             Tool(
                 name='Search',
@@ -39,66 +84,272 @@ def chat(session_id, project, question, enable_agent=False):
             )
         ]
         agent = ChatAgent.from_llm_and_tools(llm=chat_llm, tools=tools)
-        agent_chain = AgentExecutor.from_agent_and_tools(
+        chain = AgentExecutor.from_agent_and_tools(
             agent=agent,
-            tools=tools,
-            memory=memory_db.memory,
+            tools=tools
         )
+    else:  # use chain
+        chain = ConversationalRetrievalChain.from_llm(
+            llm=chat_llm,
+            retriever=doc_db.vector_db.as_retriever(),
+            return_generated_question=True
+        )
+    if project in doc_stores:
+        chain_templates.put(key, chain)
+    return chain
+
+
+def shallow_copy(model, **updates):
+    '''Shallow copy a LangChain model (chain, llm, etc.) with updated fields.'''
+    return model.__class__.construct(**{**model.__dict__, **updates})
+
+
+def with_memory(template, memory, output_key=None):
+    '''Shallow copy the chain template with a copy of memory of the session saving output_key,
+    sub-chains, retriever & chat history are shared.'''
+    return shallow_copy(template, memory=shallow_copy(memory, output_key=output_key))
+
+
+async def arun_with_memory(chain, memory, inputs: dict, output_key: str) -> dict:
+    '''Run the chain template (without memory) asynchronously, with chat history of memory loaded & saved in executor,
+    so that history queries do not block the event loop. Return outputs of the chain.'''
+    loop = asyncio.get_running_loop()
+    history = await loop.run_in_executor(None, memory.load_memory_variables, inputs)
+    outputs = await chain.acall({**inputs, **history}, return_only_outputs=True)
+    await loop.run_in_executor(None, memory.save_context, inputs, {output_key: outputs[output_key]})
+    return outputs
+
+
+def with_streaming(qa, callbacks):
+    '''Shallow copy the retrieval chain so that only the LLM generating answer streams tokens to callbacks.'''
+    llm_chain = qa.combine_docs_chain.llm_chain
+    llm_updates = {'callbacks': callbacks}
+    if 'streaming' in llm_chain.llm.__fields__:
+        llm_updates['streaming'] = True
+    llm_chain = shallow_copy(llm_chain, llm=shallow_copy(llm_chain.llm, **llm_updates))
+    combine_docs_chain = shallow_copy(qa.combine_docs_chain, llm_chain=llm_chain)
+    return shallow_copy(qa, combine_docs_chain=combine_docs_chain)
+
+
+class TokenQueueHandler(AsyncCallbackHandler):
+    '''Put new tokens from LLM into an asyncio queue.'''
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if token:
+            self.queue.put_nowait(token)
+
+
+def invalidate(project, session_id=None, memory=False):
+    '''Remove cached store handles & chains of the project.
+    Memory stores are removed only if memory is True, either of one session or all sessions if session_id is empty.'''
+    doc_stores.pop(project)
+    chain_templates.pop_if(lambda k: k[0] == project)
+    if memory:
+        if session_id:
+            memory_stores.pop((project, session_id))
+        else:
+            memory_stores.pop_if(lambda k: k[0] == project)
+
+
+def refresh_summary(project, session_id):
+    '''Summarize turns which have left the recent window in background, if memory mode is summary.'''
+    if summaries is None:
+        return
+
+    def _load_turns(covered):
+        memory_db = get_memory_store(project, session_id)
+        num = memory_db.count_turns() - SUMMARY_TURNS - covered
+        if num <= 0:
+            return []
+        return memory_db.get_history(limit=num, offset=SUMMARY_TURNS)
+
+    summaries.refresh(project, session_id, _load_turns)
+
+
+def chat(session_id, project, question, enable_agent=False):
+    '''Chat API'''
+    memory_db = get_memory_store(project, session_id)
+    template = get_chain(project, enable_agent=enable_agent)
+
+    if enable_agent:  # use agent
+        agent_chain = with_memory(template, memory_db.memory)
         try:
             final_answer = agent_chain.run(input=question)
+            refresh_summary(project, session_id)
             return question, final_answer
         except Exception as e:  # pylint: disable=W0703
             return question, f'Something went wrong:\n{e}'
     else:  # use chain
-        memory_db.memory.output_key = 'answer'
-        qa = ConversationalRetrievalChain.from_llm(
-            llm=chat_llm,
-            retriever=doc_db.vector_db.as_retriever(),
-            memory=memory_db.memory,
-            return_generated_question=True
-        )
+        qa = with_memory(template, memory_db.memory, output_key='answer')
         qa_result = qa(question)
+        refresh_summary(project, session_id)
+        return qa_result['generated_question'], qa_result['answer']
+
+
+async def achat(session_id, project, question, enable_agent=False, callbacks=None):
+    '''Async chat API. Callbacks will receive new tokens of the answer if the LLM supports streaming.
+    Store lookups and chat history I/O run in executor, so they do not block the event loop.'''
+    loop = asyncio.get_running_loop()
+    memory_db = await loop.run_in_executor(None, get_memory_store, project, session_id)
+    template = await loop.run_in_executor(None, partial(get_chain, project, enable_agent=enable_agent))
+
+    if enable_agent:  # use agent
+        try:
+            outputs = await arun_with_memory(template, memory_db.memory, {'input': question}, 'output')
+            refresh_summary(project, session_id)
+            return question, outputs['output']
+        except Exception as e:  # pylint: disable=W0703
+            return question, f'Something went wrong:\n{e}'
+    else:  # use chain
+        qa = with_streaming(template, callbacks) if callbacks else template
+        qa_result = await arun_with_memory(qa, memory_db.memory, {'question': question}, 'answer')
+        refresh_summary(project, session_id)
         return qa_result['generated_question'], qa_result['answer']
 
 
+async def astream_chat(session_id, project, question, enable_agent=False):
+    '''Stream chat API. Yield events of answer tokens as they arrive, then the final answer.
+    The agent only yields the final answer, because its raw outputs are formatted actions.'''
+    queue = asyncio.Queue()
+    callbacks = None if enable_agent else [TokenQueueHandler(queue)]
+    task = asyncio.ensure_future(
+        achat(session_id, project, question, enable_agent=enable_agent, callbacks=callbacks))
+    while True:
+        getter = asyncio.ensure_future(queue.get())
+        done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+        if getter not in done:
+            getter.cancel()
+            break
+        yield {'event': 'token', 'data': getter.result()}
+    while not queue.empty():
+        yield {'event': 'token', 'data': queue.get_nowait()}
+    new_question, final_answer = task.result()
+    yield {'event': 'answer', 'data': {'question': new_question, 'answer': final_answer}}
+
+
+async def abatch_chat(items: List[dict], enable_agent=False, max_concurrency: int = 16):
+    '''Batch chat API. Each item is a dict with keys session_id, project, question.
+    Questions are embedded in one call as queries and each project is searched once with all its query embeddings,
+    then answers are generated concurrently. The questions are not rewritten by history in batch mode.
+    The agent decides its own searches, so it falls back to concurrent chats.
+    Return a list of (question, answer) in the same order of items.'''
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results = [None] * len(items)
+
+    if enable_agent:
+        async def _agent_chat(i, item):
+            async with semaphore:
+                results[i] = await achat(enable_agent=True, **item)
+        await asyncio.gather(*[_agent_chat(i, item) for i, item in enumerate(items)])
+        return results
+
+    loop = asyncio.get_running_loop()
+    questions = [item['question'] for item in items]
+    embeddings = await loop.run_in_executor(None, encoder.embed_queries, questions)
+
+    projects = {}
+    for i, item in enumerate(items):
+        projects.setdefault(item['project'], []).append(i)
+
+    retrieved = [None] * len(items)
+
+    async def _search(project, indices):
+        try:
+            doc_db = await loop.run_in_executor(None, get_doc_store, project)
+            batch_docs = await loop.run_in_executor(None, partial(
+                doc_db.batch_search,
+                queries=[questions[i] for i in indices],
+                embeddings=[embeddings[i] for i in indices]
+            ))
+            for i, docs in zip(indices, batch_docs):
+                retrieved[i] = docs
+        except Exception as e:  # pylint: disable=W0703
+            for i in indices:
+                results[i] = (questions[i], f'Something went wrong:\n{e}')
+
+    await asyncio.gather(*[_search(project, indices) for project, indices in projects.items()])
+
+    async def _answer(i, item):
+        async with semaphore:
+            try:
+                qa = await loop.run_in_executor(None, get_chain, item['project'])
+                final_answer = await qa.combine_docs_chain.arun(input_documents=retrieved[i], question=item['question'])
+                memory_db = await loop.run_in_executor(None, get_memory_store, item['project'], item['session_id'])
+                await loop.run_in_executor(
+                    None, memory_db.add_history, [{'question': item['question'], 'answer': final_answer}])
+                refresh_summary(item['project'], item['session_id'])
+                results[i] = (item['question'], final_answer)
+            except Exception as e:  # pylint: disable=W0703
+                results[i] = (item['question'], f'Something went wrong:\n{e}')
+
+    await asyncio.gather(*[_answer(i, item) for i, item in enumerate(items) if results[i] is None])
+    return results
+
+
 def insert(data_src, project, source_type: str = 'file'):
     '''Load project docs will load docs from data source and then insert doc embeddings into the project table in the vector store.
     If there is no project table, it will create one.
     '''
-    doc_db = DocStore(table_name=project,
-                      embedding_func=encoder)
+    doc_db = get_doc_store(project)
     docs, token_count = load_data(data_src=data_src, source_type=source_type)
-    num = doc_db.insert(docs)
+    num = doc_db.insert(docs, source=data_src, manifest=manifest)
+    invalidate(project)
+    catalog.update(project, store=True)
     return num, token_count
 
 
+def sync(data_src, project, source_type: str = 'file'):
+    '''Sync project docs incrementally from data source by the project manifest:
+    stale chunks of the source will be deleted, and only new chunks will be inserted.
+    Chunks of the source inserted before it was tracked in manifest are replaced on its first sync.
+    Return a report of changes.
+    '''
+    doc_db = get_doc_store(project)
+    docs, token_count = load_data(data_src=data_src, source_type=source_type)
+    changes = doc_db.sync(source=data_src, data=docs, manifest=manifest)
+    invalidate(project)
+    catalog.update(project, store=True)
+    changes['token_count'] = token_count
+    return changes
+
+
 def drop(project):
     '''Drop project will clean both vector and memory stores.'''
     # Clear vector db
+    invalidate(project, memory=True)
+    catalog.invalidate(project)
     try:
         DocStore.drop(project)
     except Exception as e:
         logger.error('Failed to drop project:\n%s', e)
         raise RuntimeError from e
+    catalog.update(project, store=False)
+    manifest.remove(project)
     # Clear memory
+    if summaries is not None:
+        summaries.remove(project)
     try:
         memory_db = MemoryStore(table_name=project, session_id='')
         memory_db.drop(project)
     except Exception as e:
         logger.error('Failed to clean memory for the project:\n%s', e)
         raise RuntimeError from e
+    catalog.update(project, memory=False)
 
 
 def check(project):
     '''Check existences of project tables in both doc stores and memory stores.'''
     try:
-        doc_check = DocStore.has_project(project)
+        doc_check = catalog.get(project, 'store', lambda: DocStore.has_project(project))
     except Exception as e:
         logger.error('Failed to check doc stores:\n%s', e)
         raise RuntimeError from e
     # Check memory
     try:
-        memory_check = MemoryStore.check(project)
+        memory_check = catalog.get(project, 'memory', lambda: MemoryStore.check(project))
     except Exception as e:
         logger.error('Failed to clean memory for the project:\n%s', e)
         raise RuntimeError from e
@@ -108,18 +359,19 @@ def check(project):
 def count(project):
     '''Count entities.'''
     try:
-        counts = DocStore.count_entities(project=project)
+        exists = catalog.get(project, 'store', lambda: DocStore.has_project(project))
+        counts = DocStore.count_entities(project=project, exists=exists)
         return counts
     except Exception as e:
         logger.error('Failed to count entities:\n%s', e)
         raise RuntimeError from e
 
 
-def get_history(project, session_id):
-    '''Get conversation history from memory store.'''
+def get_history(project, session_id, limit=None, offset=0):
+    '''Get conversation history from memory store, at most limit turns before the latest offset turns if limit is given.'''
     try:
-        memory_db = MemoryStore(table_name=project, session_id=session_id)
-        messages = memory_db.get_history()
+        memory_db = get_memory_store(project, session_id)
+        messages = memory_db.get_history(limit=limit, offset=offset)
         return messages
     except Exception as e:
         logger.error('Failed to clean memory for the project:\n%s', e)
@@ -129,17 +381,20 @@ def get_history(project, session_id):
 def clear_history(project, session_id):
     '''Clear conversation history from memory store.'''
     try:
-        memory_db = MemoryStore(project, session_id)
-        memory_db.drop(table_name=project, session_id=session_id)
+        invalidate(project, session_id=session_id, memory=True)
+        MemoryStore.drop(table_name=project, session_id=session_id)
+        if summaries is not None:
+            summaries.remove(project, session_id)
     except Exception as e:
         raise RuntimeError(f'Failed to clear memory:\n{e}') from e
 
 
 def load(document_strs: List[str], project: str):
     '''Load doc embeddings to project table in vector store given a list of doc chunks.'''
-    doc_db = DocStore(table_name=project,
-                      embedding_func=encoder)
+    doc_db = get_doc_store(project)
     num = doc_db.insert(document_strs)
+    invalidate(project)
+    catalog.update(project, store=True)
     return num
 
 # if __name__ == '__main__':
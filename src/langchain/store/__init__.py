@@ -1,20 +1,42 @@
 import os
 import sys
-from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Union
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
 
-from .vector_store.milvus import VectorStore, Embeddings
 from .memory_store.sql import MemoryStore
+from .fusion import fuse
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from config import USE_SCALAR, VECTORDB_CONFIG, SCALARDB_CONFIG, HYBRID_CONFIG  # pylint: disable=C0413
+from src.manifest import Manifest  # pylint: disable=C0413
 
-from config import USE_SCALAR  # pylint: disable=C0413
+if VECTORDB_CONFIG.get('backend', 'milvus') == 'local':
+    from .vector_store.local import VectorStore  # pylint: disable=C0412
+else:
+    from .vector_store.milvus import VectorStore  # pylint: disable=C0412
 
 if USE_SCALAR:
-    from .scalar_store.es import ScalarStore
+    if SCALARDB_CONFIG.get('backend', 'elasticsearch') == 'bm25':
+        from .scalar_store.bm25 import ScalarStore
+    else:
+        from .scalar_store.es import ScalarStore
+
+FUSION = HYBRID_CONFIG.get('fusion', 'rrf')
+FUSION_WEIGHTS = HYBRID_CONFIG.get('weights', [1.0, 1.0])
+RRF_K = HYBRID_CONFIG.get('rrf_k', 60)
+FUSION_TOP_K = HYBRID_CONFIG.get('top_k', None)
+SEARCH_WORKERS = HYBRID_CONFIG.get('max_workers', 8)
 
 
 class DocStore:
     '''Integrate vector store and scalar store.'''
+    # Shared by all doc stores to search vector store and scalar store concurrently
+    executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
 
     def __init__(
             self,
@@ -35,23 +57,49 @@ class DocStore:
             self.scalar_db = None
 
     def search(self, query: str):
-        res = []
-        pages = []
-        for doc in self.vector_db.search(query):
-            if doc.page_content not in pages:
-                res.append(doc)
-                pages.append(doc.page_content)
-        if self.scalar_db:
-            for doc in self.scalar_db.search(query):
-                if doc.page_content not in pages:
-                    res.append(doc)
-                    pages.append(doc.page_content)
-        return res
-
-    def insert(self, data: List[str], metadatas: Optional[List[dict]] = None):
+        if not self.scalar_db:
+            return self.fuse([self.vector_db.search_with_score(query)])
+        vector_future = self.executor.submit(self.vector_db.search_with_score, query)
+        scalar_res = self.scalar_db.search_with_score(query)
+        return self.fuse([vector_future.result(), scalar_res])
+
+    def batch_search(self, queries: List[str], embeddings: List[List[float]]):
+        '''Search a batch of queries, vector store is searched once with all query embeddings.'''
+        assert len(queries) == len(embeddings), 'Each query must have its embedding.'
+        if not self.scalar_db:
+            return [self.fuse([pairs]) for pairs in self.vector_db.batch_search_with_score(embeddings)]
+        vector_future = self.executor.submit(self.vector_db.batch_search_with_score, embeddings)
+        batch_scalar_res = list(self.executor.map(self.scalar_db.search_with_score, queries))
+        return [
+            self.fuse([vector_res, scalar_res])
+            for vector_res, scalar_res in zip(vector_future.result(), batch_scalar_res)
+        ]
+
+    def fuse(self, results):
+        '''Fuse (doc, score) lists of vector store and scalar store with configured method in HYBRID_CONFIG.
+        Vector scores are distances with L2 metric, where lower is better.'''
+        if len(results) == 1:
+            return fuse(results, method='append', top_k=FUSION_TOP_K)
+        return fuse(
+            results, method=FUSION, weights=FUSION_WEIGHTS, rrf_k=RRF_K, top_k=FUSION_TOP_K,
+            higher_is_better=[self.vector_db.metric_type != 'L2', True]
+        )
+
+    def insert(self, data: List[str], metadatas: Optional[List[dict]] = None, embeddings: Optional[np.ndarray] = None,
+               source: Optional[str] = None, manifest: Optional[Manifest] = None):
+        '''Insert texts, embeddings (a 2-D float32 array) of texts are computed by embedding_func if not given.
+        If manifest is given, texts are recorded as chunks of the source, so that the source can be synced later.'''
+        if manifest is not None:
+            assert metadatas is None and embeddings is None, 'Only texts without metadatas or embeddings are recorded in manifest.'
+            return len(self._add(source, [Manifest.hash_chunk(t) for t in data], data, manifest))
         vec_count = None
         scalar_count = None
-        vec_count = self.vector_db.insert(data=data, metadatas=metadatas)
+        if embeddings is None:
+            vec_count = self.vector_db.insert(data=data, metadatas=metadatas)
+        else:
+            metadatas = metadatas or [{} for _ in data]
+            vec_count = self.vector_db.insert_embeddings(
+                data=embeddings, metadatas=[{**m, 'text': t} for t, m in zip(data, metadatas)])
         if metadatas and 'doc' in metadatas[0]:
             data = [doc['doc'] for doc in metadatas]
         if self.scalar_db:
@@ -60,7 +108,58 @@ class DocStore:
             assert vec_count == scalar_count, f'Data count does not match: {vec_count} in vector db VS {scalar_count} in scalar db.'
         return vec_count
 
-    def insert_embeddings(self, data: List[float], metadatas: List[dict]):
+    def sync(self, source: str, data: List[str], manifest: Manifest):
+        '''Incrementally sync doc chunks of the source with its manifest:
+        delete stale chunks and insert new chunks only. Return a report of changes.
+        A source without manifest entries may have been inserted before it was tracked,
+        its chunks not tracked by any source are deleted as well to avoid duplicates.'''
+        entries = manifest.get(self.table_name, source)
+        new_chunks, stale, unchanged = Manifest.diff(entries, data)
+        deleted = len(stale)
+        if not entries:
+            deleted += self._delete_untracked(data, manifest)
+        if stale:
+            self.vector_db.delete([e['vector_pk'] for e in stale if e['vector_pk'] is not None])
+            if self.scalar_db:
+                self.scalar_db.delete([e['scalar_id'] for e in stale if e['scalar_id'] is not None])
+            manifest.remove(self.table_name, source=source, ids=[e['id'] for e in stale])
+        if new_chunks:
+            self._add(source, list(new_chunks.keys()), list(new_chunks.values()), manifest)
+        return {'source': source, 'added': len(new_chunks), 'deleted': deleted, 'unchanged': unchanged}
+
+    def _add(self, source: str, chunk_hashes: List[str], texts: List[str], manifest: Manifest) -> List:
+        '''Add texts to vector & scalar stores and record them in manifest, return vector pks.
+        Texts added to either store are rolled back if the rest fails, so they are never left untracked.'''
+        if len(texts) == 0:
+            return []
+        vector_pks = self.vector_db.add_texts(texts=texts)
+        scalar_ids = [None] * len(texts)
+        try:
+            if self.scalar_db:
+                scalar_ids = self.scalar_db.add_texts(texts=texts)
+            assert len(vector_pks) == len(scalar_ids), \
+                f'Data count does not match: {len(vector_pks)} in vector db VS {len(scalar_ids)} in scalar db.'
+            manifest.add(self.table_name, source, [
+                {'chunk_hash': h, 'vector_pk': pk, 'scalar_id': i}
+                for h, pk, i in zip(chunk_hashes, vector_pks, scalar_ids)
+            ])
+        except Exception:
+            self.vector_db.delete(vector_pks)
+            if self.scalar_db:
+                self.scalar_db.delete([i for i in scalar_ids if i is not None])
+            raise
+        return vector_pks
+
+    def _delete_untracked(self, texts: List[str], manifest: Manifest) -> int:
+        '''Delete chunks of texts which are not tracked in manifest, return the count deleted from vector store.'''
+        vector_tracked, scalar_tracked = manifest.keys(self.table_name)
+        vector_pks = [pk for pk in self.vector_db.find_texts(texts) if str(pk) not in vector_tracked]
+        self.vector_db.delete(vector_pks)
+        if self.scalar_db:
+            self.scalar_db.delete([i for i in self.scalar_db.find_texts(texts) if str(i) not in scalar_tracked])
+        return len(vector_pks)
+
+    def insert_embeddings(self, data: Union[List[List[float]], np.ndarray], metadatas: List[dict]):
         vec_count = None
         scalar_count = None
         docs = []
@@ -99,8 +198,11 @@ class DocStore:
         return status
 
     @staticmethod
-    def count_entities(project):
-        if not VectorStore.has_project(project):
+    def count_entities(project, exists: bool = None):
+        '''Count entities in vector & scalar stores, existence of the project is checked if not given.'''
+        if exists is None:
+            exists = VectorStore.has_project(project)
+        if not exists:
             milvus_count = es_count = None
         else:
             milvus_count = VectorStore.count_entities(project)
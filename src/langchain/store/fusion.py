@@ -0,0 +1,52 @@
+from typing import List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+
+def fuse(
+        results: List[List[Tuple[Document, float]]],
+        method: str = 'rrf',
+        weights: Optional[List[float]] = None,
+        rrf_k: int = 60,
+        top_k: Optional[int] = None,
+        higher_is_better: Optional[List[bool]] = None
+        ) -> List[Document]:
+    '''Fuse ranked (doc, score) lists from multiple retrievers into one list of docs.
+    Docs with the same page content are deduplicated by hash.
+
+    method:
+        rrf: reciprocal rank fusion, sum of weight / (rrf_k + rank) over lists
+        weighted: sum of weight * min-max normalized score over lists
+        append: keep order of lists one after another
+    higher_is_better: whether higher scores are better in each list, False for distances like L2. All True by default.
+    '''
+    if weights is None:
+        weights = [1.0] * len(results)
+    if higher_is_better is None:
+        higher_is_better = [True] * len(results)
+    assert len(weights) == len(results), 'Each result list must have its weight.'
+    assert len(higher_is_better) == len(results), 'Each result list must have its score order.'
+
+    docs = {}
+    scores = {}
+    for pairs, weight, higher in zip(results, weights, higher_is_better):
+        if method == 'weighted' and len(pairs) > 0:
+            raw = [score for _, score in pairs]
+            low, high = min(raw), max(raw)
+        for rank, (doc, score) in enumerate(pairs):
+            key = doc.page_content
+            docs.setdefault(key, doc)
+            if method == 'rrf':
+                scores[key] = scores.get(key, 0) + weight / (rrf_k + rank + 1)
+            elif method == 'weighted':
+                norm_score = 1.0 if high == low else (score - low if higher else high - score) / (high - low)
+                scores[key] = scores.get(key, 0) + weight * norm_score
+            elif method == 'append':
+                scores.setdefault(key, -len(scores))
+            else:
+                raise AttributeError(f'Invalid fusion method: {method}. Only support "rrf", "weighted" or "append".')
+
+    keys = sorted(scores, key=scores.get, reverse=True)
+    if top_k is not None:
+        keys = keys[:top_k]
+    return [docs[k] for k in keys]
@@ -1,33 +1,124 @@
 import os
 import sys
-from typing import List
+from typing import Callable, List, Optional
 
-from sqlalchemy import create_engine, inspect, MetaData, Table
+from sqlalchemy import inspect, MetaData, Table, Index
+from sqlalchemy.orm import sessionmaker
 
-from langchain.schema import HumanMessage, AIMessage
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+from langchain.schema.messages import BaseMessage
 from langchain.memory import SQLChatMessageHistory, ConversationBufferMemory
+from langchain.memory.chat_message_histories.sql import DefaultMessageConverter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
 from config import MEMORYDB_CONFIG  # pylint: disable=C0413
+from src.engines import get_engine  # pylint: disable=C0413
+from src.history_window import window_size, trim_by_tokens  # pylint: disable=C0413
 
 
 CONNECT_STR = MEMORYDB_CONFIG.get(
     'connect_str', 'sqlite:///./sqlite.db')
+HISTORY_TURNS = MEMORYDB_CONFIG.get('history_turns', None)
+HISTORY_TOKENS = MEMORYDB_CONFIG.get('history_tokens', None)
+
+# Tables already created by (connection string, table name), so new sessions skip the DDL round trips
+created_tables = set()
+
+
+class IndexedMessageConverter(DefaultMessageConverter):
+    '''Default message model with an index on session_id.'''
+
+    def __init__(self, table_name: str):
+        super().__init__(table_name)
+        Index(f'ix_{table_name}_session_id', self.model_class.session_id)
+
+
+class WindowedSQLChatMessageHistory(SQLChatMessageHistory):
+    '''SQL chat message history only loading recent messages into memory:
+    the last max_turns turns, trimmed to no more than about max_tokens tokens.
+    The window is pushed down into SQL by ORDER BY id DESC LIMIT.
+    It uses the engine shared by connection string instead of creating one for each session.
+    '''
+
+    def __init__(self, session_id: str, connection_string: str, table_name: str,  # pylint: disable=W0231
+                 max_turns: Optional[int] = HISTORY_TURNS, max_tokens: Optional[int] = HISTORY_TOKENS,
+                 summary_loader: Optional[Callable[[], str]] = None):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_loader = summary_loader
+
+        # Same as SQLChatMessageHistory.__init__, except the shared engine
+        self.connection_string = connection_string
+        self.engine = get_engine(connection_string)
+        self.session_id_field_name = 'session_id'
+        self.converter = IndexedMessageConverter(table_name)
+        self.sql_model_class = self.converter.get_sql_model_class()
+        self.table_name = table_name
+        self._create_table_if_not_exists()
+        self.session_id = session_id
+        self.Session = sessionmaker(self.engine)  # pylint: disable=C0103
+
+    def _create_table_if_not_exists(self) -> None:
+        key = (self.connection_string, self.table_name)
+        if key in created_tables:
+            return
+        super()._create_table_if_not_exists()
+        # Tables created before have no index
+        for index in self.sql_model_class.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+        created_tables.add(key)
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore
+        '''Retrieve recent messages in the window from db'''
+        messages = self.get_messages(limit=window_size(self.max_turns))
+        messages = trim_by_tokens(messages, self.max_tokens, lambda m: m.content)
+        summary = self.summary_loader() if self.summary_loader else None
+        if summary:
+            messages = [SystemMessage(content=f'Summary of earlier conversation: {summary}')] + messages
+        return messages
+
+    def count(self) -> int:
+        '''Count messages of the session in db'''
+        with self.Session() as session:
+            return session.query(self.sql_model_class).where(
+                getattr(self.sql_model_class, self.session_id_field_name) == self.session_id).count()
+
+    def get_messages(self, limit: Optional[int] = None, offset: int = 0) -> List[BaseMessage]:
+        '''Retrieve at most limit messages before the latest offset messages, in the order of time.'''
+        with self.Session() as session:
+            query = (
+                session.query(self.sql_model_class)
+                .where(getattr(self.sql_model_class, self.session_id_field_name) == self.session_id)
+                .order_by(self.sql_model_class.id.desc())
+                .offset(offset)
+            )
+            if limit:
+                query = query.limit(limit)
+            records = list(query)
+        return [self.converter.from_sql_model(record) for record in reversed(records)]
 
 
 class MemoryStore:
     '''Memory database APIs: add_history, get_history'''
 
-    def __init__(self, table_name: str, session_id: str):
-        '''Initialize memory storage: e.g. history_db'''
+    def __init__(self, table_name: str, session_id: str,
+                 max_turns: Optional[int] = HISTORY_TURNS, summary_loader: Optional[Callable[[], str]] = None):
+        '''Initialize memory storage: e.g. history_db
+
+        max_turns: number of recent turns loaded into memory
+        summary_loader: function returning summary of earlier turns, which is put before recent turns in memory
+        '''
         self.table_name = table_name
         self.session_id = session_id
 
-        self.history_db = SQLChatMessageHistory(
+        self.history_db = WindowedSQLChatMessageHistory(
             table_name=self.table_name,
             session_id=self.session_id,
             connection_string=CONNECT_STR,
+            max_turns=max_turns,
+            summary_loader=summary_loader
         )
         self.memory = ConversationBufferMemory(
             memory_key='chat_history',
@@ -42,8 +133,14 @@ class MemoryStore:
             if 'answer' in qa:
                 self.history_db.add_ai_message(qa['answer'])
 
-    def get_history(self):
-        history = self.history_db.messages
+    def count_turns(self) -> int:
+        '''Count (question, answer) turns of the session.'''
+        return (self.history_db.count() + 1) // 2
+
+    def get_history(self, limit: Optional[int] = None, offset: int = 0):
+        '''Get history in (question, answer) turns of time order.
+        If limit is given, return at most limit turns before the latest offset turns.'''
+        history = self.history_db.get_messages(limit=window_size(limit), offset=2 * offset)
         messages = []
         for x in history:
             if isinstance(x, HumanMessage):
@@ -64,8 +161,8 @@ class MemoryStore:
 
     @staticmethod
     def drop(table_name, connect_str: str = CONNECT_STR, session_id: str = None):
-        engine = create_engine(connect_str, echo=False)
-        existence = MemoryStore.check(table_name)
+        engine = get_engine(connect_str)
+        existence = MemoryStore.check(table_name, connect_str=connect_str)
 
         if existence:
             project_table = Table(table_name, MetaData(),
@@ -77,8 +174,9 @@ class MemoryStore:
                     conn.commit()
             else:
                 query = project_table.drop(engine)
+                created_tables.discard((connect_str, table_name))
 
     @staticmethod
     def check(table_name, connect_str: str = CONNECT_STR):
-        engine = create_engine(connect_str, echo=False)
+        engine = get_engine(connect_str)
         return inspect(engine).has_table(table_name)
@@ -0,0 +1,285 @@
+import os
+import re
+import sys
+import json
+import math
+import uuid
+import shutil
+import threading
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from config import SCALARDB_CONFIG  # pylint: disable=C0413
+
+
+DATA_DIR = SCALARDB_CONFIG.get('data_dir', './scalar_data')
+TOP_K = SCALARDB_CONFIG.get('top_k', 3)
+BM25_K1 = SCALARDB_CONFIG.get('bm25_k1', 1.2)
+BM25_B = SCALARDB_CONFIG.get('bm25_b', 0.75)
+MAX_SEGMENTS = SCALARDB_CONFIG.get('max_segments', 8)
+
+# Words, or single CJK characters like the standard analyzer of Elasticsearch
+TOKEN_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]|[^\W_]+')
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _load_array(path: str) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # Empty arrays can not be memory mapped
+        return np.load(path)
+
+
+class Segment:
+    '''Immutable inverted index of a batch of docs. Postings of all terms are concatenated in compact arrays,
+    vocab maps each term to (offset, length) of its postings. Arrays are memory mapped from disk.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'vocab.json'), 'r', encoding='utf-8') as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(path, 'docs.json'), 'r', encoding='utf-8') as f:
+            docs = json.load(f)
+        self.ids = docs['ids']
+        self.texts = docs['texts']
+        self.doc_ids = _load_array(os.path.join(path, 'doc_ids.npy'))
+        self.tfs = _load_array(os.path.join(path, 'tfs.npy'))
+        self.doc_lens = _load_array(os.path.join(path, 'doc_lens.npy'))
+        self.total_len = int(self.doc_lens.sum())
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.live = np.ones(len(self.ids), dtype=bool)
+
+    @staticmethod
+    def write(path: str, ids: List[str], texts: List[str]) -> 'Segment':
+        '''Build the segment of docs and write it to path atomically.'''
+        counts = [Counter(tokenize(text)) for text in texts]
+        postings = {}
+        for i, count in enumerate(counts):
+            for term, tf in count.items():
+                postings.setdefault(term, []).append((i, tf))
+        vocab = {}
+        doc_ids = []
+        tfs = []
+        for term in sorted(postings):
+            vocab[term] = [len(doc_ids), len(postings[term])]
+            for i, tf in postings[term]:
+                doc_ids.append(i)
+                tfs.append(tf)
+
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'doc_ids.npy'), np.array(doc_ids, dtype=np.int32))
+        np.save(os.path.join(tmp_path, 'tfs.npy'), np.array(tfs, dtype=np.float32))
+        np.save(os.path.join(tmp_path, 'doc_lens.npy'), np.array([sum(c.values()) for c in counts], dtype=np.int32))
+        with open(os.path.join(tmp_path, 'vocab.json'), 'w', encoding='utf-8') as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        with open(os.path.join(tmp_path, 'docs.json'), 'w', encoding='utf-8') as f:
+            json.dump({'ids': ids, 'texts': texts}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return Segment(path)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        offset, length = self.vocab.get(term, (0, 0))
+        return self.doc_ids[offset:offset + length], self.tfs[offset:offset + length]
+
+
+class BM25Index:
+    '''Inverted index of a project saved in a directory, scored by BM25 like Elasticsearch.
+
+    Each add writes a new segment, so adding docs never rewrites old ones.
+    Deleted docs are masked out until segments are merged, which happens when there are more than max_segments.
+    Document frequencies still count deleted docs before merging, as Elasticsearch does.
+    '''
+
+    def __init__(self, path: str, k1: float = BM25_K1, b: float = BM25_B, max_segments: int = MAX_SEGMENTS):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self.segments = []
+        self.deleted = set()
+        self._next = 0
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if not os.path.isdir(self.path):
+            return
+        names = sorted(x for x in os.listdir(self.path) if x.startswith('seg_') and not x.endswith('.tmp'))
+        self.segments = [Segment(os.path.join(self.path, x)) for x in names]
+        if names:
+            self._next = int(names[-1][len('seg_'):]) + 1
+        deleted_path = os.path.join(self.path, 'deleted.json')
+        if os.path.exists(deleted_path):
+            with open(deleted_path, 'r', encoding='utf-8') as f:
+                self._mask(json.load(f))
+
+    def add(self, texts: List[str]) -> List[str]:
+        ids = [str(uuid.uuid4()) for _ in texts]
+        if len(texts) == 0:
+            return ids
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            self.segments.append(Segment.write(self._segment_path(), ids, texts))
+            if len(self.segments) > self.max_segments:
+                self.merge()
+        return ids
+
+    def delete(self, ids: Iterable[str]):
+        with self._lock:
+            if len(self.segments) == 0:
+                return
+            self._mask(ids)
+            with open(os.path.join(self.path, 'deleted.json'), 'w', encoding='utf-8') as f:
+                json.dump(sorted(self.deleted), f)
+
+    def _mask(self, ids: Iterable[str]):
+        for doc_id in ids:
+            for segment in self.segments:
+                i = segment.positions.get(doc_id)
+                if i is not None:
+                    segment.live[i] = False
+                    self.deleted.add(doc_id)
+
+    def merge(self):
+        '''Merge all segments into one, purging deleted docs.'''
+        with self._lock:
+            ids = []
+            texts = []
+            for segment in self.segments:
+                for i in np.flatnonzero(segment.live):
+                    ids.append(segment.ids[i])
+                    texts.append(segment.texts[i])
+            merged = Segment.write(self._segment_path(), ids, texts)
+            for segment in self.segments:
+                shutil.rmtree(segment.path, ignore_errors=True)
+            self.segments = [merged]
+            self.deleted = set()
+            deleted_path = os.path.join(self.path, 'deleted.json')
+            if os.path.exists(deleted_path):
+                os.remove(deleted_path)
+
+    def _segment_path(self) -> str:
+        path = os.path.join(self.path, f'seg_{self._next:06d}')
+        self._next += 1
+        return path
+
+    def count(self) -> int:
+        return sum(len(s.ids) for s in self.segments) - len(self.deleted)
+
+    def search(self, query: str, top_k: int = TOP_K) -> List[Tuple[str, float, str]]:
+        '''Return top_k (text, BM25 score, id) of docs matching any term of the query.'''
+        segments = list(self.segments)
+        num_docs = sum(len(s.ids) for s in segments)
+        query_terms = Counter(tokenize(query))
+        if num_docs == 0 or len(query_terms) == 0:
+            return []
+        avg_len = sum(s.total_len for s in segments) / num_docs
+        idfs = {}
+        for term in query_terms:
+            df = sum(s.vocab.get(term, (0, 0))[1] for s in segments)
+            if df > 0:
+                idfs[term] = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+        candidates = []
+        for segment in segments:
+            scores = np.zeros(len(segment.ids), dtype=np.float32)
+            for term, idf in idfs.items():
+                doc_ids, tfs = segment.postings(term)
+                if len(doc_ids) == 0:
+                    continue
+                norms = self.k1 * (1 - self.b + self.b * segment.doc_lens[doc_ids] / avg_len)
+                scores[doc_ids] += query_terms[term] * idf * tfs * (self.k1 + 1) / (tfs + norms)
+            scores[~segment.live] = 0
+            hits = np.flatnonzero(scores)
+            if len(hits) > top_k:
+                hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+            candidates.extend((float(scores[i]), segment, int(i)) for i in hits)
+        candidates.sort(key=lambda x: -x[0])
+        return [(segment.texts[i], score, segment.ids[i]) for score, segment, i in candidates[:top_k]]
+
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def get_index(project: str, data_dir: str = DATA_DIR) -> BM25Index:
+    '''Get the index of project shared in process, loaded from disk once.'''
+    path = os.path.abspath(os.path.join(data_dir, project))
+    with indexes_lock:
+        if path not in indexes:
+            indexes[path] = BM25Index(path)
+        return indexes[path]
+
+
+class ScalarStore:
+    '''Scalar store to save and retrieve scalar data by BM25, using an in-process inverted index instead of Elasticsearch.
+    It works in a single process, as the index of each project is loaded once and updated in memory.'''
+
+    def __init__(self, index_name: str, data_dir: str = DATA_DIR):
+        self.index_name = index_name
+        self.data_dir = data_dir
+
+    @property
+    def index(self) -> BM25Index:
+        return get_index(self.index_name, self.data_dir)
+
+    def insert(self, data: Iterable[str]):
+        '''Insert data'''
+        ids = self.add_texts(texts=data)
+        return len(ids)
+
+    def add_texts(self, texts: Iterable[str], refresh_indices: bool = True) -> List[str]:  # pylint: disable=W0613
+        '''Add texts, which are searchable right after adding.'''
+        return self.index.add(list(texts))
+
+    def find_texts(self, texts: Iterable[str]) -> List[str]:
+        '''Find ids of docs whose text is one of texts.'''
+        texts = set(texts)
+        return [
+            segment.ids[i]
+            for segment in list(self.index.segments)
+            for i in np.flatnonzero(segment.live)
+            if segment.texts[i] in texts
+        ]
+
+    def delete(self, ids: List[str]):
+        '''Delete data by ids'''
+        if ids:
+            self.index.delete(ids)
+
+    def search(self, query: str):
+        '''Query data'''
+        return [doc for doc, _ in self.search_with_score(query)]
+
+    def search_with_score(self, query: str, top_k: Optional[int] = None) -> List[Tuple[Document, float]]:
+        '''Query data, return a list of (doc, BM25 score)'''
+        res = self.index.search(query, top_k=top_k or TOP_K)
+        return [(Document(page_content=text), score) for text, score, _ in res]
+
+    @staticmethod
+    def drop(project: str, data_dir: str = DATA_DIR):
+        path = os.path.abspath(os.path.join(data_dir, project))
+        with indexes_lock:
+            index = indexes.pop(path, None)
+        if index is None and not os.path.isdir(path):
+            raise RuntimeError(f'No scalar index found for project: {project}')
+        shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def has_project(project: str, data_dir: str = DATA_DIR):
+        return os.path.isdir(os.path.join(data_dir, project))
+
+    @staticmethod
+    def count_entities(project: str, data_dir: str = DATA_DIR):
+        return get_index(project, data_dir).count()
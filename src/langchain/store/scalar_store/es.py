@@ -1,8 +1,12 @@
 import os
 import sys
-from typing import Any, Iterable
+import uuid
+import threading
+from typing import Any, Iterable, List, Optional, Tuple
 
 import elasticsearch
+from elasticsearch.helpers import parallel_bulk, scan, streaming_bulk
+from langchain.docstore.document import Document
 from langchain.retrievers import ElasticSearchBM25Retriever
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
@@ -12,27 +16,117 @@ from config import SCALARDB_CONFIG  # pylint: disable=C0413
 
 CONNECTION_ARGS = SCALARDB_CONFIG.get(
     'connection_args', {'host': 'localhost', 'port': 9200})
+TOP_K = SCALARDB_CONFIG.get('top_k', 3)
+BULK_CHUNK_SIZE = SCALARDB_CONFIG.get('bulk_chunk_size', 500)
+BULK_WORKERS = SCALARDB_CONFIG.get('bulk_workers', 1)
+BULK_MAX_RETRIES = SCALARDB_CONFIG.get('bulk_max_retries', 3)
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(connection_args: dict = CONNECTION_ARGS) -> elasticsearch.Elasticsearch:
+    '''Get the client shared by connection args, whose HTTP connections are pooled and reused across requests.'''
+    key = repr(sorted(connection_args.items()))
+    with clients_lock:
+        if key not in clients:
+            clients[key] = elasticsearch.Elasticsearch(**connection_args)
+        return clients[key]
 
 
 class ScalarStore(ElasticSearchBM25Retriever):
     '''Scalar store to save and retrieve scalar data.'''
-    def __init__(self, index_name: str, client: Any = elasticsearch.Elasticsearch(**CONNECTION_ARGS)):
-        super().__init__(client=client, index_name=index_name)
+    def __init__(self, index_name: str, client: Any = None):
+        super().__init__(client=client or get_client(), index_name=index_name)
 
     def insert(self, data: Iterable[str]):
         '''Insert data'''
         ids = self.add_texts(texts=data)
         return len(ids)
 
+    def add_texts(
+            self,
+            texts: Iterable[str],
+            refresh_indices: bool = True,
+            chunk_size: int = BULK_CHUNK_SIZE,
+            workers: int = BULK_WORKERS
+            ) -> List[str]:
+        '''Index texts by bulk requests of chunk_size docs, sent by parallel workers if workers > 1.
+        Refresh is deferred until all chunks are indexed, and turned off during ingestions of multiple chunks.
+        The index is created with the explicit mapping first if not exists.'''
+        texts = list(texts)
+        ids = [str(uuid.uuid4()) for _ in texts]
+        if len(texts) == 0:
+            return ids
+        actions = (
+            {'_op_type': 'index', '_index': self.index_name, '_id': _id, 'content': text}
+            for _id, text in zip(ids, texts)
+        )
+
+        self._ensure_index()
+        deferred = len(texts) > chunk_size
+        if deferred:
+            refresh_interval = self._refresh_interval()
+            self.client.indices.put_settings(index=self.index_name, settings={'index': {'refresh_interval': '-1'}})
+        try:
+            if workers > 1:
+                results = parallel_bulk(self.client, actions, thread_count=workers, chunk_size=chunk_size)
+            else:
+                results = streaming_bulk(self.client, actions, chunk_size=chunk_size, max_retries=BULK_MAX_RETRIES)
+            # Failed docs raise BulkIndexError, results must be consumed to send all chunks
+            for _ in results:
+                pass
+        finally:
+            if deferred:
+                self.client.indices.put_settings(index=self.index_name, settings={'index': {'refresh_interval': refresh_interval}})
+
+        if refresh_indices:
+            self.client.indices.refresh(index=self.index_name)
+        return ids
+
+    def _refresh_interval(self) -> Optional[str]:
+        '''Refresh interval set on the index, None if not set and the cluster default applies.'''
+        res = self.client.indices.get_settings(index=self.index_name, name='index.refresh_interval')
+        return res.get(self.index_name, {}).get('settings', {}).get('index', {}).get('refresh_interval')
+
+    def _ensure_index(self):
+        if not self.client.indices.exists(index=self.index_name):
+            self.client.options(ignore_status=400).indices.create(
+                index=self.index_name, mappings={'properties': {'content': {'type': 'text'}}})
+
+    def find_texts(self, texts: Iterable[str], batch_size: int = 100) -> List[str]:
+        '''Find ids of docs whose content is one of texts. Docs are matched by phrase, then compared exactly.'''
+        if not self.client.indices.exists(index=self.index_name):
+            return []
+        texts = list(set(texts))
+        wanted = set(texts)
+        ids = []
+        for i in range(0, len(texts), batch_size):
+            query = {'query': {'bool': {'should': [{'match_phrase': {'content': t}} for t in texts[i:i + batch_size]]}}}
+            ids.extend(
+                hit['_id'] for hit in scan(self.client, query=query, index=self.index_name)
+                if hit['_source']['content'] in wanted
+            )
+        return ids
+
+    def delete(self, ids: List[str]):
+        '''Delete data by ids'''
+        if ids:
+            self.client.delete_by_query(index=self.index_name, query={'ids': {'values': list(ids)}}, refresh=True)
+
     def search(self, query: str):
         '''Query data'''
         res_docs = self.get_relevant_documents(query=query)
         return res_docs
 
+    def search_with_score(self, query: str) -> List[Tuple[Document, float]]:
+        '''Query data, return a list of (doc, BM25 score)'''
+        res = self.client.search(index=self.index_name, query={'match': {'content': query}}, size=TOP_K)
+        return [(Document(page_content=r['_source']['content']), r['_score']) for r in res['hits']['hits']]
+
     @staticmethod
     def connect(connection_args: dict = CONNECTION_ARGS):
-        client = elasticsearch.Elasticsearch(**connection_args)
-        return client
+        return get_client(connection_args)
 
     @staticmethod
     def drop(project: str, connection_args: dict = CONNECTION_ARGS):
@@ -0,0 +1,517 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain.vectorstores.base import VectorStore as BaseVectorStore
+from langchain.embeddings.base import Embeddings
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from config import VECTORDB_CONFIG  # pylint: disable=C0413
+from src.search_tuner import search_tuner, AUTO_TUNE  # pylint: disable=C0413
+
+
+logger = logging.getLogger('vector_store')
+
+DATA_DIR = VECTORDB_CONFIG.get('data_dir', './vector_data')
+TOP_K = VECTORDB_CONFIG.get('top_k', 3)
+INDEX_PARAMS = VECTORDB_CONFIG.get('index_params', None) or {}
+SEARCH_PARAMS = VECTORDB_CONFIG.get('search_params', None) or {}
+IVF_THRESHOLD = VECTORDB_CONFIG.get('ivf_threshold', 50000)
+
+MetadataFilter = Union[Dict[str, Any], Callable[[dict], bool]]
+
+
+def _kmeans(data: np.ndarray, nlist: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    '''Train nlist centroids on a sample of data by k-means.'''
+    rng = np.random.default_rng(seed)
+    sample = data[np.sort(rng.choice(len(data), size=min(len(data), nlist * 64), replace=False))]
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(sample, centroids)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=nlist)
+        nonempty = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        centroids[nonempty] = np.add.reduceat(sample[order], starts) / counts[nonempty, None]
+    return centroids
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    '''Assign each vector to the nearest centroid in L2 distance.'''
+    half_norms = (centroids ** 2).sum(axis=1) / 2
+    assign = np.empty(len(data), dtype=np.int32)
+    for i in range(0, len(data), batch_size):
+        assign[i:i + batch_size] = np.argmax(data[i:i + batch_size] @ centroids.T - half_norms, axis=1)
+    return assign
+
+
+class LocalIndex:
+    '''Vectors of a project saved in a directory, searched in process.
+
+    Vectors are appended to a float32 matrix file, which is memory mapped for search.
+    Rows (text & metadata) are appended as json lines, primary keys are row numbers.
+    Search is exact by default. Once there are more than ivf_threshold rows, an IVF index is trained by k-means,
+    and queries only scan vectors in the nprobe nearest clusters.
+    The IVF index is retrained when the number of rows doubles, vectors added in between are assigned to trained clusters.
+    '''
+
+    def __init__(self, path: str, metric_type: str = INDEX_PARAMS.get('metric_type', 'IP'),
+                 nlist: int = INDEX_PARAMS.get('params', {}).get('nlist', 1024), ivf_threshold: int = IVF_THRESHOLD):
+        self.path = path
+        self.metric_type = metric_type.upper()
+        self.nlist = nlist
+        self.ivf_threshold = ivf_threshold
+        self.dim = None
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.rows = []
+        self.live = np.ones(0, dtype=bool)
+        self.deleted = set()
+        self.centroids = None
+        self.assign = np.zeros(0, dtype=np.int32)
+        self._lists = None
+        self._trained_size = 0
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, 'meta.json'))
+
+    @property
+    def index_type(self) -> str:
+        return 'FLAT' if self.centroids is None else 'IVF_FLAT'
+
+    def _load(self):
+        if not self.exists:
+            return
+        with open(os.path.join(self.path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+        self.metric_type = meta['metric_type']
+        self._load_rows()
+        self._map_vectors()
+        self.live = np.ones(len(self.rows), dtype=bool)
+        deleted_path = os.path.join(self.path, 'deleted.json')
+        if os.path.exists(deleted_path):
+            with open(deleted_path, 'r', encoding='utf-8') as f:
+                self._mask(json.load(f))
+        ivf_path = os.path.join(self.path, 'ivf.npz')
+        if os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            self.centroids = ivf['centroids']
+            self.assign = ivf['assign'][:len(self.rows)]
+            self._trained_size = len(self.assign)
+            if len(self.assign) < len(self.rows):
+                self.assign = np.concatenate([self.assign, _assign(self.vectors[len(self.assign):], self.centroids)])
+
+    def _load_rows(self):
+        '''Load rows, and truncate rows & vectors files to the rows with both written completely,
+        so that an interrupted add does not shift primary keys of later rows away from their vectors.'''
+        rows_path = os.path.join(self.path, 'rows.jsonl')
+        vectors_path = os.path.join(self.path, 'vectors.f32')
+        lines = [b'']
+        if os.path.exists(rows_path):
+            with open(rows_path, 'rb') as f:
+                lines = f.read().split(b'\n')
+        # The last piece is empty unless the last line is torn
+        rows, ends, end = [], [0], 0
+        for line in lines[:-1]:
+            end += len(line) + 1
+            if line.strip():
+                rows.append(json.loads(line))
+                ends.append(end)
+        row_size = 4 * self.dim
+        vectors_size = os.path.getsize(vectors_path)
+        num = min(len(rows), vectors_size // row_size)
+        if num < len(rows) or lines[-1] or vectors_size != num * row_size:
+            logger.warning('Truncating %s to %s rows, as %s rows & %s vectors are not completely written.',
+                           self.path, num, len(rows), vectors_size // row_size)
+            with open(rows_path, 'ab') as f:
+                f.truncate(ends[num])
+            with open(vectors_path, 'r+b') as f:
+                f.truncate(num * row_size)
+        self.rows = rows[:num]
+
+    def _map_vectors(self):
+        size = os.path.getsize(os.path.join(self.path, 'vectors.f32')) // (4 * self.dim)
+        if size == 0:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        else:
+            self.vectors = np.memmap(os.path.join(self.path, 'vectors.f32'), dtype=np.float32, mode='r',
+                                     shape=(size, self.dim))
+
+    def add(self, embeddings: np.ndarray, rows: List[dict]) -> List[int]:
+        '''Append vectors with rows of text & metadata, return primary keys.'''
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        assert embeddings.ndim == 2 and len(embeddings) == len(rows), 'Each row must have an embedding.'
+        with self._lock:
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                os.makedirs(self.path, exist_ok=True)
+                with open(os.path.join(self.path, 'vectors.f32'), 'wb'):
+                    pass
+                with open(os.path.join(self.path, 'meta.json'), 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim, 'metric_type': self.metric_type}, f)
+            assert embeddings.shape[1] == self.dim, f'Embedding dim {embeddings.shape[1]} does not match {self.dim}.'
+
+            start = len(self.rows)
+            pks = list(range(start, start + len(rows)))
+            vectors_path = os.path.join(self.path, 'vectors.f32')
+            rows_path = os.path.join(self.path, 'rows.jsonl')
+            sizes = {path: os.path.getsize(path) if os.path.exists(path) else 0 for path in [vectors_path, rows_path]}
+            try:
+                with open(vectors_path, 'ab') as f:
+                    f.write(embeddings.tobytes())
+                with open(rows_path, 'ab') as f:
+                    f.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8'))
+            except Exception:
+                # Roll back the partial write, otherwise later rows would not match their vectors
+                for path, size in sizes.items():
+                    if os.path.exists(path):
+                        with open(path, 'r+b') as f:
+                            f.truncate(size)
+                raise
+            self.rows.extend(rows)
+            self.live = np.concatenate([self.live, np.ones(len(rows), dtype=bool)])
+            self._map_vectors()
+
+            if self.centroids is not None:
+                self.assign = np.concatenate([self.assign, _assign(embeddings, self.centroids)])
+                self._lists = None
+            if len(self.rows) >= self.ivf_threshold and len(self.rows) >= 2 * self._trained_size:
+                self.train()
+        self.tune()
+        return pks
+
+    def train(self):
+        '''Train the IVF index on all vectors.'''
+        with self._lock:
+            # About sqrt(n) lists, each list has enough vectors to train its centroid
+            nlist = max(1, min(self.nlist, int(np.sqrt(len(self.rows))), len(self.rows) // 39))
+            self.centroids = _kmeans(self.vectors, nlist)
+            self.assign = _assign(self.vectors, self.centroids)
+            self._lists = None
+            self._trained_size = len(self.assign)
+            # Tuned nprobe is for the old lists
+            search_tuner.invalidate(self.path)
+            np.savez(os.path.join(self.path, 'ivf.npz'), centroids=self.centroids, assign=self.assign)
+            logger.debug('Trained IVF index of %s vectors with %s lists: %s', len(self.assign), nlist, self.path)
+
+    def tune(self, auto_tune: bool = AUTO_TUNE):
+        '''Tune nprobe of the IVF index in background if it has grown enough since last tuning.'''
+        if not auto_tune or self.centroids is None:
+            return None
+        return search_tuner.schedule(self.path, self.count(), self._tune)
+
+    def _tune(self) -> dict:
+        # Live vectors are sampled randomly as queries, each query is left out of its own results
+        live = np.flatnonzero(self.live)
+        rng = np.random.default_rng(0)
+        pks = np.sort(rng.choice(live, size=min(len(live), search_tuner.sample_size), replace=False))
+        queries = np.asarray(self.vectors[pks])
+
+        def _search(params):
+            hits = self.search(queries, k=search_tuner.k + 1, nprobe=params.get('nprobe'))
+            return [[pk for pk, _ in x] for x in hits]
+
+        return search_tuner.tune(_search, {'index_type': self.index_type, 'params': {'nlist': len(self.centroids)}},
+                                 query_ids=pks.tolist())
+
+    def delete(self, pks: Iterable[int]):
+        with self._lock:
+            if not self.exists:
+                return
+            self._mask(pks)
+            with open(os.path.join(self.path, 'deleted.json'), 'w', encoding='utf-8') as f:
+                json.dump(sorted(self.deleted), f)
+
+    def _mask(self, pks: Iterable[int]):
+        for pk in pks:
+            pk = int(pk)
+            if 0 <= pk < len(self.live):
+                self.live[pk] = False
+                self.deleted.add(pk)
+
+    def count(self) -> int:
+        return len(self.rows) - len(self.deleted)
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        lists = self._lists
+        if lists is None:
+            order = np.argsort(self.assign, kind='stable')
+            bounds = np.cumsum(np.bincount(self.assign, minlength=len(self.centroids)))[:-1]
+            lists = self._lists = np.split(order, bounds)
+        return lists
+
+    def search(self, queries: np.ndarray, k: int = TOP_K, nprobe: Optional[int] = None,
+               metadata_filter: Optional[MetadataFilter] = None) -> List[List[Tuple[int, float]]]:
+        '''Search a batch of query vectors, return top k (primary key, score) of each query.
+        Scores are inner products for IP metric, or L2 distances for L2 metric, the same as Milvus.'''
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        with self._lock:
+            vectors, live, assign = self.vectors, self.live, self.assign
+            centroids = self.centroids
+            lists = self._inverted_lists() if centroids is not None else None
+        if len(vectors) == 0:
+            return [[] for _ in queries]
+
+        mask = live[:len(vectors)]
+        if metadata_filter is not None:
+            mask = mask & self._filter_mask(metadata_filter, len(vectors))
+
+        if centroids is None or len(assign) < len(vectors):
+            return self._top_k(queries, vectors, np.flatnonzero(mask), k)
+
+        if nprobe is None:
+            tuned = search_tuner.get(self.path) if AUTO_TUNE else None
+            nprobe = (tuned or SEARCH_PARAMS.get('params', {})).get('nprobe', 16)
+        nprobe = min(nprobe, len(centroids))
+        # Probe the lists nearest in L2 distance, as vectors are assigned to them by _assign
+        half_norms = (centroids ** 2).sum(axis=1) / 2
+        probes = np.argpartition(half_norms - queries @ centroids.T, nprobe - 1, axis=1)[:, :nprobe]
+        res = []
+        for q, probe in zip(queries, probes):
+            candidates = np.concatenate([lists[c] for c in probe])
+            candidates = candidates[mask[candidates]]
+            res.extend(self._top_k(q[None, :], vectors, candidates, k))
+        return res
+
+    def _top_k(self, queries: np.ndarray, vectors: np.ndarray, candidates: np.ndarray,
+               k: int) -> List[List[Tuple[int, float]]]:
+        '''Score candidates for all queries by one matrix product, return top k (primary key, score) of each query.'''
+        if len(candidates) == 0:
+            return [[] for _ in queries]
+        candidates = np.sort(candidates)
+        data = vectors if len(candidates) == len(vectors) else vectors[candidates]
+        if self.metric_type == 'L2':
+            # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2
+            scores = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ data.T + (data ** 2).sum(axis=1)
+            order_scores = -scores
+        else:
+            scores = queries @ data.T
+            order_scores = scores
+        if len(candidates) > k:
+            top = np.argpartition(-order_scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(len(candidates)), (len(queries), 1))
+        res = []
+        for i, row in enumerate(top):
+            row = row[np.argsort(-order_scores[i, row])]
+            res.append([(int(candidates[j]), float(scores[i, j])) for j in row])
+        return res
+
+    def _filter_mask(self, metadata_filter: MetadataFilter, size: int) -> np.ndarray:
+        if callable(metadata_filter):
+            match = metadata_filter
+        else:
+            def match(row):
+                return all(row.get(key) == value for key, value in metadata_filter.items())
+        return np.fromiter((match(row) for row in self.rows[:size]), dtype=bool, count=size)
+
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def get_index(project: str, data_dir: str = DATA_DIR) -> LocalIndex:
+    '''Get the index of project shared in process, loaded from disk once.'''
+    path = os.path.abspath(os.path.join(data_dir, project))
+    with indexes_lock:
+        if path not in indexes:
+            indexes[path] = LocalIndex(path)
+        return indexes[path]
+
+
+class VectorStore(BaseVectorStore):
+    '''
+    Vector database APIs: insert, search
+
+    Local alternative to the Milvus vector store, with vectors saved in data_dir and searched in process.
+    '''
+
+    def __init__(self, table_name: str, embedding_func: Embeddings = None, data_dir: str = DATA_DIR):
+        self.embedding_func = embedding_func
+        self.collection_name = table_name
+        self.data_dir = data_dir
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding_func
+
+    @property
+    def index(self) -> LocalIndex:
+        return get_index(self.collection_name, self.data_dir)
+
+    @property
+    def col(self) -> Optional[LocalIndex]:
+        '''The index if the project table exists, like the collection of Milvus vector store.'''
+        index = self.index
+        return index if index.exists else None
+
+    @property
+    def exists(self) -> bool:
+        return self.col is not None
+
+    @property
+    def metric_type(self) -> str:
+        '''Metric type of search, scores are distances for L2 and similarities for others.'''
+        return self.index.metric_type
+
+    def describe(self) -> dict:
+        '''Describe schema fields, vector dim, index type and index params.'''
+        index = self.index
+        fields = ['pk', 'vector'] + sorted({key for row in index.rows[:1] for key in row})
+        params = {} if index.centroids is None else {'nlist': len(index.centroids)}
+        index_params = {'metric_type': index.metric_type, 'index_type': index.index_type, 'params': params}
+        return {'schema': fields, 'dim': index.dim, 'index_type': index.index_type, 'index_params': index_params}
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[int]:
+        texts = list(texts)
+        if len(texts) == 0:
+            return []
+        embed_array = getattr(self.embedding_func, 'embed_documents_array', None)
+        embeddings = embed_array(texts) if embed_array else self.embedding_func.embed_documents(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        rows = [{'text': text, **metadata} for text, metadata in zip(texts, metadatas)]
+        return self.index.add(np.asarray(embeddings, dtype=np.float32), rows)
+
+    def insert(self, data: List[str], metadatas: Optional[List[dict]] = None):
+        '''Insert data'''
+        pks = self.add_texts(texts=data, metadatas=metadatas)
+        return len(pks)
+
+    def insert_embeddings(self, data: Union[List[List[float]], np.ndarray], metadatas: List[dict], **kwargs: Any):
+        '''Insert embeddings with texts, embeddings can be a 2-D float32 array'''
+        if len(data) == 0:
+            logger.debug('Nothing to insert, skipping.')
+            return 0
+        rows = [dict(d) for d in metadatas]
+        pks = self.index.add(np.asarray(data, dtype=np.float32), rows)
+        return len(pks)
+
+    def find_texts(self, texts: Iterable[str]) -> List[int]:
+        '''Find primary keys of live entities whose text is one of texts.'''
+        index = self.col
+        if index is None:
+            return []
+        texts = set(texts)
+        return [pk for pk, row in enumerate(index.rows) if index.live[pk] and row.get('text') in texts]
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        '''Delete entities by primary keys'''
+        if not ids:
+            return False
+        assert self.col, f'No project table: {self.collection_name}'
+        self.index.delete(ids)
+        return True
+
+    def similarity_search(self, query: str, k: int = TOP_K, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = TOP_K,
+        metadata_filter: Optional[MetadataFilter] = None,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = self.embedding_func.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k=k, metadata_filter=metadata_filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = TOP_K, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = TOP_K,
+        metadata_filter: Optional[MetadataFilter] = None,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.batch_similarity_search_with_score_by_vector(
+            embeddings=[embedding], k=k, metadata_filter=metadata_filter, **kwargs)[0]
+
+    def batch_similarity_search_with_score_by_vector(
+        self,
+        embeddings: List[List[float]],
+        k: int = TOP_K,
+        metadata_filter: Optional[MetadataFilter] = None,
+        nprobe: Optional[int] = None,
+        **kwargs: Any
+    ) -> List[List[Tuple[Document, float]]]:
+        '''Search multiple vectors at once, return a list of (doc, score) pairs for each vector.
+        metadata_filter is a dict of metadata values to match, or a function of row metadata.'''
+        index = self.col
+        if index is None:
+            raise RuntimeError('No existing collection to search.')
+        batch_hits = index.search(np.asarray(embeddings, dtype=np.float32), k=k, nprobe=nprobe,
+                                  metadata_filter=metadata_filter)
+        batch_ret = []
+        for hits in batch_hits:
+            ret = []
+            for pk, score in hits:
+                meta = dict(index.rows[pk])
+                text = meta.pop('text')
+                page_content = meta.pop('doc') if 'doc' in meta else text
+                meta['pk'] = pk
+                ret.append((Document(page_content=page_content, metadata=meta), score))
+            batch_ret.append(ret)
+        return batch_ret
+
+    def search(self, query: str) -> List[Document]:
+        '''Query data'''
+        return [doc for doc, _ in self.search_with_score(query)]
+
+    def search_with_score(self, query: str) -> List[Tuple[Document, float]]:
+        '''Query data, return a list of (doc, score)'''
+        assert self.col, f'No project table: {self.collection_name}'
+        return self.similarity_search_with_score(query=query, k=TOP_K)
+
+    def batch_search(self, embeddings: List[List[float]]) -> List[List[Document]]:
+        '''Query data with a batch of query embeddings'''
+        return [[doc for doc, _ in pairs] for pairs in self.batch_search_with_score(embeddings)]
+
+    def batch_search_with_score(self, embeddings: List[List[float]]) -> List[List[Tuple[Document, float]]]:
+        '''Query data with a batch of query embeddings, return lists of (doc, score)'''
+        assert self.col, f'No project table: {self.collection_name}'
+        return self.batch_similarity_search_with_score_by_vector(embeddings=embeddings, k=TOP_K)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        table_name: str = 'akcio',
+        **kwargs: Any
+    ) -> 'VectorStore':
+        store = cls(table_name=table_name, embedding_func=embedding, **kwargs)
+        store.add_texts(texts=texts, metadatas=metadatas)
+        return store
+
+    @staticmethod
+    def drop(project: str, data_dir: str = DATA_DIR):
+        if not VectorStore.has_project(project=project, data_dir=data_dir):
+            raise AttributeError(f'No table in vector db: {project}')
+        path = os.path.abspath(os.path.join(data_dir, project))
+        with indexes_lock:
+            indexes.pop(path, None)
+        search_tuner.invalidate(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def has_project(project: str, data_dir: str = DATA_DIR):
+        return os.path.exists(os.path.join(data_dir, project, 'meta.json'))
+
+    @staticmethod
+    def count_entities(project: str, data_dir: str = DATA_DIR):
+        if not VectorStore.has_project(project=project, data_dir=data_dir):
+            return 0
+        return get_index(project, data_dir).count()
@@ -1,8 +1,10 @@
 import os
 import sys
+import json
 import logging
-from typing import Optional, Any, Tuple, List, Dict, Union
-from uuid import uuid4
+from typing import Optional, Any, Tuple, List, Dict, Iterable, Union
+
+import numpy as np
 
 from langchain.vectorstores import Milvus
 from langchain.embeddings.base import Embeddings
@@ -11,6 +13,9 @@ from langchain.docstore.document import Document
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
 
 from config import VECTORDB_CONFIG  # pylint: disable=C0413
+from src.catalog import catalog  # pylint: disable=C0413
+from src.milvus_registry import milvus_registry  # pylint: disable=C0413
+from src.search_tuner import search_tuner, AUTO_TUNE, AUTO_INDEX  # pylint: disable=C0413
 
 
 logger = logging.getLogger('vector_store')
@@ -19,87 +24,204 @@ CONNECTION_ARGS = VECTORDB_CONFIG.get('connection_args', {'uri': 'http://localho
 TOP_K = VECTORDB_CONFIG.get('top_k', 3)
 INDEX_PARAMS = VECTORDB_CONFIG.get('index_params', None)
 SEARCH_PARAMS = VECTORDB_CONFIG.get('search_params', None)
+SHARED_COLLECTION = VECTORDB_CONFIG.get('shared_collection', None)
+NUM_PARTITIONS = VECTORDB_CONFIG.get('num_partitions', 64)
+PROJECT_FIELD = 'project'
+DOC_FIELD = 'doc'
+
+
+def project_expr(project: str, expr: Optional[str] = None) -> str:
+    '''Filter expression of entities in project, combined with expr if given.'''
+    project_filter = f'{PROJECT_FIELD} == {json.dumps(project)}'
+    return f'({project_filter}) and ({expr})' if expr else project_filter
 
 
 class VectorStore(Milvus):
     '''
     Vector database APIs: insert, search
+
+    If shared_collection is set, projects are stored in that collection instead of one collection for each,
+    partitioned by the project field as partition key. Operations of a project are filtered by project.
     '''
 
-    def __init__(self, table_name: str, embedding_func: Embeddings = None, connection_args: dict = CONNECTION_ARGS):
+    def __init__(self, table_name: str, embedding_func: Embeddings = None, connection_args: dict = CONNECTION_ARGS,
+                 shared_collection: Optional[str] = SHARED_COLLECTION):
         '''Initialize vector db
 
         connection_args:
             uri: milvus or zilliz uri
             token: zilliz token
+        shared_collection: name of the collection shared by projects, None for a collection per project
         '''
         # assert isinstance(
         #     embedding_func, Embeddings), 'Invalid embedding function. Only accept langchain.embeddings.'
         self.embedding_func = embedding_func
         self.connect_args = connection_args
-        self.collection_name = table_name
+        self.project = table_name
+        self.shared = bool(shared_collection)
+        self.collection_name = shared_collection or table_name
         super().__init__(
             embedding_function=self.embedding_func,
             collection_name=self.collection_name,
             connection_args=self.connect_args,
-            index_params=INDEX_PARAMS,
+            # New collections start with a FLAT index, which is rebuilt as they grow
+            index_params=search_tuner.recommend_index(0, (INDEX_PARAMS or {}).get('metric_type', 'IP')) if AUTO_INDEX else INDEX_PARAMS,
             search_params=SEARCH_PARAMS
         )
 
-    def _create_connection_alias(self, connection_args: dict) -> str:
-        """Create the connection to the Milvus server."""
-        from pymilvus import MilvusException, connections  # pylint: disable = C0415
-
-        # Grab the connection arguments that are used for checking existing connection
-        host: str = connection_args.get('host', None)
-        port: Union[str, int] = connection_args.get('port', None)
-        uri: str = connection_args.get('uri', None)
-        user = connection_args.get('user', None)
-        password = connection_args.get('password', None)
-        token = connection_args.get('token', None)
-
-
-        _connection_args = {}  # pylint: disable = C0103
-        # Order of use is uri > host/port
-        if uri is not None:
-            _connection_args['uri'] = uri
-            given_address = uri.split('://')[1]
-        elif host is not None and port is not None:
-            _connection_args['host'] = host
-            _connection_args['port'] = port
-            given_address = f'{host}:{port}'
-        else:
-            logger.debug('Missing standard address type for reuse attempt')
-            given_address = None
-
-        # Order of use is token > user/password
-        if token is not None:
-            _connection_args['token'] = token
-            _connection_args['secure'] = True
-        elif user is not None and password is not None:
-            _connection_args['user'] = user
-            _connection_args['password'] = password
-            _connection_args['secure'] = True
-        else:
-            _connection_args['secure'] = False
-
-        # If a valid address was given, then check if a connection exists
-        if given_address is not None:
-            for con in connections.list_connections():
-                addr = connections.get_connection_addr(con[0])
-                if addr == given_address:
-                    logger.debug('Using previous connection: %s', con[0])
-                    return con[0]
-
-        # Generate a new connection if one doesn't exist
-        alias = uuid4().hex
+    @property
+    def exists(self) -> bool:
+        '''Whether the project has been created, or has entities in the shared collection.'''
+        if self.col is None:
+            return False
+        if self.shared:
+            return VectorStore.has_project(self.project, self.connect_args, shared_collection=self.collection_name)
+        return True
+
+    @property
+    def metric_type(self) -> str:
+        '''Metric type of search, scores are distances for L2 and similarities for others.'''
+        return (self.search_params or INDEX_PARAMS or {}).get('metric_type', 'IP').upper()
+
+    def describe(self) -> dict:
+        '''Describe schema fields, vector dim, index type and index params of the collection.'''
+        return milvus_registry.describe(self.col)
+
+    def _index_params(self) -> dict:
+        '''Index params of the collection, read from the project catalog and described only if missing.'''
+        return catalog.get(self.project, 'index_params', lambda: self.describe()['index_params']) or {}
+
+    def _create_search_params(self) -> None:
+        self.default_search_params.setdefault('FLAT', {'metric_type': 'L2', 'params': {}})
+        super()._create_search_params()
+
+    def _search_params(self) -> Optional[dict]:
+        '''Search params tuned for the collection (by auto tune or rebuild_index), otherwise the configured ones.
+        Tuned params are shared by all stores of the collection in process.'''
+        tuned = search_tuner.get(self.collection_name)
+        if tuned is None:
+            return self.search_params
+        return {**(self.search_params or {}), 'params': tuned}
+
+    def tune(self) -> Optional[Any]:
+        '''Tune search params in background if the collection has grown enough since last tuning.
+        With auto index on, it also warns when the index no longer fits the collection size, see rebuild_index.'''
+        if not (AUTO_TUNE or AUTO_INDEX) or self.col is None:
+            return None
+        return search_tuner.schedule(self.collection_name, self.col.num_entities, self._tune)
+
+    def _tune(self) -> dict:
+        index_params = self._index_params()
+        if AUTO_INDEX:
+            recommended = search_tuner.recommend_index(self.col.num_entities, index_params.get('metric_type', 'IP'))
+            if search_tuner.should_rebuild(index_params, recommended):
+                # Rebuilding releases the collection and fails all searches meanwhile, so it is never done online
+                logger.warning('Index of %s does not fit %s entities any more, run offline_tools/rebuild_index.py to apply: %s',
+                               self.collection_name, self.col.num_entities, recommended)
+        if not AUTO_TUNE:
+            # Keep params tuned by the last rebuild
+            return {'params': search_tuner.get(self.collection_name)}
+        return self._tune_search(index_params)
+
+    def _tune_search(self, index_params: dict) -> dict:
+        # Stored vectors are sampled randomly as queries, each query is left out of its own results
+        pks = search_tuner.sample(self._iter_pks())
+        if len(pks) == 0:
+            return {'params': None}
+        rows = self.col.query(expr=f'{self._primary_field} in {list(pks)}',
+                              output_fields=[self._primary_field, self._vector_field])
+        vectors = {row[self._primary_field]: row[self._vector_field] for row in rows}
+        pks = [pk for pk in pks if pk in vectors]
+        queries = [vectors[pk] for pk in pks]
+
+        def _search(params):
+            res = self.col.search(data=queries, anns_field=self._vector_field, limit=search_tuner.k + 1,
+                                  param={**(self.search_params or {}), 'params': params})
+            return [[hit.id for hit in hits] for hits in res]
+
+        return search_tuner.tune(_search, index_params, query_ids=pks)
+
+    def _iter_pks(self, batch_size: int = 10000) -> Iterable[int]:
+        '''Iterate primary keys of all entities in the collection.'''
+        iterator = self.col.query_iterator(batch_size=batch_size, expr=f'{self._primary_field} >= 0',
+                                           output_fields=[self._primary_field])
         try:
-            connections.connect(alias=alias, **_connection_args)
-            logger.debug('Created new connection using: %s', alias)
-            return alias
-        except MilvusException as e:
-            logger.error('Failed to create new connection using: %s', alias)
-            raise e
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    return
+                for row in batch:
+                    yield row[self._primary_field]
+        finally:
+            iterator.close()
+
+    def rebuild_index(self, index_params: Optional[dict] = None) -> dict:
+        '''Rebuild the index with index_params, or the one recommended for the collection size,
+        then tune search params for the new index to meet the target recall.
+
+        The collection is released while building, and all searches of it fail meanwhile
+        (of all projects for a shared collection), so run it as an offline maintenance step.
+        '''
+        assert self.col is not None, f'No collection: {self.collection_name}'
+        count = self.col.num_entities
+        current = self._index_params()
+        index_params = index_params or search_tuner.recommend_index(count, current.get('metric_type', 'IP'))
+        logger.info('Rebuilding index of %s: %s', self.collection_name, index_params)
+        self.col.release()
+        self.col.drop_index()
+        self.col.create_index(self._vector_field, index_params=index_params)
+        self.col.load()
+        catalog.update(self.project, **self.describe())
+        res = self._tune_search(index_params)
+        search_tuner.record(self.collection_name, count, res)
+        return res
+
+    def _create_collection(self, embeddings: list, metadatas: Optional[List[dict]] = None) -> None:
+        if not self.shared:
+            super()._create_collection(embeddings, metadatas)
+            return
+
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema  # pylint: disable=C0415
+
+        # Schema of the shared collection is fixed, as metadata of projects may differ
+        fields = [
+            FieldSchema(PROJECT_FIELD, DataType.VARCHAR, max_length=255, is_partition_key=True),
+            FieldSchema(DOC_FIELD, DataType.VARCHAR, max_length=65_535),
+            FieldSchema(self._text_field, DataType.VARCHAR, max_length=65_535),
+            FieldSchema(self._primary_field, DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema(self._vector_field, DataType.FLOAT_VECTOR, dim=len(embeddings[0]))
+        ]
+        self.col = Collection(
+            name=self.collection_name,
+            schema=CollectionSchema(fields),
+            consistency_level=self.consistency_level,
+            using=self.alias,
+            num_partitions=NUM_PARTITIONS
+        )
+
+    def _with_project(self, metadatas: Optional[List[dict]], size: int) -> Optional[List[dict]]:
+        '''Tag metadatas with project for the shared collection.'''
+        if not self.shared:
+            return metadatas
+        metadatas = metadatas or [{} for _ in range(size)]
+        return [{**m, PROJECT_FIELD: self.project, DOC_FIELD: m.get(DOC_FIELD, '')} for m in metadatas]
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        embed_array = getattr(self.embedding_func, 'embed_documents_array', None)
+        if embed_array is None:
+            pks = super().add_texts(texts=texts, metadatas=self._with_project(metadatas, len(texts)), **kwargs)
+        else:
+            # Insert float32 array of embeddings as it is, instead of lists of python floats
+            metadatas = metadatas or [{} for _ in texts]
+            pks = self._insert_embeddings(
+                embed_array(texts), [{**m, 'text': t} for t, m in zip(texts, metadatas)], **kwargs)
+        self.tune()
+        return pks
+
+    def _create_connection_alias(self, connection_args: dict) -> str:
+        """Get a pooled connection to the Milvus server from the shared registry."""
+        return milvus_registry.get_alias(connection_args)
 
     def similarity_search_with_score_by_vector(
         self,
@@ -110,11 +232,32 @@ class VectorStore(Milvus):
         timeout: Optional[int] = None,
         **kwargs: Any,
     ) -> List[Tuple[Document, float]]:
+        return self.batch_similarity_search_with_score_by_vector(
+            embeddings=[embedding],
+            k=k,
+            param=param,
+            expr=expr,
+            timeout=timeout,
+            **kwargs
+        )[0]
+
+    def batch_similarity_search_with_score_by_vector(
+        self,
+        embeddings: List[List[float]],
+        k: int = 4,
+        param: Optional[dict] = None,
+        expr: Optional[str] = None,
+        timeout: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[List[Tuple[Document, float]]]:
+        '''Search multiple vectors in one request, return a list of (doc, score) pairs for each vector.'''
         if self.col is None:
             raise RuntimeError('No existing collection to search.')
 
         if param is None:
-            param = self.search_params
+            param = self._search_params()
+        if self.shared:
+            expr = project_expr(self.project, expr)
 
         # Determine result metadata fields.
         output_fields = self.fields[:]
@@ -122,7 +265,7 @@ class VectorStore(Milvus):
 
         # Perform the search.
         res = self.col.search(
-            data=[embedding],
+            data=list(embeddings),
             anns_field=self._vector_field,
             param=param,
             limit=k,
@@ -132,18 +275,25 @@ class VectorStore(Milvus):
             **kwargs,
         )
         # Organize results.
-        ret = []
         if 'doc' in output_fields:
             doc_field = 'doc'
         else:
             doc_field = self._text_field
-        for result in res[0]:
-            meta = {x: result.entity.get(x) for x in output_fields}
-            doc = Document(page_content=meta.pop(doc_field), metadata=meta)
-            pair = (doc, result.score)
-            ret.append(pair)
-
-        return ret
+        batch_ret = []
+        for hits in res:
+            ret = []
+            for result in hits:
+                meta = {x: result.entity.get(x) for x in output_fields}
+                if self.shared:
+                    meta.pop(PROJECT_FIELD)
+                    doc = Document(page_content=meta.pop(DOC_FIELD) or meta[self._text_field], metadata=meta)
+                else:
+                    doc = Document(page_content=meta.pop(doc_field), metadata=meta)
+                pair = (doc, result.score)
+                ret.append(pair)
+            batch_ret.append(ret)
+
+        return batch_ret
 
     def insert(self, data: List[str], metadatas: Optional[List[dict]] = None):
         '''Insert data'''
@@ -154,16 +304,29 @@ class VectorStore(Milvus):
         return len(pks)
 
     def insert_embeddings(self,
-                          data: List[float],
+                          data: Union[List[List[float]], np.ndarray],
                           metadatas: List[dict],
                           timeout: Optional[int] = None,
                           batch_size: int = 1000,
                           **kwargs: Any
                           ):
-        '''Insert embeddings with texts'''
+        '''Insert embeddings with texts, embeddings can be a 2-D float32 array'''
+        pks = self._insert_embeddings(data, metadatas, timeout=timeout, batch_size=batch_size, **kwargs)
+        self.tune()
+        return len(pks)
+
+    def _insert_embeddings(self,
+                           data: Union[List[List[float]], np.ndarray],
+                           metadatas: List[dict],
+                           timeout: Optional[int] = None,
+                           batch_size: int = 1000,
+                           **kwargs: Any
+                           ) -> List:
         from pymilvus import Collection, MilvusException  # pylint: disable=C0415
 
-        embeddings = list(data)
+        # Rows of an array are sliced by batch without copy
+        embeddings = data if isinstance(data, np.ndarray) else list(data)
+        metadatas = self._with_project(metadatas, len(embeddings))
         texts = []
         for d in metadatas:
             texts.append(d.pop('text'))
@@ -177,7 +340,7 @@ class VectorStore(Milvus):
             self._init(embeddings, metadatas)
 
         # Dict to hold all insert columns
-        insert_dict: Dict[str, list] = {
+        insert_dict: Dict[str, Any] = {
             self._text_field: texts,
             self._vector_field: embeddings,
         }
@@ -189,7 +352,7 @@ class VectorStore(Milvus):
                     insert_dict.setdefault(key, []).append(value)
 
         # Total insert count
-        vectors: list = insert_dict[self._vector_field]
+        vectors = insert_dict[self._vector_field]
         total_count = len(vectors)
 
         pks: List[str] = []
@@ -210,36 +373,83 @@ class VectorStore(Milvus):
                     'Failed to insert batch starting at entity: %s/%s', i, total_count
                 )
                 raise e
-        return len(pks)
+        return pks
+
 
+    def find_texts(self, texts: Iterable[str], batch_size: int = 100) -> List[int]:
+        '''Find primary keys of entities whose text is one of texts.'''
+        if self.col is None:
+            return []
+        texts = list(set(texts))
+        pks = []
+        for i in range(0, len(texts), batch_size):
+            expr = f'{self._text_field} in [{",".join(json.dumps(t) for t in texts[i:i + batch_size])}]'
+            if self.shared:
+                expr = project_expr(self.project, expr)
+            pks.extend(row[self._primary_field] for row in self.col.query(expr=expr, output_fields=[self._primary_field]))
+        return pks
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        '''Delete entities by primary keys'''
+        if not ids:
+            return False
+        assert self.col, f'No project table: {self.collection_name}'
+        expr = f'{self._primary_field} in [{",".join(str(int(i)) for i in ids)}]'
+        if self.shared:
+            expr = project_expr(self.project, expr)
+        self.col.delete(expr=expr, **kwargs)
+        return True
 
     def search(self, query: str) -> List[Document]:
         '''Query data'''
+        return [doc for doc, _ in self.search_with_score(query)]
+
+    def search_with_score(self, query: str) -> List[Tuple[Document, float]]:
+        '''Query data, return a list of (doc, score)'''
         assert self.col, f'No project table: {self.collection_name}'
-        docs = self.similarity_search(
+        pairs = self.similarity_search_with_score(
             query=query,
             k=TOP_K,
-            param=self.search_params
+            param=self._search_params()
         )
+        return self._clean_pairs(pairs)
+
+    def batch_search(self, embeddings: List[List[float]]) -> List[List[Document]]:
+        '''Query data with a batch of query embeddings in one search request'''
+        return [[doc for doc, _ in pairs] for pairs in self.batch_search_with_score(embeddings)]
+
+    def batch_search_with_score(self, embeddings: List[List[float]]) -> List[List[Tuple[Document, float]]]:
+        '''Query data with a batch of query embeddings in one search request, return lists of (doc, score)'''
+        assert self.col, f'No project table: {self.collection_name}'
+        batch_pairs = self.batch_similarity_search_with_score_by_vector(
+            embeddings=embeddings,
+            k=TOP_K,
+            param=self._search_params()
+        )
+        return [self._clean_pairs(pairs) for pairs in batch_pairs]
+
+    @staticmethod
+    def _clean_pairs(pairs: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
         res = []
-        for doc in docs:
+        for doc, score in pairs:
             if 'text' in doc.metadata:
                 del doc.metadata['text']
-            res.append(doc)
+            res.append((doc, score))
         return res
 
     @staticmethod
-    def connect(connection_args: dict = CONNECTION_ARGS):
-        from pymilvus import connections  # pylint: disable=C0415
-
-        connections.connect(**connection_args)
+    def connect(connection_args: dict = CONNECTION_ARGS) -> str:
+        return milvus_registry.get_alias(connection_args)
 
     @staticmethod
-    def drop(project: str, connection_args: dict = CONNECTION_ARGS):
-        if VectorStore.has_project(project=project, connection_args=connection_args):
-            from pymilvus import Collection  # pylint: disable=C0415
-
-            collection = Collection(project)
+    def drop(project: str, connection_args: dict = CONNECTION_ARGS, shared_collection: Optional[str] = SHARED_COLLECTION):
+        if VectorStore.has_project(project=project, connection_args=connection_args, shared_collection=shared_collection):
+            if shared_collection:
+                # Delete entities of the project, instead of dropping the shared collection
+                collection = milvus_registry.get_collection(shared_collection, connection_args)
+                collection.delete(expr=project_expr(project))
+                return
+            collection = milvus_registry.get_collection(project, connection_args)
             # confirm = input(f'Confirm to drop table {project} vector db (y/n): ')
             # if confirm == 'y':
             try:
@@ -247,21 +457,26 @@ class VectorStore(Milvus):
                 collection.drop()
             except Exception as e:
                 raise RuntimeError from e
+            finally:
+                milvus_registry.invalidate(project)
+                search_tuner.invalidate(project)
         else:
             raise AttributeError(f'No table in vector db: {project}')
 
     @staticmethod
-    def has_project(project: str, connection_args: dict = CONNECTION_ARGS):
-        from pymilvus import utility # pylint: disable=C0415
-
-        VectorStore.connect(connection_args)
-        return utility.has_collection(project)
+    def has_project(project: str, connection_args: dict = CONNECTION_ARGS, shared_collection: Optional[str] = SHARED_COLLECTION):
+        if shared_collection:
+            if not milvus_registry.has_collection(shared_collection, connection_args):
+                return False
+            collection = milvus_registry.get_collection(shared_collection, connection_args)
+            return len(collection.query(expr=project_expr(project), output_fields=['pk'], limit=1)) > 0
+        return milvus_registry.has_collection(project, connection_args)
 
 
     @staticmethod
-    def count_entities(project: str, connection_args: dict = CONNECTION_ARGS):
-        from pymilvus import Collection # pylint: disable=C0415
-
-        VectorStore.connect(connection_args)
-        collection = Collection(project)
+    def count_entities(project: str, connection_args: dict = CONNECTION_ARGS, shared_collection: Optional[str] = SHARED_COLLECTION):
+        if shared_collection:
+            collection = milvus_registry.get_collection(shared_collection, connection_args)
+            return collection.query(expr=project_expr(project), output_fields=['count(*)'])[0]['count(*)']
+        collection = milvus_registry.get_collection(project, connection_args)
         return collection.num_entities
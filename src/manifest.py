@@ -0,0 +1,104 @@
+import os
+import sys
+import hashlib
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select, MetaData, Table, Column, String, Integer, Index
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import MEMORYDB_CONFIG  # pylint: disable=C0413
+from src.engines import get_engine  # pylint: disable=C0413
+
+
+TABLE_NAME = 'akcio_manifest'
+
+
+class Manifest:
+    '''Ingestion manifest of each project: source -> chunk hashes -> primary keys in vector & scalar stores.
+    It is saved in the memory database, and used to sync sources incrementally.'''
+
+    def __init__(self, connect_str: str = MEMORYDB_CONFIG['connect_str'], table_name: str = TABLE_NAME):
+        self.engine = get_engine(connect_str)
+        self.meta = MetaData()
+        self.table = Table(
+            table_name, self.meta,
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('project', String(255), nullable=False),
+            Column('source', String(1000), nullable=False),
+            Column('chunk_hash', String(64), nullable=False),
+            Column('vector_pk', String(64)),
+            Column('scalar_id', String(64)),
+            Index(f'ix_{table_name}_project_source', 'project', 'source')
+        )
+        self.meta.create_all(self.engine)
+
+    @staticmethod
+    def hash_chunk(text) -> str:
+        if isinstance(text, str):
+            text = text.encode('utf-8')
+        return hashlib.sha256(text).hexdigest()
+
+    def get(self, project: str, source: str) -> List[Dict]:
+        '''Get manifest entries of the source in project.'''
+        query = self.table.select().where(self.table.c.project == project, self.table.c.source == source)
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(query)]  # pylint: disable=W0212
+
+    def sources(self, project: str) -> List[str]:
+        '''List all sources ingested in project.'''
+        query = select(self.table.c.source).distinct().where(self.table.c.project == project)
+        with self.engine.connect() as conn:
+            return [row.source for row in conn.execute(query)]
+
+    def keys(self, project: str) -> Tuple[Set[str], Set[str]]:
+        '''Get primary keys of all entries in project, as (vector pks, scalar ids).'''
+        query = select(self.table.c.vector_pk, self.table.c.scalar_id).where(self.table.c.project == project)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        return {r.vector_pk for r in rows if r.vector_pk is not None}, {r.scalar_id for r in rows if r.scalar_id is not None}
+
+    def add(self, project: str, source: str, entries: List[Dict]):
+        '''Add entries of the source, each entry is a dict with chunk_hash, vector_pk and scalar_id.'''
+        if len(entries) == 0:
+            return
+        data = [
+            {
+                'project': project, 'source': source, 'chunk_hash': e['chunk_hash'],
+                'vector_pk': None if e.get('vector_pk') is None else str(e['vector_pk']),
+                'scalar_id': None if e.get('scalar_id') is None else str(e['scalar_id'])
+            }
+            for e in entries
+        ]
+        with self.engine.connect() as conn:
+            conn.execute(self.table.insert(), data)
+            conn.commit()
+
+    def remove(self, project: str, source: Optional[str] = None, ids: Optional[List[int]] = None):
+        '''Remove entries of the project, filtered by source and/or entry ids if given.'''
+        query = self.table.delete().where(self.table.c.project == project)
+        if source is not None:
+            query = query.where(self.table.c.source == source)
+        if ids is not None:
+            if len(ids) == 0:
+                return
+            query = query.where(self.table.c.id.in_(ids))
+        with self.engine.connect() as conn:
+            conn.execute(query)
+            conn.commit()
+
+    @staticmethod
+    def diff(entries: List[Dict], chunks: List[str]):
+        '''Compare manifest entries with new chunks of the same source.
+        Return (new chunks to insert as a dict of chunk_hash -> chunk, stale entries to delete, unchanged count).'''
+        old_hashes = {e['chunk_hash'] for e in entries}
+        new_chunks = {}
+        current = set()
+        for chunk in chunks:
+            chunk_hash = Manifest.hash_chunk(chunk)
+            current.add(chunk_hash)
+            if chunk_hash not in old_hashes:
+                new_chunks.setdefault(chunk_hash, chunk)
+        stale = [e for e in entries if e['chunk_hash'] not in current]
+        unchanged = len(entries) - len(stale)
+        return new_chunks, stale, unchanged
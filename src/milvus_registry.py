@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+import logging
+import threading
+from itertools import count
+from uuid import uuid4
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import VECTORDB_CONFIG  # pylint: disable=C0413
+
+
+logger = logging.getLogger('milvus_registry')
+
+POOL_SIZE = VECTORDB_CONFIG.get('pool_size', 1)
+HEALTH_CHECK_INTERVAL = VECTORDB_CONFIG.get('health_check_interval', 30)
+
+
+class MilvusRegistry:
+    '''Process-wide registry of Milvus connection aliases and collection handles.
+    It is shared by the LangChain stores, Towhee pipelines and offline loaders, so the same connection args
+    always reuse a pool of aliases, and collections are not described again for every operation.
+    '''
+
+    def __init__(self, pool_size: int = POOL_SIZE, health_check_interval: float = HEALTH_CHECK_INTERVAL):
+        self.pool_size = max(pool_size, 1)
+        self.health_check_interval = health_check_interval
+        self._pools = {}  # connection key -> list of aliases
+        self._counters = {}  # connection key -> round robin counter
+        self._last_checks = {}  # alias -> last time of health check
+        self._collections = {}  # (alias, collection name) -> Collection
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def normalize_args(connection_args: dict) -> dict:
+        '''Keep args used to connect: uri > host/port, token > user/password.'''
+        args = {}
+        if connection_args.get('uri'):
+            args['uri'] = connection_args['uri']
+        elif connection_args.get('host') and connection_args.get('port'):
+            args['host'] = connection_args['host']
+            args['port'] = connection_args['port']
+        else:
+            raise AttributeError('Invalid connection args for milvus.')
+
+        if connection_args.get('token'):
+            args['token'] = connection_args['token']
+            args['secure'] = True
+        elif connection_args.get('user') and connection_args.get('password'):
+            args['user'] = connection_args['user']
+            args['password'] = connection_args['password']
+            args['secure'] = True
+        else:
+            args['secure'] = connection_args.get('secure', False)
+        return args
+
+    def get_alias(self, connection_args: dict) -> str:
+        '''Get a healthy alias from the pool of connection args, reconnect if the alias is broken.'''
+        args = self.normalize_args(connection_args)
+        key = tuple(sorted((k, str(v)) for k, v in args.items()))
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self.pool_size:
+                alias = self._connect(args)
+                pool.append(alias)
+                return alias
+            counter = self._counters.setdefault(key, count())
+            alias = pool[next(counter) % len(pool)]
+        if not self._is_healthy(alias):
+            logger.warning('Reconnecting unhealthy milvus connection: %s', alias)
+            self._reconnect(alias, args)
+        return alias
+
+    def get_collection(self, name: str, connection_args: dict):
+        '''Get the cached collection handle by name.'''
+        from pymilvus import Collection  # pylint: disable=C0415
+
+        alias = self.get_alias(connection_args)
+        with self._lock:
+            collection = self._collections.get((alias, name))
+        if collection is None:
+            collection = Collection(name, using=alias)
+            with self._lock:
+                self._collections[(alias, name)] = collection
+        return collection
+
+    def has_collection(self, name: str, connection_args: dict) -> bool:
+        from pymilvus import utility  # pylint: disable=C0415
+
+        alias = self.get_alias(connection_args)
+        return utility.has_collection(name, using=alias)
+
+    @staticmethod
+    def describe(collection) -> dict:
+        '''Describe schema fields, vector dim, index type and index params of the collection.'''
+        from pymilvus import DataType  # pylint: disable=C0415
+
+        meta = {'schema': [f.name for f in collection.schema.fields], 'dim': None, 'index_type': None, 'index_params': None}
+        for field in collection.schema.fields:
+            if field.dtype == DataType.FLOAT_VECTOR:
+                meta['dim'] = field.params.get('dim')
+        indexes = collection.indexes
+        if indexes:
+            meta['index_params'] = indexes[0].params
+            meta['index_type'] = indexes[0].params.get('index_type')
+        return meta
+
+    def invalidate(self, name: str = None):
+        '''Remove cached collection handles by name, or all handles if name is None.'''
+        with self._lock:
+            for key in list(self._collections):
+                if name is None or key[1] == name:
+                    del self._collections[key]
+
+    def _connect(self, args: dict) -> str:
+        from pymilvus import connections  # pylint: disable=C0415
+
+        alias = uuid4().hex
+        connections.connect(alias=alias, **args)
+        self._last_checks[alias] = time.time()
+        logger.debug('Created new connection using: %s', alias)
+        return alias
+
+    def _reconnect(self, alias: str, args: dict):
+        from pymilvus import connections  # pylint: disable=C0415
+
+        with self._lock:
+            try:
+                connections.disconnect(alias)
+            except Exception:  # pylint: disable=W0703
+                pass
+            connections.connect(alias=alias, **args)
+            self._last_checks[alias] = time.time()
+            for key in list(self._collections):
+                if key[0] == alias:
+                    del self._collections[key]
+
+    def _is_healthy(self, alias: str) -> bool:
+        from pymilvus import connections, utility  # pylint: disable=C0415
+
+        if not connections.has_connection(alias):
+            return False
+        now = time.time()
+        if now - self._last_checks.get(alias, 0) < self.health_check_interval:
+            return True
+        try:
+            utility.get_server_version(using=alias)
+        except Exception:  # pylint: disable=W0703
+            return False
+        self._last_checks[alias] = now
+        return True
+
+
+milvus_registry = MilvusRegistry()
@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import TEXTENCODER_CONFIG  # pylint: disable=C0413
+
+
+ONNX_DIR = TEXTENCODER_CONFIG.get('onnx_dir', './onnx_models')
+QUANTIZE = TEXTENCODER_CONFIG.get('quantize', True)
+NUM_THREADS = TEXTENCODER_CONFIG.get('num_threads', 0)
+POOLING = TEXTENCODER_CONFIG.get('pooling', None)
+MAX_LENGTH = 512
+
+
+def export(model_name: str, model_dir: str, quantize: bool = QUANTIZE) -> str:
+    '''Export the transformer of model_name to model_dir/model.onnx once, and quantize its weights to int8
+    dynamically into model_dir/model_int8.onnx if quantize. Return path of the onnx model to load.'''
+    fp32_path = os.path.join(model_dir, 'model.onnx')
+    int8_path = os.path.join(model_dir, 'model_int8.onnx')
+    if not os.path.exists(fp32_path):
+        import torch  # pylint: disable=C0415
+        from transformers import AutoModel, AutoTokenizer  # pylint: disable=C0415
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        inputs = tokenizer(['export onnx'], return_tensors='pt')
+        names = list(inputs.keys())
+
+        class Wrapper(torch.nn.Module):
+            '''Pass inputs by name, as the order of tokenizer outputs differs from forward args'''
+            def __init__(self):
+                super().__init__()
+                self.model = model
+
+            def forward(self, *args):  # pylint: disable=W0221
+                return self.model(**dict(zip(names, args))).last_hidden_state
+
+        os.makedirs(model_dir, exist_ok=True)
+        tmp_path = fp32_path + '.tmp'
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in names + ['last_hidden_state']}
+        with torch.no_grad():
+            torch.onnx.export(
+                Wrapper(), tuple(inputs[name] for name in names), tmp_path,
+                input_names=names, output_names=['last_hidden_state'],
+                dynamic_axes=dynamic_axes, opset_version=14
+            )
+        tokenizer.save_pretrained(model_dir)
+        os.replace(tmp_path, fp32_path)
+    if not quantize:
+        return fp32_path
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType  # pylint: disable=C0415
+
+        tmp_path = int8_path + '.tmp'
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+class OnnxEncoder:
+    '''Sentence encoder running an ONNX export of the transformer model on CPU by ONNX Runtime.
+
+    The model is exported from HuggingFace on first use and cached in model_dir,
+    with weights quantized to int8 by default. Token embeddings are pooled by CLS for BGE models, else by mean,
+    as sentence transformers does for them. It can be called with a text as a Towhee operator.
+    '''
+
+    def __init__(
+            self,
+            model_name: str,
+            model_dir: Optional[str] = None,
+            quantize: bool = QUANTIZE,
+            num_threads: int = NUM_THREADS,
+            pooling: Optional[str] = POOLING,
+            max_length: int = MAX_LENGTH
+            ):
+        import onnxruntime  # pylint: disable=C0415
+        from transformers import AutoTokenizer  # pylint: disable=C0415
+
+        self.model_name = model_name
+        self.model_dir = model_dir or os.path.join(ONNX_DIR, model_name.replace('/', '--'))
+        self.quantize = quantize
+        self.pooling = pooling or ('cls' if 'bge' in model_name.lower() else 'mean')
+        self.max_length = max_length
+
+        path = export(model_name, self.model_dir, quantize=quantize)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {x.name for x in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        '''Embed texts into a float32 array of shape (len(texts), dim), not normalized.'''
+        res = []
+        for i in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[i:i + batch_size], padding=True, truncation=True, max_length=self.max_length, return_tensors='np')
+            feed = {k: v.astype(np.int64) for k, v in inputs.items() if k in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            res.append(self._pool(hidden, inputs['attention_mask']))
+        if not res:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.ascontiguousarray(np.concatenate(res), dtype=np.float32)
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling == 'cls':
+            return hidden[:, 0]
+        mask = attention_mask[..., None].astype(hidden.dtype)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def __call__(self, text: str) -> np.ndarray:
+        return self.encode([text])[0]
+
+    def __deepcopy__(self, memo):
+        # The session is read only and can not be copied, share it with copies of configs
+        return self
+
+
+encoders = {}
+encoders_lock = threading.Lock()
+
+
+def get_encoder(model_name: str, quantize: bool = QUANTIZE, **kwargs) -> OnnxEncoder:
+    '''Get the encoder of model_name shared in process, exported and loaded once.'''
+    key = (model_name, quantize)
+    with encoders_lock:
+        if key not in encoders:
+            encoders[key] = OnnxEncoder(model_name, quantize=quantize, **kwargs)
+        return encoders[key]
+
+
+def cosine_drift(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    '''Drift (1 - cosine similarity) between rows of reference and candidate embeddings of the same texts.'''
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    cos = (reference * candidate).sum(axis=1) / np.maximum(
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1), 1e-12)
+    drift = 1 - cos
+    return {
+        'mean': float(drift.mean()),
+        'p99': float(np.percentile(drift, 99)),
+        'max': float(drift.max()),
+        'min_cosine': float(cos.min())
+    }
+
+
+def parity_check(model_name: str, texts: List[str], quantize: bool = QUANTIZE, **kwargs) -> Dict[str, float]:
+    '''Compare embeddings of the ONNX encoder with the fp32 sentence transformers model on texts,
+    return cosine drift and seconds taken by each to embed texts.'''
+    from sentence_transformers import SentenceTransformer  # pylint: disable=C0415
+
+    model = SentenceTransformer(model_name, device='cpu')
+    encoder = OnnxEncoder(model_name, quantize=quantize, **kwargs)
+    start = time.perf_counter()
+    reference = model.encode(texts)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    candidate = encoder.encode(texts)
+    seconds = time.perf_counter() - start
+    return {**cosine_drift(reference, candidate), 'fp32_seconds': reference_seconds, 'onnx_seconds': seconds}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export the embedding model to ONNX and report cosine drift against fp32.')
+    parser.add_argument('--model', type=str, default=TEXTENCODER_CONFIG['model'])
+    parser.add_argument('--texts', type=str, required=True, help='A text file with one sample text per line.')
+    parser.add_argument('--no_quantize', action='store_true', help='Check the fp32 ONNX model instead of int8.')
+    args = parser.parse_args()
+
+    with open(args.texts, 'r', encoding='utf-8') as f:
+        samples = [line.strip() for line in f if line.strip()]
+    print(parity_check(args.model, samples, quantize=not args.no_quantize))
@@ -0,0 +1,194 @@
+import os
+import sys
+import math
+import time
+import random
+import logging
+import threading
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import VECTORDB_CONFIG  # pylint: disable=C0413
+
+
+logger = logging.getLogger('search_tuner')
+
+AUTO_TUNE = VECTORDB_CONFIG.get('auto_tune', False)
+AUTO_INDEX = VECTORDB_CONFIG.get('auto_index', False)
+TARGET_RECALL = VECTORDB_CONFIG.get('target_recall', 0.95)
+TUNE_SAMPLE = VECTORDB_CONFIG.get('tune_sample', 50)
+RETUNE_GROWTH = VECTORDB_CONFIG.get('retune_growth', 2.0)
+FLAT_THRESHOLD = VECTORDB_CONFIG.get('flat_threshold', 10000)
+TOP_K = VECTORDB_CONFIG.get('top_k', 3)
+
+
+class SearchTuner:
+    '''Choose search params (nprobe / ef) of each collection to meet the target recall@k at minimum latency.
+
+    A random sample of stored vectors is searched as queries with candidate params in order of cost,
+    the cheapest params reaching target recall against exact search are kept. Each query's own vector is
+    left out of its results. Indexes without an exact search (eg. HNSW, IVF_PQ) are not tuned,
+    unless an exact search is given.
+    Collections are tuned again in background when their entity count grows by growth times since last tuning.
+    Index types are only recommended here, rebuilding an index is left to explicit offline steps,
+    see offline_tools/rebuild_index.py.
+    '''
+    # Index types whose most expensive candidate params search exhaustively without quantization
+    exact_index_types = ('FLAT', 'IVF_FLAT')
+
+    def __init__(
+            self,
+            target_recall: float = TARGET_RECALL,
+            k: int = TOP_K,
+            sample_size: int = TUNE_SAMPLE,
+            growth: float = RETUNE_GROWTH,
+            flat_threshold: int = FLAT_THRESHOLD
+            ):
+        self.target_recall = target_recall
+        self.k = k
+        self.sample_size = sample_size
+        self.growth = growth
+        self.flat_threshold = flat_threshold
+        self._tuned = {}  # name -> {'count', 'params', 'recall', 'latency'}
+        self._running = set()
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def recommend_index(self, count: int, metric_type: str = 'IP') -> dict:
+        '''Index params for a collection of count entities: FLAT for small ones, else IVF_FLAT with about 4 * sqrt(count) lists.'''
+        if count < self.flat_threshold:
+            return {'metric_type': metric_type, 'index_type': 'FLAT', 'params': {}}
+        nlist = 2 ** round(math.log2(4 * math.sqrt(count)))
+        return {'metric_type': metric_type, 'index_type': 'IVF_FLAT', 'params': {'nlist': min(nlist, 65536)}}
+
+    @staticmethod
+    def should_rebuild(current: Optional[dict], recommended: dict) -> bool:
+        '''Rebuild if index type differs, or nlist differs by more than 2 times.'''
+        if not current or current.get('index_type') != recommended['index_type']:
+            return True
+        nlist = current.get('params', {}).get('nlist')
+        new_nlist = recommended['params'].get('nlist')
+        return bool(nlist and new_nlist) and not new_nlist / 2 <= nlist <= new_nlist * 2
+
+    def candidates(self, index_params: dict) -> List[dict]:
+        '''Candidate search params in order of cost, the last one is exhaustive or the most accurate.'''
+        index_type = index_params.get('index_type', 'FLAT')
+        params = index_params.get('params', {})
+        if index_type.startswith('IVF'):
+            nlist = params.get('nlist', 1024)
+            nprobes = [2 ** i for i in range(int(math.log2(nlist)) + 1)]
+            if nprobes[-1] != nlist:
+                nprobes.append(nlist)
+            return [{'nprobe': x} for x in nprobes]
+        if 'HNSW' in index_type:
+            efs = sorted({max(self.k, x) for x in (16, 32, 64, 128, 256, 512)})
+            return [{'ef': x} for x in efs]
+        return [{}]
+
+    def sample(self, ids: Iterable, seed: Optional[int] = None) -> list:
+        '''Sample sample_size ids uniformly from the iterable by reservoir sampling, in one pass.'''
+        rng = random.Random(seed)
+        res = []
+        for i, x in enumerate(ids):
+            if i < self.sample_size:
+                res.append(x)
+            else:
+                j = rng.randint(0, i)
+                if j < self.sample_size:
+                    res[j] = x
+        return res
+
+    @staticmethod
+    def recall(results: Sequence[Sequence], truth: Sequence[Sequence], k: int) -> float:
+        '''Mean recall@k of result ids against true ids of each query.'''
+        scores = []
+        for ids, true_ids in zip(results, truth):
+            true_ids = set(list(true_ids)[:k])
+            if true_ids:
+                scores.append(len(true_ids & set(list(ids)[:k])) / len(true_ids))
+        return sum(scores) / len(scores) if scores else 1.0
+
+    def tune(
+            self,
+            search: Callable[[dict], List[List]],
+            index_params: dict,
+            query_ids: Optional[Sequence] = None,
+            exact_search: Optional[Callable[[], List[List]]] = None
+            ) -> dict:
+        '''Tune search params, search is called with params and returns ids of top results for each sampled query.
+        If query_ids are given, the id of each query is removed from its results, so search should return top k + 1.
+        exact_search returns ids of exact top results, the exhaustive candidate of FLAT & IVF_FLAT is used if not given.'''
+        candidates = self.candidates(index_params)
+        if exact_search is None:
+            index_type = index_params.get('index_type', 'FLAT')
+            if index_type not in self.exact_index_types:
+                logger.warning('No exact search to measure recall of %s index, search params are not tuned.', index_type)
+                return {'params': None, 'recall': None, 'latency': None}
+            exact_search = partial(search, candidates[-1])
+
+        def _top_k(res):
+            if query_ids is None:
+                return res
+            return [[x for x in ids if x != query_id][:self.k] for ids, query_id in zip(res, query_ids)]
+
+        truth = _top_k(exact_search())
+        best = {'params': candidates[-1], 'recall': 1.0, 'latency': None}
+        for params in candidates:
+            start = time.perf_counter()
+            res = search(params)
+            latency = time.perf_counter() - start
+            recall = self.recall(_top_k(res), truth, self.k)
+            if recall >= self.target_recall:
+                best = {'params': params, 'recall': recall, 'latency': latency}
+                break
+        return best
+
+    def get(self, name: str) -> Optional[dict]:
+        '''Tuned search params of the collection, None if not tuned yet.'''
+        with self._lock:
+            entry = self._tuned.get(name)
+        return None if entry is None else entry['params']
+
+    def needs_tuning(self, name: str, count: int) -> bool:
+        with self._lock:
+            entry = self._tuned.get(name)
+        return count > 0 and (entry is None or count >= entry['count'] * self.growth)
+
+    def schedule(self, name: str, count: int, run: Callable[[], dict]) -> Optional[Future]:
+        '''Tune the collection in background by run if it has grown enough, run returns the result of tune.'''
+        if not self.needs_tuning(name, count):
+            return None
+        with self._lock:
+            if name in self._running:
+                return None
+            self._running.add(name)
+        return self.executor.submit(self._run, name, count, run)
+
+    def _run(self, name: str, count: int, run: Callable[[], dict]):
+        try:
+            self.record(name, count, run())
+        except Exception as e:  # pylint: disable=W0703
+            logger.error('Failed to tune search params of %s:\n%s', name, e)
+        finally:
+            with self._lock:
+                self._running.discard(name)
+
+    def record(self, name: str, count: int, res: dict):
+        '''Save the result of tune for the collection of count entities.'''
+        with self._lock:
+            self._tuned[name] = {'count': count, **res}
+        logger.info('Tuned search params of %s with %s entities: %s', name, count, res)
+
+    def invalidate(self, name: str):
+        with self._lock:
+            self._tuned.pop(name, None)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._tuned.items()}
+
+
+search_tuner = SearchTuner()
@@ -0,0 +1,140 @@
+import os
+import sys
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import select, MetaData, Table, Column, String, Integer, Text, Index
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import MEMORYDB_CONFIG  # pylint: disable=C0413
+from src.engines import get_engine  # pylint: disable=C0413
+
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = 'akcio_summary'
+SUMMARY_TOKENS = MEMORYDB_CONFIG.get('summary_tokens', 200)
+
+SUMMARY_PROMPT = '''Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary.
+Keep names, facts and open questions that later questions may refer to.
+Write no more than {max_words} words, in the same language as the conversation.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:'''
+
+
+class ConversationSummary:
+    '''Rolling summary of conversation turns older than the recent window of each session.
+
+    Summaries are saved in the memory database with the number of turns they cover,
+    and refreshed by background threads after answers, so summarizing never delays an answer.
+    summarize is called with a prompt and returns the text generated by LLM.
+    '''
+
+    def __init__(
+            self,
+            summarize: Callable[[str], str],
+            connect_str: str = MEMORYDB_CONFIG['connect_str'],
+            table_name: str = TABLE_NAME,
+            max_tokens: int = SUMMARY_TOKENS,
+            max_workers: int = 2
+            ):
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.engine = get_engine(connect_str)
+        self.meta = MetaData()
+        self.table = Table(
+            table_name, self.meta,
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('project', String(255), nullable=False),
+            Column('session_id', String(255), nullable=False),
+            Column('summary', Text, nullable=False),
+            Column('turns', Integer, nullable=False),
+            Index(f'ix_{table_name}_project_session', 'project', 'session_id')
+        )
+        self.meta.create_all(self.engine)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._running = set()
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def get(self, project: str, session_id: str) -> Tuple[str, int]:
+        '''Return (summary, number of turns covered by the summary) of the session.'''
+        query = select(self.table.c.summary, self.table.c.turns).where(
+            self.table.c.project == project, self.table.c.session_id == session_id)
+        with self.engine.connect() as conn:
+            row = conn.execute(query).first()
+        if row is None:
+            return '', 0
+        return row.summary, row.turns
+
+    def save(self, project: str, session_id: str, summary: str, turns: int):
+        with self.engine.connect() as conn:
+            conn.execute(self.table.delete().where(
+                self.table.c.project == project, self.table.c.session_id == session_id))
+            conn.execute(self.table.insert(), [
+                {'project': project, 'session_id': session_id, 'summary': summary, 'turns': turns}])
+            conn.commit()
+
+    def remove(self, project: str, session_id: Optional[str] = None):
+        '''Remove summaries of the session, or of all sessions in project if session_id is empty.'''
+        query = self.table.delete().where(self.table.c.project == project)
+        if session_id:
+            query = query.where(self.table.c.session_id == session_id)
+        with self.engine.connect() as conn:
+            conn.execute(query)
+            conn.commit()
+
+    def refresh(self, project: str, session_id: str, load_turns: Callable[[int], List[tuple]]) -> Optional[Future]:
+        '''Summarize new turns in background. load_turns is called with the number of turns already covered,
+        and returns (question, answer) turns which have left the recent window but are not summarized yet.
+        If the session is being summarized, it will be summarized again after that, instead of in parallel.'''
+        key = (project, session_id)
+        with self._lock:
+            if key in self._running:
+                self._dirty.add(key)
+                return None
+            self._running.add(key)
+        return self.executor.submit(self._refresh_loop, key, load_turns)
+
+    def _refresh_loop(self, key: tuple, load_turns: Callable[[int], List[tuple]]):
+        try:
+            while True:
+                self._refresh(*key, load_turns)
+                with self._lock:
+                    if key not in self._dirty:
+                        self._running.discard(key)
+                        return
+                    self._dirty.discard(key)
+        except Exception as e:  # pylint: disable=W0703
+            logger.error('Failed to summarize conversation %s:\n%s', key, e)
+            with self._lock:
+                self._running.discard(key)
+                self._dirty.discard(key)
+
+    def _refresh(self, project: str, session_id: str, load_turns: Callable[[int], List[tuple]]):
+        summary, turns = self.get(project, session_id)
+        new_turns = load_turns(turns)
+        if len(new_turns) == 0:
+            return
+        new_lines = []
+        for q, a in new_turns:
+            if q:
+                new_lines.append(f'Human: {q}')
+            if a:
+                new_lines.append(f'AI: {a}')
+        prompt = SUMMARY_PROMPT.format(max_words=self.max_tokens, summary=summary, new_lines='\n'.join(new_lines))
+        new_summary = self.summarize(prompt).strip()
+        # Token budget is approximated by words, in case LLM does not follow the instruction
+        words = new_summary.split()
+        if len(words) > self.max_tokens:
+            new_summary = ' '.join(words[:self.max_tokens])
+        self.save(project, session_id, new_summary, turns + len(new_turns))
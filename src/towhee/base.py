@@ -57,6 +57,6 @@ class BasePipelines(ABC):
         pass
 
     @abstractmethod
-    def count_entities(self, project) -> int:
-        '''Count doc chunks in project.'''
+    def count_entities(self, project, flush: bool = False) -> int:
+        '''Count doc chunks in project, flush to count unsealed ones.'''
         pass
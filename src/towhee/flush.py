@@ -0,0 +1,77 @@
+import time
+import logging
+import threading
+from typing import Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlushScheduler:
+    '''Flush projects in a background thread, at most once per interval (seconds) for each project.
+    Requests for the same project within the interval are merged into one flush,
+    so concurrent inserts do not serialize on flushing and do not seal many tiny segments.
+    A negative interval disables background flush.
+    '''
+
+    def __init__(self, flush_func: Callable[[str], None], interval: float = 60):
+        self.flush_func = flush_func
+        self.interval = interval
+        self._pending = set()
+        self._last_flushes = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def request(self, project: str):
+        '''Ask for a flush of the project, it will be done when the interval since the last flush is over.'''
+        if self.interval < 0:
+            return
+        with self._lock:
+            self._pending.add(project)
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name='towhee-flush', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def stop(self, flush: bool = True):
+        '''Stop the background thread, flush pending projects right now if flush is True.'''
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        if flush:
+            for project in pending:
+                self._flush(project)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.clear()
+            now = time.monotonic()
+            due = []
+            wait = None
+            with self._lock:
+                for project in list(self._pending):
+                    next_time = self._last_flushes.get(project, float('-inf')) + self.interval
+                    if next_time <= now:
+                        due.append(project)
+                        self._pending.discard(project)
+                    else:
+                        wait = next_time - now if wait is None else min(wait, next_time - now)
+            for project in due:
+                self._flush(project)
+            if not due:
+                self._wakeup.wait(timeout=wait)
+
+    def _flush(self, project: str):
+        try:
+            self.flush_func(project)
+        except Exception as e:  # pylint: disable=W0703
+            logger.warning('Failed to flush project %s:\n%s', project, e)
+        with self._lock:
+            self._last_flushes[project] = time.monotonic()
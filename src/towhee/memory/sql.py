@@ -1,25 +1,59 @@
 import sys
 import os
 import json
+import atexit
+import logging
+import threading
 from typing import List, Dict
 
-from sqlalchemy import create_engine, inspect, MetaData, Table, Column, String, Integer, JSON
+from sqlalchemy import inspect, select, func, MetaData, Table, Column, String, Integer, JSON, Index
 
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
 from src.towhee.base import BaseMemory # pylint: disable=C0413
+from src.cache import LRUCache # pylint: disable=C0413
 from config import MEMORYDB_CONFIG # pylint: disable=C0413
+from src.engines import get_engine # pylint: disable=C0413
+from src.history_window import trim_by_tokens # pylint: disable=C0413
+
+
+logger = logging.getLogger(__name__)
 
 
 class MemoryStore(BaseMemory):
-    '''Memory store using SQL databases supported by sqlalchemy. (eg. Postgresql)'''
+    '''Memory store using SQL databases supported by sqlalchemy. (eg. Postgresql)
+
+    History of recent sessions is cached in memory, bounded by session count and bytes.
+    New messages are written behind in batches by a background thread, pending writes are flushed
+    before reading a session missed in cache, before dropping, and at exit.
+    Messages failed to write are queued again for up to flush_retries flushes.
+    '''
 
     def __init__(self, configs: Dict = MEMORYDB_CONFIG):
         '''Initialize memory storage'''
-        self.engine = create_engine(url=configs['connect_str'])
+        self.engine = get_engine(configs['connect_str'])
         self.meta = MetaData()
 
+        self.write_behind = configs.get('write_behind', True)
+        self.flush_interval = configs.get('flush_interval', 1)
+        self.batch_size = configs.get('batch_size', 100)
+        self.flush_retries = configs.get('flush_retries', 3)
+        self.history_turns = configs.get('history_turns', None)
+        self._history = LRUCache(
+            maxsize=configs.get('cache_sessions', 1024),
+            maxweight=configs.get('cache_bytes', 16 * 1024 * 1024),
+            weigh=lambda messages: len(json.dumps(messages))
+        )
+        self._tables = {}  # project -> reflected table
+        self._pending = []  # (project, row) to insert
+        self._failures = {}  # project -> consecutive failed flushes
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._writer = None
+        atexit.register(self.flush)
+
     def add_history(self, project: str, session_id: str, messages: List[dict]):
         project_table = self._create_table_if_not_exists(project)
 
@@ -28,54 +62,191 @@ class MemoryStore(BaseMemory):
                 self._message_to_dict(message))}
             for message in messages
         ]
-        with self.engine.connect() as conn:
-            query = project_table.insert()
-            conn.execute(query, data)
-            conn.commit()
+        with self._lock:
+            history = self._history.get((project, session_id))
+            if history is not None:
+                self._history.put((project, session_id), self._window(history + [tuple(m) for m in messages]))
+            if self.write_behind:
+                self._pending.extend((project, row) for row in data)
+                self._start_writer()
+                if len(self._pending) >= self.batch_size:
+                    self._wakeup.set()
+                return
 
-    def get_history(self, project: str, session_id: str):
-        if self.check(project):
-            project_table = Table(project, self.meta,
-                                  autoload_with=self.engine,
-                                  extend_existing=True
-                                  )
-            query = project_table.select().where(project_table.c.session_id == session_id)
-            messages = []
+        try:
             with self.engine.connect() as conn:
-                for row in conn.execute(query):
-                    message = row.message
-                    if isinstance(message, str):
-                        message = json.loads(message)
-                    message = self._message_from_dict(message)
-                    messages.append(message)
+                query = project_table.insert()
+                conn.execute(query, data)
+                conn.commit()
+        except Exception:
+            # Cached history must not show messages failed to write
+            with self._lock:
+                self._history.pop((project, session_id))
+            raise
+
+    def get_history(self, project: str, session_id: str, limit: int = None, offset: int = 0, max_tokens: int = None):
+        '''Get history in (question, answer) turns of time order.
+        If limit is given, return at most limit turns before the latest offset turns.
+        If max_tokens is given, the oldest turns are dropped until the rest have no more than about max_tokens tokens.
+        Turns within the recent window are served from cache.'''
+        in_window = offset == 0 and (not self.history_turns or (limit and limit <= self.history_turns))
+        if in_window:
+            messages = self._get_recent_history(project, session_id)
+            if limit:
+                messages = messages[-limit:]
         else:
-            messages = []
-        return messages
+            with self._flush_lock:
+                self.flush()
+                messages = self._select_history(project, session_id, limit=limit, offset=offset)
+        return trim_by_tokens(messages, max_tokens, lambda turn: ' '.join(x for x in turn if x))
+
+    def count_history(self, project: str, session_id: str) -> int:
+        '''Count turns of the session.'''
+        with self._flush_lock:
+            self.flush()
+            project_table = self._get_table(project)
+            if project_table is None:
+                return 0
+            query = select(func.count()).select_from(project_table).where(project_table.c.session_id == session_id)
+            with self.engine.connect() as conn:
+                return conn.execute(query).scalar()
+
+    def _get_recent_history(self, project: str, session_id: str):
+        history = self._history.get((project, session_id))
+        if history is not None:
+            return list(history)
+
+        # Make sure history read from database includes pending writes
+        with self._flush_lock:
+            self.flush()
+            messages = self._select_history(project, session_id, limit=self.history_turns)
+            with self._lock:
+                # Messages added while reading are still pending, as flushing is blocked by the flush lock
+                for p, row in self._pending:
+                    if p == project and row['session_id'] == session_id:
+                        messages.append(self._message_from_dict(json.loads(row['message'])))
+                messages = self._window(messages)
+                self._history.put((project, session_id), messages)
+        return list(messages)
+
+    def _select_history(self, project: str, session_id: str, limit: int = None, offset: int = 0):
+        '''Select at most limit messages before the latest offset messages by ORDER BY id DESC LIMIT.'''
+        project_table = self._get_table(project)
+        if project_table is None:
+            return []
+        query = project_table.select().where(project_table.c.session_id == session_id) \
+            .order_by(project_table.c.id.desc()).offset(offset)
+        if limit:
+            query = query.limit(limit)
+        messages = []
+        with self.engine.connect() as conn:
+            for row in conn.execute(query):
+                message = row.message
+                if isinstance(message, str):
+                    message = json.loads(message)
+                message = self._message_from_dict(message)
+                messages.append(message)
+        return messages[::-1]
+
+    def _window(self, messages):
+        return messages[-self.history_turns:] if self.history_turns else messages
+
+    def flush(self):
+        '''Write all pending messages into database.'''
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if len(pending) == 0:
+                return
+            data = {}
+            for project, row in pending:
+                data.setdefault(project, []).append(row)
+            failed = []
+            for project, rows in data.items():
+                try:
+                    project_table = self._create_table_if_not_exists(project)
+                    with self.engine.connect() as conn:
+                        conn.execute(project_table.insert(), rows)
+                        conn.commit()
+                    self._failures.pop(project, None)
+                except Exception as e:  # pylint: disable=W0703
+                    failures = self._failures.get(project, 0) + 1
+                    if failures <= self.flush_retries:
+                        logger.warning('Failed to write %s messages of project %s (attempt %s), will retry:\n%s',
+                                       len(rows), project, failures, e)
+                        self._failures[project] = failures
+                        failed.extend((project, row) for row in rows)
+                    else:
+                        logger.error('Failed to write %s messages of project %s, dropped after %s attempts:\n%s',
+                                     len(rows), project, failures, e)
+                        self._failures.pop(project, None)
+                        with self._lock:
+                            for row in rows:
+                                self._history.pop((project, row['session_id']))
+            if failed:
+                with self._lock:
+                    # Keep the order of messages, failed ones were added before those pending now
+                    self._pending = failed + self._pending
+
+    def _get_table(self, project):
+        '''Get the cached table of project, reflected from database once. Return None if not exists.'''
+        if project not in self._tables:
+            if not self.check(project):
+                return None
+            project_table = Table(project, self.meta, autoload_with=self.engine, extend_existing=True)
+            # Tables created before have no index on session_id
+            if not any('session_id' in idx.columns for idx in project_table.indexes):
+                Index(f'ix_{project}_session_id', project_table.c.session_id).create(self.engine, checkfirst=True)
+            self._tables[project] = project_table
+        return self._tables[project]
 
     def _create_table_if_not_exists(self, project):
-        if not self.check(project):
+        project_table = self._get_table(project)
+        if project_table is None:
             project_table = Table(project, self.meta,
                                   Column('id', Integer, primary_key=True,
                                          autoincrement=True),
-                                  Column('session_id', String, nullable=False),
+                                  Column('session_id', String, nullable=False, index=True),
                                   Column('message', JSON, nullable=False),
                                   extend_existing=True
                                   )
-            self.meta.create_all(self.engine)
-        project_table = Table(project, self.meta, autoload_with=self.engine, extend_existing=True)
+            self.meta.create_all(self.engine, tables=[project_table])
+            self._tables[project] = project_table
         return project_table
 
+    def _start_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._write_loop, name='memory-writer', daemon=True)
+            self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            self._wakeup.wait(timeout=self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
     def drop(self, project, session_id=None):
-        if self.check(project):
-            project_table = Table(project, self.meta,
-                                  autoload_with=self.engine, extend_existing=True)
-            if session_id and len(session_id) > 0:
-                query = project_table.delete().where(project_table.c.session_id == session_id)
-                with self.engine.connect() as conn:
-                    conn.execute(query)
-                    conn.commit()
-            else:
-                query = project_table.drop(self.engine)
+        with self._flush_lock:
+            with self._lock:
+                if session_id and len(session_id) > 0:
+                    self._pending = [(p, r) for p, r in self._pending if p != project or r['session_id'] != session_id]
+                    self._history.pop((project, session_id))
+                else:
+                    self._pending = [(p, r) for p, r in self._pending if p != project]
+                    self._history.pop_if(lambda k: k[0] == project)
+
+            if self.check(project):
+                project_table = Table(project, self.meta,
+                                      autoload_with=self.engine, extend_existing=True)
+                if session_id and len(session_id) > 0:
+                    query = project_table.delete().where(project_table.c.session_id == session_id)
+                    with self.engine.connect() as conn:
+                        conn.execute(query)
+                        conn.commit()
+                else:
+                    query = project_table.drop(self.engine)
+                    self._tables.pop(project, None)
+                    self.meta.remove(project_table)
 
         if not session_id or len(session_id) == 0:
             existence = self.check(project)
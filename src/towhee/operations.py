@@ -1,18 +1,55 @@
 import sys
 import os
+import atexit
+import asyncio
 import logging
+from functools import partial
+from typing import Optional
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+from config import VECTORDB_CONFIG, MEMORYDB_CONFIG, INSERT_MODE  # pylint: disable=C0413
 from src.towhee.pipelines import TowheePipelines  # pylint: disable=C0413
+from src.towhee.flush import FlushScheduler  # pylint: disable=C0413
 from src.towhee.memory import MemoryStore  # pylint: disable=C0413
+from src.manifest import Manifest  # pylint: disable=C0413
+from src.catalog import catalog  # pylint: disable=C0413
+from src.summary import ConversationSummary  # pylint: disable=C0413
 
 
 logger = logging.getLogger(__name__)
 
+INSERT_ACK = VECTORDB_CONFIG.get('insert_ack', 'count')
+FLUSH_INTERVAL = VECTORDB_CONFIG.get('flush_interval', 60)
+HISTORY_TURNS = MEMORYDB_CONFIG.get('history_turns', None)
+HISTORY_TOKENS = MEMORYDB_CONFIG.get('history_tokens', None)
+MEMORY_MODE = MEMORYDB_CONFIG.get('memory_mode', 'window')
+SUMMARY_TURNS = MEMORYDB_CONFIG.get('summary_turns', 3)
+SUMMARY_QUESTION = 'What have we talked about before?'
+# Key of the Milvus insert result in rows output by the insert pipeline of INSERT_MODE
+INSERT_RESULT_KEY = 'milvus_res' if INSERT_MODE == 'generate_questions' else 'milvus'
+
 
 towhee_pipelines = TowheePipelines()
 memory_store = MemoryStore()
+manifest = Manifest()
+flusher = FlushScheduler(lambda project: towhee_pipelines.flush(project), interval=FLUSH_INTERVAL)  # pylint: disable=W0108
+atexit.register(flusher.stop)
+summary_llm = None
+count_fallback_logged = False
+
+
+def summarize(prompt):
+    '''Generate summary by the LLM configured for search pipeline.'''
+    global summary_llm  # pylint: disable=W0603
+    if summary_llm is None:
+        from src.towhee.pipelines.utils import get_llm_op  # pylint: disable=C0415
+
+        summary_llm = get_llm_op(towhee_pipelines.search_config)
+    return summary_llm([{'question': prompt}])
+
+
+summaries = ConversationSummary(summarize=summarize) if MEMORY_MODE == 'summary' else None
 
 # Initiate pipelines
 insert_pipeline = towhee_pipelines.insert_pipeline
@@ -22,7 +59,13 @@ search_pipeline = towhee_pipelines.search_pipeline
 def chat(session_id, project, question):
     '''Chat API'''
     try:
-        history = memory_store.get_history(project, session_id)
+        if summaries is None:
+            history = memory_store.get_history(project, session_id, limit=HISTORY_TURNS, max_tokens=HISTORY_TOKENS)
+        else:
+            history = memory_store.get_history(project, session_id, limit=SUMMARY_TURNS, max_tokens=HISTORY_TOKENS)
+            summary, _ = summaries.get(project, session_id)
+            if summary:
+                history = [(SUMMARY_QUESTION, summary)] + history
         res = search_pipeline(question, history, project).get()
         if len(res) == 2:
             new_question, final_answer = res
@@ -34,28 +77,133 @@ def chat(session_id, project, question):
         # Update history
         messages = [(question, final_answer)]
         memory_store.add_history(project, session_id, messages)
+        catalog.update(project, memory=True)
+        refresh_summary(project, session_id)
         return new_question, final_answer
     except Exception as e: # pylint: disable=W0703
         return question, f'Something went wrong:\n{e}'
 
 
+def refresh_summary(project, session_id):
+    '''Summarize turns which have left the recent window in background, if memory mode is summary.'''
+    if summaries is None:
+        return
+
+    def _load_turns(covered):
+        num = memory_store.count_history(project, session_id) - SUMMARY_TURNS - covered
+        if num <= 0:
+            return []
+        return memory_store.get_history(project, session_id, limit=num, offset=SUMMARY_TURNS)
+
+    summaries.refresh(project, session_id, _load_turns)
+
+
+async def achat(session_id, project, question):
+    '''Async chat API, running the blocking pipeline in the default executor.'''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(chat, session_id, project, question))
+
+
+async def astream_chat(session_id, project, question):
+    '''Stream chat API. Towhee pipelines return the whole answer, so it is yielded as a single token.'''
+    new_question, final_answer = await achat(session_id, project, question)
+    yield {'event': 'token', 'data': final_answer}
+    yield {'event': 'answer', 'data': {'question': new_question, 'answer': final_answer}}
+
+
+async def abatch_chat(items, max_concurrency: int = 16):
+    '''Batch chat API. Each item is a dict with keys session_id, project, question.
+    The search pipeline embeds and searches inside, so items are answered concurrently by pipeline calls.
+    Return a list of (question, answer) in the same order of items.'''
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _chat(item):
+        async with semaphore:
+            return await achat(**item)
+
+    return await asyncio.gather(*[_chat(item) for item in items])
+
+
 def insert(data_src, project, source_type: str = 'file'): # pylint: disable=W0613
     '''Load project docs will load docs from data source and then insert doc embeddings into the project table in the vector store.
     If there is no project table, it will create one.
     '''
-    if not towhee_pipelines.check(project):
+    if not catalog.get(project, 'store', lambda: towhee_pipelines.check(project)):
         towhee_pipelines.create(project)
+        catalog.update(project, store=True, **towhee_pipelines.describe(project))
     res = insert_pipeline(data_src, project).to_list()
-    num = towhee_pipelines.count_entities(project)['vector store']
+    counts = [count_inserted(r[0]) for r in res]
+    if INSERT_ACK == 'flush' or None in counts:
+        num = towhee_pipelines.count_entities(project, flush=True, exists=True)['vector store']
+    else:
+        num = sum(counts)
+        flusher.request(project)
     assert len(res) <= num, 'Failed to insert data.'
+    towhee_pipelines.tune_index(project)
     token_count = 0
     for r in res:
         token_count += r[0]['token_count']
     return len(res), token_count
 
 
+def count_inserted(res, key: str = INSERT_RESULT_KEY) -> Optional[int]:
+    '''Count inserted primary keys from the key of a result of insert pipeline, return None if unknown.
+    eg. {'milvus': MutationResult, 'es': None, 'token_count': 5} output by osschat-insert counts insert_count of milvus.
+    '''
+    global count_fallback_logged  # pylint: disable=W0603
+    value = res.get(key) if isinstance(res, dict) else None
+    if isinstance(value, int):
+        return value
+    if hasattr(value, 'insert_count'):
+        return value.insert_count
+    if hasattr(value, 'primary_keys'):
+        return len(value.primary_keys)
+    if isinstance(value, (list, tuple)):
+        return len(value)
+    if not count_fallback_logged:
+        count_fallback_logged = True
+        logger.warning('Unknown insert result under "%s" in %s, counting entities by flush instead.', key, type(res).__name__)
+    return None
+
+
+def sync(data_src, project, source_type: str = 'file'):
+    '''Sync project docs incrementally from data source by the project manifest.
+    Towhee pipelines split docs inside, so the manifest keeps one content hash per source:
+    a file source is skipped if its content is unchanged (counted as one unchanged entry),
+    otherwise (or for urls) chunks of the source are deleted and the source is inserted again.
+    Return a report of changes.
+    '''
+    exists = catalog.get(project, 'store', lambda: towhee_pipelines.check(project))
+    if exists and towhee_pipelines.use_scalar:
+        # Chunks in the scalar store can not be deleted by source, refuse before changing anything
+        raise RuntimeError('Syncing sources of an existing project is not supported with scalar store (USE_SCALAR) yet.')
+    entries = manifest.get(project, data_src)
+    content_hash = ''
+    if source_type == 'file':
+        with open(data_src, 'rb') as f:
+            content_hash = Manifest.hash_chunk(f.read())
+        if len(entries) > 0 and entries[0]['chunk_hash'] == content_hash:
+            return {'source': data_src, 'added': 0, 'deleted': 0, 'unchanged': len(entries), 'token_count': 0}
+
+    deleted = 0
+    if exists:
+        # Sources loaded before by insert have no manifest entry, delete their chunks as well to avoid duplicates
+        deleted = towhee_pipelines.delete_source(project, data_src)
+    try:
+        chunk_num, token_count = insert(data_src, project, source_type=source_type)
+    except Exception:
+        # Old chunks are deleted, record the source as stale so the next sync loads it again
+        manifest.remove(project, source=data_src)
+        manifest.add(project, data_src, [{'chunk_hash': ''}])
+        raise
+    manifest.remove(project, source=data_src)
+    manifest.add(project, data_src, [{'chunk_hash': content_hash}])
+    return {'source': data_src, 'added': chunk_num, 'deleted': deleted, 'unchanged': 0, 'token_count': token_count}
+
+
 def drop(project):
     '''Drop project will clean both vector and memory stores.'''
+    catalog.invalidate(project)
     status = check(project)
     # Clear vector db
     try:
@@ -66,6 +214,10 @@ def drop(project):
     except Exception as e:
         logger.error('Failed to drop project:\n%s', e)
         raise RuntimeError from e
+    catalog.update(project, store=False)
+    manifest.remove(project)
+    if summaries is not None:
+        summaries.remove(project)
     # Clear memory
     try:
         if status['memory']:
@@ -75,18 +227,19 @@ def drop(project):
     except Exception as e:
         logger.error('Failed to clean memory for the project:\n%s', e)
         raise RuntimeError from e
+    catalog.update(project, memory=False)
 
 
 def check(project):
     '''Check existences of project tables in both vector and memory stores.'''
     try:
-        doc_check = towhee_pipelines.check(project)
+        doc_check = catalog.get(project, 'store', lambda: towhee_pipelines.check(project))
     except Exception as e:
         logger.error('Failed to check doc stores:\n%s', e)
         raise RuntimeError from e
     # Check memory
     try:
-        memory_check = memory_store.check(project)
+        memory_check = catalog.get(project, 'memory', lambda: memory_store.check(project))
     except Exception as e:
         logger.error('Failed to clean memory for the project:\n%s', e)
         raise RuntimeError from e
@@ -96,17 +249,18 @@ def check(project):
 def count(project):
     '''Count entities.'''
     try:
-        counts = towhee_pipelines.count_entities(project)
+        exists = catalog.get(project, 'store', lambda: towhee_pipelines.check(project))
+        counts = towhee_pipelines.count_entities(project, exists=exists)
         return counts
     except Exception as e:
         logger.error('Failed to count entities:\n%s', e)
         raise RuntimeError from e
 
 
-def get_history(project, session_id):
-    '''Get conversation history from memory store.'''
+def get_history(project, session_id, limit=None, offset=0):
+    '''Get conversation history from memory store, at most limit turns before the latest offset turns if limit is given.'''
     try:
-        messages = memory_store.get_history(project, session_id)
+        messages = memory_store.get_history(project, session_id, limit=limit, offset=offset)
         return messages
     except Exception as e:
         logger.error('Failed to clean memory for the project:\n%s', e)
@@ -117,6 +271,8 @@ def clear_history(project, session_id):
     '''Clear conversation history from memory store.'''
     try:
         memory_store.drop(project, session_id)
+        if summaries is not None:
+            summaries.remove(project, session_id)
     except Exception as e:
         raise RuntimeError(f'Failed to clear memory:\n{e}') from e
 
@@ -1,8 +1,14 @@
 import sys
 import os
+import copy
+import json
+import hashlib
+import logging
+import threading
 from typing import Any, Dict
 
-from pymilvus import Collection, connections
+import numpy as np
+from pymilvus import Collection
 from towhee import AutoConfig
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
@@ -12,13 +18,20 @@ from config import ( # pylint: disable=C0413
     TEXTENCODER_CONFIG, CHAT_CONFIG,
     VECTORDB_CONFIG, SCALARDB_CONFIG,
     RERANK_CONFIG, QUERY_MODE, INSERT_MODE,
-    DATAPARSER_CONFIG
+    DATAPARSER_CONFIG, CACHE_CONFIG
 )
+from src.cache import LRUCache  # pylint: disable=C0413
+from src.catalog import catalog  # pylint: disable=C0413
+from src.milvus_registry import milvus_registry  # pylint: disable=C0413
+from src.search_tuner import search_tuner, AUTO_INDEX  # pylint: disable=C0413
 from src.towhee.base import BasePipelines  # pylint: disable=C0413
 from src.towhee.pipelines.search import build_search_pipeline  # pylint: disable=C0413
 from src.towhee.pipelines.insert import build_insert_pipeline  # pylint: disable=C0413
 
 
+logger = logging.getLogger(__name__)
+
+
 class TowheePipelines(BasePipelines):
     '''Towhee pipelines'''
     def __init__(self,
@@ -78,7 +91,7 @@ class TowheePipelines(BasePipelines):
             self.connection_args['secure'] = True
             self.milvus_secure = True
 
-        connections.connect(**self.connection_args)
+        self.milvus_alias = milvus_registry.get_alias(self.connection_args)
 
         if self.use_scalar:
             from elasticsearch import Elasticsearch  # pylint: disable=C0415
@@ -87,20 +100,109 @@ class TowheePipelines(BasePipelines):
             self.es_top_k = scalardb_config['top_k']
             self.es_client = Elasticsearch(**self.es_connection_kwargs)
 
+        # Built pipelines & configs are memoized, keyed by (kind, mode, config hash)
+        self._pipelines = LRUCache(maxsize=CACHE_CONFIG.get('max_pipelines', 8))
+        self._configs = {}
+        self._build_lock = threading.RLock()
+
     @property
     def search_pipeline(self):
-        search_pipeline = build_search_pipeline(
-            self.query_mode, config=self.search_config)
-        return search_pipeline
+        return self.get_search_pipeline()
 
     @property
     def insert_pipeline(self):
-        insert_pipeline = build_insert_pipeline(
-            self.insert_mode, config=self.insert_config)
-        return insert_pipeline
+        return self.get_insert_pipeline()
+
+    def get_search_pipeline(self, mode: str = None, **config_updates):
+        '''Get the memoized search pipeline, built by the query mode and search config updated by config_updates.
+        eg. get_search_pipeline(llm_src='ernie') holds another pipeline for ERNIE besides the default one.'''
+        return self._get_pipeline('search', mode or self.query_mode, config_updates)
+
+    def get_insert_pipeline(self, mode: str = None, **config_updates):
+        '''Get the memoized insert pipeline, built by the insert mode and insert config updated by config_updates.'''
+        return self._get_pipeline('insert', mode or self.insert_mode, config_updates)
+
+    def rebuild(self, kind: str = None):
+        '''Drop built pipelines of the kind ("search" or "insert", or both if None), they will be built again on next access.'''
+        self._pipelines.pop_if(lambda k: kind is None or k[0] == kind)
+
+    def reload(self):
+        '''Load configs again and drop all built pipelines.'''
+        with self._build_lock:
+            self._configs.clear()
+            self._pipelines.clear()
+
+    @staticmethod
+    def config_hash(config) -> str:
+        data = config.dict() if hasattr(config, 'dict') else vars(config)
+        # Prompt op is set on config by build_search_pipeline
+        data = {k: v for k, v in data.items() if k != 'customize_prompt'}
+        return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _get_pipeline(self, kind: str, mode: str, config_updates: Dict):
+        config = self.search_config if kind == 'search' else self.insert_config
+        if config_updates:
+            config = copy.deepcopy(config)
+            for k, v in config_updates.items():
+                setattr(config, k, v)
+        key = (kind, mode, self.config_hash(config))
+        pipeline = self._pipelines.get(key)
+        if pipeline is None:
+            # Build under lock so that concurrent misses do not load operators & models twice
+            with self._build_lock:
+                pipeline = self._pipelines.get(key)
+                if pipeline is None:
+                    build = build_search_pipeline if kind == 'search' else build_insert_pipeline
+                    pipeline = build(mode, config=config)
+                    self._pipelines.put(key, pipeline)
+        return pipeline
 
     @property
     def search_config(self):
+        with self._build_lock:
+            if 'search' not in self._configs:
+                self._configs['search'] = self._load_search_config()
+            return self._configs['search']
+
+    @property
+    def insert_config(self):
+        with self._build_lock:
+            if 'insert' not in self._configs:
+                self._configs['insert'] = self._load_insert_config()
+            return self._configs['insert']
+
+    @property
+    def onnx_encoder(self):
+        '''ONNX Runtime encoder of the embedding model shared in process, used instead of the torch model on cpu.'''
+        from src.onnx_embedding import get_encoder  # pylint: disable=C0415
+        return get_encoder(self.textencoder_config['model'], quantize=self.textencoder_config.get('quantize', True))
+
+    def query_batcher(self, config):
+        '''Embedding op of search pipelines shared in process, coalescing queries of concurrent searches into batched forward passes.
+        It embeds by the same op as the insert pipeline of config, so queries and docs are embedded alike.'''
+        from src.embedding_batcher import get_batcher  # pylint: disable=C0415
+        from src.towhee.pipelines.utils import get_embedding_op  # pylint: disable=C0415
+
+        model = self.textencoder_config['model']
+        backend = self.textencoder_config.get('backend', 'torch')
+
+        def make_embed_batch():
+            if backend == 'onnx':
+                return self.onnx_encoder.encode
+            op = get_embedding_op(config)
+            op = op.get_op() if hasattr(op, 'get_op') else op
+
+            def embed_batch(texts):
+                return np.stack([np.asarray(x, dtype=np.float32) for x in op(texts)])
+            return embed_batch
+
+        return get_batcher(
+            f'towhee:{model}:{backend}', make_embed_batch,
+            max_batch_size=self.textencoder_config.get('coalesce_max_batch', 32),
+            max_wait=self.textencoder_config.get('coalesce_max_wait', 0.005)
+        )
+
+    def _load_search_config(self):
         search_config = AutoConfig.load_config(
             'osschat-search',
             llm_src=self.llm_src,
@@ -112,7 +214,10 @@ class TowheePipelines(BasePipelines):
         search_config.embedding_model = self.textencoder_config['model']
         search_config.embedding_normalize = self.textencoder_config['norm']
         search_config.embedding_device = self.textencoder_config['device']
-
+        if self.textencoder_config.get('coalesce', False):
+            search_config.customize_embedding_op = self.query_batcher(search_config)
+        elif self.textencoder_config.get('backend', 'torch') == 'onnx':
+            search_config.customize_embedding_op = self.onnx_encoder
 
         # Configure vector store (Milvus/Zilliz)
         search_config.milvus_uri = self.milvus_uri
@@ -133,8 +238,7 @@ class TowheePipelines(BasePipelines):
             search_config.es_enable = False
         return search_config
 
-    @property
-    def insert_config(self):
+    def _load_insert_config(self):
         insert_config = AutoConfig.load_config(
             'osschat-insert',
             llm_src=self.llm_src,
@@ -147,6 +251,8 @@ class TowheePipelines(BasePipelines):
         insert_config.embedding_model = self.textencoder_config['model']
         insert_config.embedding_normalize = self.textencoder_config['norm']
         insert_config.embedding_device = self.textencoder_config['device']
+        if self.textencoder_config.get('backend', 'torch') == 'onnx':
+            insert_config.customize_embedding_op = self.onnx_encoder
 
         # Configure vector store (Milvus/Zilliz)
         insert_config.milvus_uri = self.milvus_uri
@@ -181,18 +287,63 @@ class TowheePipelines(BasePipelines):
         fields.append(FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR,
                         description='embedding vectors', dim=self.textencoder_config['dim']))
         schema = CollectionSchema(fields=fields, description='osschat', enable_dynamic_field=False)
-        collection = Collection(name=project, schema=schema)
+        collection = Collection(name=project, schema=schema, using=self.milvus_alias)
 
         index_params = self.milvus_index_params
+        if AUTO_INDEX:
+            # Start with a FLAT index, which is rebuilt as the collection grows
+            index_params = search_tuner.recommend_index(0, index_params.get('metric_type', 'IP'))
         collection.create_index(field_name='embedding',
                                 index_params=index_params)
         return collection
 
+    def tune_index(self, project):
+        '''Check in background whether the index of project collection still fits its size, if auto index is on.
+        Search params can not be tuned for the search pipeline, as the hub search operator does not take them.'''
+        if not AUTO_INDEX:
+            return None
+        collection = milvus_registry.get_collection(project, self.connection_args)
+
+        def _check():
+            current = self._index_params(project, collection)
+            recommended = search_tuner.recommend_index(collection.num_entities, (current or {}).get('metric_type', 'IP'))
+            if search_tuner.should_rebuild(current, recommended):
+                # Rebuilding releases the collection and fails all searches meanwhile, so it is never done online
+                logger.warning('Index of %s does not fit %s entities any more, run offline_tools/rebuild_index.py to apply: %s',
+                               project, collection.num_entities, recommended)
+            return {'params': None}
+
+        return search_tuner.schedule(project, collection.num_entities, _check)
+
+    def rebuild_index(self, project, index_params: Dict = None):
+        '''Rebuild the index of project collection with index_params, or the one recommended for its size.
+        The collection is released and searches fail while building, so run it as an offline maintenance step.'''
+        collection = milvus_registry.get_collection(project, self.connection_args)
+        current = self._index_params(project, collection)
+        index_params = index_params or search_tuner.recommend_index(collection.num_entities, current.get('metric_type', 'IP'))
+        collection.release()
+        collection.drop_index()
+        collection.create_index(field_name='embedding', index_params=index_params)
+        collection.load()
+        catalog.update(project, **milvus_registry.describe(collection))
+        return index_params
+
+    def describe(self, project) -> Dict:
+        '''Describe schema fields, vector dim, index type and index params of project collection.'''
+        return milvus_registry.describe(milvus_registry.get_collection(project, self.connection_args))
+
+    @staticmethod
+    def _index_params(project, collection) -> Dict:
+        '''Index params of project collection, read from the project catalog and described only if missing.'''
+        return catalog.get(project, 'index_params', lambda: milvus_registry.describe(collection)['index_params']) or {}
+
     def drop(self, project):
         assert self.check(project), f'No project store: {project}'
         # drop vector store
-        collection = Collection(project)
+        collection = milvus_registry.get_collection(project, self.connection_args)
         collection.drop()
+        milvus_registry.invalidate(project)
+        search_tuner.invalidate(project)
 
         if self.use_scalar:
             # drop scalar store
@@ -201,21 +352,38 @@ class TowheePipelines(BasePipelines):
         assert not self.check(
             project), f'Failed to drop project store : {project}'
 
-    def check(self, project):
-        from pymilvus import utility  # pylint: disable=C0415
+    def delete_source(self, project, source):
+        '''Delete doc chunks loaded from the source in vector store, return the count of deleted chunks.'''
+        if self.use_scalar:
+            raise RuntimeError('Deleting by source does not support scalar store yet.')
+        collection = milvus_registry.get_collection(project, self.connection_args)
+        source = source.replace('\\', '\\\\').replace('"', '\\"')
+        res = collection.delete(expr=f'text_id == "{source}"')
+        return res.delete_count
 
-        status = utility.has_collection(project)  # check vector store
+    def flush(self, project):
+        '''Seal growing segments of the project collection, so that entity counts are up to date.'''
+        milvus_registry.get_collection(project, self.connection_args).flush()
+
+    def check(self, project):
+        status = milvus_registry.has_collection(project, self.connection_args)  # check vector store
         if self.use_scalar:
             assert self.es_client.indices.exists(
                 index=project) == status  # check scalar store
         return status
 
-    def count_entities(self, project):
-        if not self.check(project):
+    def count_entities(self, project, flush: bool = False, exists: bool = None):
+        '''Count entities of the project. Entities in growing segments are not counted until flushed
+        by the flusher or by flush=True, which blocks until segments are sealed.
+        Existence of the project is checked if not given.'''
+        if exists is None:
+            exists = self.check(project)
+        if not exists:
             milvus_count = es_count = None
         else:
-            collection = Collection(project)
-            collection.flush()
+            collection = milvus_registry.get_collection(project, self.connection_args)
+            if flush:
+                collection.flush()
             milvus_count = collection.num_entities
             if self.use_scalar:
                 es_count = self.es_client.count(index=project)['count']
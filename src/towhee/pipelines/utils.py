@@ -26,6 +26,8 @@ def get_llm_op(config):
 
 
 def get_embedding_op(config):
+    if getattr(config, 'customize_embedding_op', None) is not None:
+        return config.customize_embedding_op
     if config.embedding_device == -1:
         device = 'cpu'
     else:
@@ -0,0 +1,20 @@
+import unittest
+from unittest.mock import patch
+
+from offline_tools.rebuild_index import rebuild_index
+
+
+class TestRebuildIndex(unittest.TestCase):
+    '''Offline index rebuild test'''
+
+    def test_langchain(self):
+        index_params = {'metric_type': 'IP', 'index_type': 'IVF_FLAT', 'params': {'nlist': 128}}
+        with patch('src.langchain.store.vector_store.milvus.VectorStore.__init__', return_value=None), \
+                patch('src.langchain.store.vector_store.milvus.VectorStore.rebuild_index') as mock_rebuild:
+            mock_rebuild.return_value = {'params': {'nprobe': 8}}
+            rebuild_index('akcio_ut', platform='langchain', index_params=index_params)
+            mock_rebuild.assert_called_once_with(index_params)
+
+
+if __name__ == '__main__':
+    unittest.main()
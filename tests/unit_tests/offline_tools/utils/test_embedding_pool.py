@@ -0,0 +1,46 @@
+import time
+import unittest
+from functools import partial
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from offline_tools.insert import get_embedding_array
+from offline_tools.utils.embedding_pool import EmbeddingPool
+
+
+class StubEncoder:
+    '''Embed a text to [length, 1], slower for short texts so that chunks finish out of order'''
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def embed_documents_array(self, texts):
+        time.sleep(0.05 / len(texts[0]))
+        return np.array([[len(t), 1] for t in texts], dtype=np.float32)
+
+
+class TestEmbeddingPool(unittest.TestCase):
+    '''Multiprocess embedding pool test'''
+    texts = ['x' * i for i in range(1, 42)]
+
+    def test_in_order(self):
+        with EmbeddingPool(3, chunk_size=4, encoder_cls=StubEncoder) as pool:
+            chunks = list(pool.imap(self.texts))
+            res = pool.embed(self.texts)
+        assert [len(c) for c in chunks] == [4] * 10 + [1]
+        assert res.dtype == np.float32
+        assert res[:, 0].tolist() == list(range(1, 42))
+
+    def test_get_embedding_array(self):
+        df = pd.DataFrame({'file': ['f'] * len(self.texts), 'doc_chunk': self.texts, 'url': ['u'] * len(self.texts)})
+        with patch('offline_tools.insert.EmbeddingPool', partial(EmbeddingPool, encoder_cls=StubEncoder)):
+            res = get_embedding_array(df, enable_qa=False, workers=2)
+        assert res.shape == (len(self.texts), 4)
+        assert [row[-1][0] for row in res] == list(range(1, 42))
+        assert [row[1] for row in res] == self.texts
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import unittest
+
+import numpy as np
+
+from src.langchain.embedding.embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    '''Embedding cache test'''
+    db_path = os.path.join(os.path.dirname(__file__), 'embedding_cache.db')
+
+    def setUp(self):
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+        self.cache = EmbeddingCache(self.db_path)
+
+    def test_get_put(self):
+        key = EmbeddingCache.make_key('mock chunk', 'mock_model', True)
+        assert key != EmbeddingCache.make_key('mock chunk', 'mock_model', False)
+        assert self.cache.get_many([key]) == {}
+
+        emb = np.random.rand(8).astype(np.float32)
+        self.cache.put_many({key: emb.tolist()})
+        res = self.cache.get_many([key, 'missing'])
+        assert list(res.keys()) == [key]
+        assert np.array_equal(res[key], emb)
+        assert len(self.cache) == 1
+
+    def tearDown(self):
+        self.cache.close()
+        os.remove(self.db_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 from unittest.mock import patch
 import numpy as np
 
-from src.langchain.embedding.langchain_huggingface import TextEncoder
+from src.langchain.embedding.langchain_huggingface import TextEncoder, token_batches
 
 
 class TestLangchainHuggingface(unittest.TestCase):
@@ -10,18 +10,64 @@ class TestLangchainHuggingface(unittest.TestCase):
     rand_emb = np.random.rand(64, )
 
     def test_embed_query(self):
-        with patch('langchain.embeddings.HuggingFaceEmbeddings.embed_query') as mock_embed:
-            mock_embed.return_value = self.rand_emb
+        with patch.object(TextEncoder, '_encode') as mock_embed:
+            mock_embed.return_value = self.rand_emb.reshape(1, -1).astype(np.float32)
             text_encoder = TextEncoder()
-            res = text_encoder.embed_query('mock query')
-            self.assertEqual(self.rand_emb.tolist(), res)
+            res = text_encoder.embed_query('mock query', norm=False)
+            self.assertEqual(self.rand_emb.astype(np.float32).tolist(), res)
 
     def test_embed_documents(self):
-        with patch('langchain.embeddings.HuggingFaceEmbeddings.embed_documents') as mock_embed:
-            mock_embed.return_value = [self.rand_emb.tolist()]
+        with patch.object(TextEncoder, '_encode') as mock_embed:
+            mock_embed.return_value = self.rand_emb.reshape(1, -1).astype(np.float32)
             text_encoder = TextEncoder()
             res = text_encoder.embed_documents(['mock query'], norm=False)
-            self.assertEqual([self.rand_emb.tolist()], res)
+            self.assertEqual([self.rand_emb.astype(np.float32).tolist()], res)
+
+    def test_embed_documents_array(self):
+        with patch.object(TextEncoder, '_encode') as mock_embed:
+            mock_embed.return_value = np.array([[3, 4], [0, 0]], dtype=np.float32)
+            text_encoder = TextEncoder()
+            res = text_encoder.embed_documents_array(['mock query', 'empty'], norm=True)
+            self.assertEqual(res.dtype, np.float32)
+            self.assertTrue(res.flags['C_CONTIGUOUS'])
+            np.testing.assert_allclose(res, [[0.6, 0.8], [0, 0]], atol=1e-6)
+
+    def test_embed_query_cache(self):
+        with patch.object(TextEncoder, '_encode') as mock_embed:
+            mock_embed.return_value = self.rand_emb.reshape(1, -1).astype(np.float32)
+            text_encoder = TextEncoder(query_cache_size=8)
+            res = text_encoder.embed_query('mock query', norm=False)
+            res_cached = text_encoder.embed_query(' mock  query ', norm=False)
+            self.assertEqual(self.rand_emb.astype(np.float32).tolist(), res_cached)
+            self.assertEqual(res, res_cached)
+            self.assertEqual(mock_embed.call_count, 1)
+            self.assertEqual(text_encoder.query_cache_info()['hits'], 1)
+
+    def test_embed_queries(self):
+        with patch.object(TextEncoder, '_encode') as mock_embed:
+            mock_embed.side_effect = lambda texts: np.array([[len(t), 1] for t in texts], dtype=np.float32)
+            text_encoder = TextEncoder(query_cache_size=8, cache_path=None)
+            text_encoder.embed_query('a', norm=False)
+            res = text_encoder.embed_queries(['a', 'bb', ' bb '], norm=False)
+            self.assertEqual([[1, 1], [2, 1], [2, 1]], res)
+            # Cached query is not embedded again, the others are embedded in one pass
+            self.assertEqual([['a'], ['bb']], [c.args[0] for c in mock_embed.call_args_list])
+
+    def test_token_batches(self):
+        batches = token_batches([5, 50, 10, 48, 6, 200], max_tokens=100, max_batch_size=3)
+        self.assertEqual([[5], [1, 3], [2, 4, 0]], batches)
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(6)))
+        self.assertEqual([], token_batches([], max_tokens=100, max_batch_size=3))
+
+    def test_encode_batches(self):
+        text_encoder = TextEncoder(batch_tokens=8, max_batch_size=4)
+        texts = ['a b c d e f', 'a', 'a b c', 'a b']
+        with patch.object(TextEncoder, '_token_lengths', return_value=[len(t.split()) for t in texts]), \
+                patch.object(text_encoder.client, 'encode') as mock_encode:
+            mock_encode.side_effect = lambda batch, **kwargs: np.array([[len(t.split()), 1] for t in batch])
+            res = text_encoder.embed_documents_array(texts, norm=False)
+            self.assertEqual([[6, 1], [1, 1], [3, 1], [2, 1]], res.tolist())
+            self.assertEqual([['a b c d e f'], ['a b c', 'a b'], ['a']], [c.args[0] for c in mock_encode.call_args_list])
 
 
 if __name__ == '__main__':
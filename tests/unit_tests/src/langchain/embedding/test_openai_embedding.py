@@ -13,15 +13,24 @@ class TestOpenAIEmbedding(unittest.TestCase):
         with patch('langchain.embeddings.OpenAIEmbeddings.embed_query') as mock_embed:
             mock_embed.return_value = self.rand_emb
             text_encoder = TextEncoder(openai_api_key='mock-key')
-            res = text_encoder.embed_query('mock query')
-            self.assertEqual(self.rand_emb.tolist(), res)
+            res = text_encoder.embed_query('mock query', norm=True)
+            np.testing.assert_allclose(res, self.rand_emb / np.linalg.norm(self.rand_emb))
 
     def test_embed_documents(self):
         with patch('langchain.embeddings.OpenAIEmbeddings.embed_documents') as mock_embed:
             mock_embed.return_value = [self.rand_emb.tolist()]
             text_encoder = TextEncoder(openai_api_key='mock-key')
             res = text_encoder.embed_documents(['mock query'], norm=False)
-            self.assertEqual([self.rand_emb.tolist()], res)
+            self.assertEqual([self.rand_emb.astype(np.float32).tolist()], res)
+
+    def test_embed_documents_array(self):
+        with patch('langchain.embeddings.OpenAIEmbeddings.embed_documents') as mock_embed:
+            mock_embed.return_value = [[3.0, 4.0], [6.0, 8.0]]
+            text_encoder = TextEncoder(openai_api_key='mock-key')
+            res = text_encoder.embed_documents_array(['mock query', 'mock doc'], norm=True)
+            self.assertEqual(res.dtype, np.float32)
+            self.assertEqual((2, 2), res.shape)
+            np.testing.assert_allclose(res, [[0.6, 0.8], [0.6, 0.8]], atol=1e-6)
 
 
 if __name__ == '__main__':
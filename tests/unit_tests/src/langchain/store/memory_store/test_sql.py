@@ -0,0 +1,45 @@
+import os
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+from src.langchain.store.memory_store.sql import WindowedSQLChatMessageHistory
+
+
+class TestWindowedHistory(unittest.TestCase):
+    '''Windowed SQL chat message history test'''
+    table_name = 'akcio_ut'
+    db_path = os.path.join(os.path.dirname(__file__), 'sqlite.db')
+    connect_str = f'sqlite:///{db_path}'
+
+    def setUp(self):
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+
+    def test_window(self):
+        history = WindowedSQLChatMessageHistory(
+            session_id='test000', connection_string=self.connect_str, table_name=self.table_name, max_turns=2)
+        for i in range(3):
+            history.add_user_message(f'question {i}')
+            history.add_ai_message(f'answer {i}')
+        assert [m.content for m in history.messages] == ['question 1', 'answer 1', 'question 2', 'answer 2']
+        assert [m.content for m in history.get_messages(limit=2, offset=2)] == ['question 1', 'answer 1']
+        assert len(history.get_messages()) == 6
+
+        history.max_tokens = 4
+        assert [m.content for m in history.messages] == ['question 2', 'answer 2']
+
+        history.summary_loader = lambda: 'earlier summary'
+        assert history.messages[0].content == 'Summary of earlier conversation: earlier summary'
+        assert history.count() == 6
+
+        indexes = inspect(create_engine(self.connect_str)).get_indexes(self.table_name)
+        assert any(idx['column_names'] == ['session_id'] for idx in indexes)
+
+    def tearDown(self):
+        if os.path.exists(self.db_path):
+            os.remove(self.db_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import unittest
+
+from src.langchain.store.scalar_store.bm25 import ScalarStore, BM25Index, tokenize
+
+
+class TestBM25ScalarStore(unittest.TestCase):
+    '''In-process BM25 scalar store test'''
+    project = 'akcio_ut'
+    data_dir = os.path.join(os.path.dirname(__file__), 'scalar_data')
+
+    def setUp(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_tokenize(self):
+        assert tokenize('Hello, Akcio_v2!') == ['hello', 'akcio', 'v2']
+        assert tokenize('向量数据库') == ['向', '量', '数', '据', '库']
+
+    def test_search(self):
+        store = ScalarStore(index_name=self.project, data_dir=self.data_dir)
+        assert not ScalarStore.has_project(self.project, data_dir=self.data_dir)
+        assert store.insert(['milvus is a vector database', 'elasticsearch is a search engine']) == 2
+        ids = store.add_texts(['towhee builds pipelines', 'the vector database stores vector embeddings'])
+        assert ScalarStore.has_project(self.project, data_dir=self.data_dir)
+        assert ScalarStore.count_entities(self.project, data_dir=self.data_dir) == 4
+
+        res = store.search_with_score('vector database', top_k=2)
+        assert [doc.page_content for doc, _ in res] == [
+            'the vector database stores vector embeddings', 'milvus is a vector database']
+        assert res[0][1] > res[1][1] > 0
+        assert store.search_with_score('nothing matched') == []
+
+        assert store.find_texts(['towhee builds pipelines', 'towhee']) == ids[:1]
+        store.delete(ids[1:])
+        assert store.find_texts(['the vector database stores vector embeddings']) == []
+        res = store.search_with_score('vector database', top_k=2)
+        assert [doc.page_content for doc, _ in res] == ['milvus is a vector database']
+        assert ScalarStore.count_entities(self.project, data_dir=self.data_dir) == 3
+
+        # Reloaded from disk with deletions
+        index = BM25Index(os.path.join(self.data_dir, self.project))
+        assert index.count() == 3
+        assert [x[0] for x in index.search('vector', top_k=3)] == ['milvus is a vector database']
+
+        ScalarStore.drop(self.project, data_dir=self.data_dir)
+        assert not ScalarStore.has_project(self.project, data_dir=self.data_dir)
+
+    def test_merge(self):
+        index = BM25Index(os.path.join(self.data_dir, self.project), max_segments=2)
+        ids = index.add(['doc one'])
+        index.add(['doc two'])
+        index.delete(ids)
+        scores = [x[1] for x in index.search('doc two', top_k=3)]
+        index.add(['doc three'])
+        assert len(index.segments) == 1
+        assert index.count() == 2
+        assert [x[0] for x in index.search('doc two', top_k=3)] == ['doc two', 'doc three']
+        assert len(scores) == 1
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from src.langchain.store.scalar_store.es import ScalarStore, get_client
+
+
+class TestScalarStore(unittest.TestCase):
+    '''Elasticsearch scalar store test'''
+    index_name = 'akcio_ut'
+
+    def test_get_client(self):
+        args = {'hosts': 'http://localhost:9200'}
+        assert get_client(args) is get_client(dict(args))
+        assert ScalarStore.connect(args) is get_client(args)
+
+    def test_add_texts(self):
+        client = MagicMock()
+        store = ScalarStore(index_name=self.index_name, client=client)
+        with patch('src.langchain.store.scalar_store.es.streaming_bulk') as mock_bulk:
+            mock_bulk.side_effect = lambda client, actions, **kwargs: [(True, a) for a in actions]
+            ids = store.add_texts(['doc 1', 'doc 2'], chunk_size=10, workers=1)
+        assert len(set(ids)) == 2
+        assert mock_bulk.call_args[1]['chunk_size'] == 10
+        client.indices.put_settings.assert_not_called()
+        client.indices.refresh.assert_called_once_with(index=self.index_name)
+
+        # The index is created with the explicit mapping, even by a small ingestion
+        client.indices.exists.return_value = False
+        with patch('src.langchain.store.scalar_store.es.streaming_bulk', return_value=[]):
+            store.add_texts(['doc 3'])
+        assert client.options.return_value.indices.create.call_args[1]['mappings'] == {'properties': {'content': {'type': 'text'}}}
+
+    def test_add_texts_parallel(self):
+        client = MagicMock()
+        client.indices.get_settings.return_value = {self.index_name: {'settings': {'index': {'refresh_interval': '5s'}}}}
+        store = ScalarStore(index_name=self.index_name, client=client)
+        actions = []
+        with patch('src.langchain.store.scalar_store.es.parallel_bulk') as mock_bulk:
+            mock_bulk.side_effect = lambda client, acts, **kwargs: [actions.append(a) or (True, a) for a in acts]
+            assert store.insert([f'doc {i}' for i in range(5)]) == 5
+            store.add_texts([f'doc {i}' for i in range(5)], chunk_size=2, workers=2)
+        assert [a['content'] for a in actions[:5]] == [f'doc {i}' for i in range(5)]
+        assert mock_bulk.call_args[1]['thread_count'] == 2
+        # Refresh is turned off during the ingestion of multiple chunks, and restored to the former setting after that
+        settings = [c[1]['settings']['index']['refresh_interval'] for c in client.indices.put_settings.call_args_list]
+        assert settings == ['-1', '5s']
+        assert client.indices.refresh.call_count == 2
+
+
+    def test_find_texts(self):
+        client = MagicMock()
+        store = ScalarStore(index_name=self.index_name, client=client)
+        hits = [{'_id': '1', '_source': {'content': 'doc 1'}}, {'_id': '2', '_source': {'content': 'doc 1 and more'}}]
+        with patch('src.langchain.store.scalar_store.es.scan', return_value=hits) as mock_scan:
+            # Docs matched by phrase are compared exactly
+            assert store.find_texts(['doc 1']) == ['1']
+        assert mock_scan.call_args[1]['query'] == {'query': {'bool': {'should': [{'match_phrase': {'content': 'doc 1'}}]}}}
+
+
+if __name__ == '__main__':
+    unittest.main()
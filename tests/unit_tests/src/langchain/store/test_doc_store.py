@@ -0,0 +1,86 @@
+import os
+import unittest
+
+from src.manifest import Manifest
+from src.langchain.store import DocStore
+
+
+class MockStore:
+    def __init__(self, fail: bool = False):
+        self.texts = {}
+        self.fail = fail
+        self.next_id = 0
+
+    def add_texts(self, texts):
+        if self.fail:
+            raise RuntimeError('mock failure')
+        ids = [str(self.next_id + i) for i in range(len(texts))]
+        self.next_id += len(texts)
+        self.texts.update(zip(ids, texts))
+        return ids
+
+    def find_texts(self, texts):
+        return [i for i, t in self.texts.items() if t in texts]
+
+    def delete(self, ids):
+        for i in ids:
+            self.texts.pop(str(i), None)
+
+
+class TestDocStore(unittest.TestCase):
+    '''Doc store sync test'''
+    project = 'akcio_ut'
+    source = 'akcio_ut.txt'
+
+    db_path = os.path.join(os.path.dirname(__file__), 'manifest.db')
+    manifest = Manifest(connect_str=f'sqlite:///{db_path}')
+
+    def _doc_store(self, scalar_fail: bool = False):
+        doc_db = DocStore.__new__(DocStore)
+        doc_db.table_name = self.project
+        doc_db.vector_db = MockStore()
+        doc_db.scalar_db = MockStore(fail=scalar_fail)
+        return doc_db
+
+    def tearDown(self):
+        self.manifest.remove(self.project)
+
+    def test_sync_inserted(self):
+        doc_db = self._doc_store()
+        assert doc_db.insert(['chunk 1', 'chunk 2'], source=self.source, manifest=self.manifest) == 2
+        changes = doc_db.sync(self.source, ['chunk 2', 'chunk 3'], self.manifest)
+        assert changes == {'source': self.source, 'added': 1, 'deleted': 1, 'unchanged': 1}
+        assert sorted(doc_db.vector_db.texts.values()) == ['chunk 2', 'chunk 3']
+        assert sorted(doc_db.scalar_db.texts.values()) == ['chunk 2', 'chunk 3']
+
+    def test_sync_untracked(self):
+        doc_db = self._doc_store()
+        # Chunks inserted before sources were tracked, and a chunk tracked by another source
+        doc_db.vector_db.add_texts(['chunk 1', 'chunk 2'])
+        doc_db.scalar_db.add_texts(['chunk 1', 'chunk 2'])
+        doc_db.sync('other.txt', ['chunk 2'], self.manifest)
+
+        changes = doc_db.sync(self.source, ['chunk 1', 'chunk 2'], self.manifest)
+        assert changes == {'source': self.source, 'added': 2, 'deleted': 1, 'unchanged': 0}
+        assert sorted(doc_db.vector_db.texts.values()) == ['chunk 1', 'chunk 2', 'chunk 2']
+        assert sorted(doc_db.scalar_db.texts.values()) == ['chunk 1', 'chunk 2', 'chunk 2']
+
+    def test_sync_rollback(self):
+        doc_db = self._doc_store(scalar_fail=True)
+        with self.assertRaises(RuntimeError):
+            doc_db.sync(self.source, ['chunk 1'], self.manifest)
+        assert doc_db.vector_db.texts == {}
+        assert self.manifest.get(self.project, self.source) == []
+
+        doc_db.scalar_db.fail = False
+        changes = doc_db.sync(self.source, ['chunk 1'], self.manifest)
+        assert changes['added'] == 1
+        assert list(doc_db.vector_db.texts.values()) == ['chunk 1']
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.db_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
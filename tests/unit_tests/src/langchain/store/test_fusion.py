@@ -0,0 +1,34 @@
+import unittest
+
+from langchain.docstore.document import Document
+
+from src.langchain.store.fusion import fuse
+
+
+class TestFusion(unittest.TestCase):
+    '''Fusion test'''
+    vector_res = [(Document(page_content='a'), 0.9), (Document(page_content='b'), 0.8), (Document(page_content='c'), 0.1)]
+    scalar_res = [(Document(page_content='c'), 12.0), (Document(page_content='d'), 3.0)]
+
+    def test_rrf(self):
+        docs = fuse([self.vector_res, self.scalar_res], method='rrf')
+        assert [d.page_content for d in docs] == ['c', 'a', 'b', 'd']
+
+    def test_weighted(self):
+        docs = fuse([self.vector_res, self.scalar_res], method='weighted', weights=[1.0, 0.5], top_k=2)
+        assert [d.page_content for d in docs] == ['a', 'b']
+
+    def test_weighted_distance(self):
+        # L2 distances of vector store, lower is better
+        vector_res = [(Document(page_content='a'), 0.1), (Document(page_content='b'), 0.2), (Document(page_content='c'), 0.9)]
+        docs = fuse([vector_res, self.scalar_res], method='weighted', weights=[1.0, 0.5], top_k=2,
+                    higher_is_better=[False, True])
+        assert [d.page_content for d in docs] == ['a', 'b']
+
+    def test_append(self):
+        docs = fuse([self.vector_res, self.scalar_res], method='append')
+        assert [d.page_content for d in docs] == ['a', 'b', 'c', 'd']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import shutil
+import unittest
+
+import numpy as np
+
+from src.langchain.store.vector_store.local import VectorStore, LocalIndex
+from src.search_tuner import search_tuner
+
+
+class MockEmbeddings:
+    '''Embed texts to one-hot vectors by the first letter'''
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text):
+        vec = [0.0] * 26
+        vec[ord(text[0].lower()) - ord('a')] = 1.0
+        return vec
+
+
+class MockArrayEmbeddings(MockEmbeddings):
+    '''Return embeddings of documents as a float32 array'''
+
+    def embed_documents(self, texts):
+        raise AssertionError('Lists of embeddings should not be used when arrays are available.')
+
+    def embed_documents_array(self, texts):
+        return np.asarray([self.embed_query(t) for t in texts], dtype=np.float32)
+
+
+class TestLocalVectorStore(unittest.TestCase):
+    '''Local vector store test'''
+    project = 'akcio_ut'
+    data_dir = os.path.join(os.path.dirname(__file__), 'vector_data')
+
+    def setUp(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_store(self):
+        store = VectorStore(table_name=self.project, embedding_func=MockEmbeddings(), data_dir=self.data_dir)
+        assert store.col is None
+        assert store.find_texts(['apple']) == []
+        assert not VectorStore.has_project(self.project, data_dir=self.data_dir)
+
+        assert store.insert(['apple', 'banana'], metadatas=[{'source': 'a.txt'}, {'source': 'b.txt'}]) == 2
+        pks = store.add_texts(['avocado'], metadatas=[{'source': 'b.txt'}])
+        assert store.insert_embeddings([MockEmbeddings().embed_query('cherry')], [{'text': 'c?', 'doc': 'cherry'}]) == 1
+        assert VectorStore.has_project(self.project, data_dir=self.data_dir)
+        assert VectorStore.count_entities(self.project, data_dir=self.data_dir) == 4
+        assert store.describe()['dim'] == 26
+
+        res = store.similarity_search_with_score('a', k=2)
+        assert sorted(doc.page_content for doc, _ in res) == ['apple', 'avocado']
+        assert all(score == 1.0 for _, score in res)
+        docs = store.similarity_search('a', k=4, metadata_filter={'source': 'b.txt'})
+        assert [doc.page_content for doc in docs] == ['avocado', 'banana']
+        assert [doc.page_content for doc in store.search('c')][0] == 'cherry'
+
+        batch = store.batch_search([MockEmbeddings().embed_query('b'), MockEmbeddings().embed_query('c')])
+        assert [docs[0].page_content for docs in batch] == ['banana', 'cherry']
+
+        store.delete([str(pk) for pk in pks])
+        assert [doc.page_content for doc in store.similarity_search('a', k=2)][0] == 'apple'
+        assert store.find_texts(['avocado', 'banana', 'kiwi']) == [1]
+        assert VectorStore.count_entities(self.project, data_dir=self.data_dir) == 3
+
+        VectorStore.drop(self.project, data_dir=self.data_dir)
+        assert not VectorStore.has_project(self.project, data_dir=self.data_dir)
+
+    def test_array_embeddings(self):
+        embeddings = MockArrayEmbeddings()
+        store = VectorStore(table_name=self.project, embedding_func=embeddings, data_dir=self.data_dir)
+        assert store.insert(['apple', 'banana']) == 2
+        assert store.insert_embeddings(embeddings.embed_documents_array(['c?']), [{'text': 'cherry'}]) == 1
+        assert [doc.page_content for doc in store.search('c')][0] == 'cherry'
+        assert VectorStore.count_entities(self.project, data_dir=self.data_dir) == 3
+        VectorStore.drop(self.project, data_dir=self.data_dir)
+
+    def test_ivf(self):
+        rng = np.random.default_rng(0)
+        data = rng.standard_normal((2000, 16)).astype(np.float32)
+        index = LocalIndex(os.path.join(self.data_dir, self.project), nlist=16, ivf_threshold=1000)
+        index.add(data[:500], [{'text': str(i)} for i in range(500)])
+        assert index.index_type == 'FLAT'
+        index.add(data[500:], [{'text': str(i)} for i in range(500, 2000)])
+        assert index.index_type == 'IVF_FLAT'
+
+        queries = data[:20]
+        exact = [[pk for pk, _ in hits] for hits in index.search(queries, k=5, nprobe=16)]
+        assert [hits[0] for hits in exact] == list(np.argmax(queries @ data.T, axis=1))
+        approx = [[pk for pk, _ in hits] for hits in index.search(queries, k=5, nprobe=4)]
+        recall = np.mean([len(set(a) & set(e)) / 5 for a, e in zip(approx, exact)])
+        assert recall > 0.5
+
+        index.tune(auto_tune=True).result()
+        assert search_tuner.get(index.path)['nprobe'] <= 16
+
+        # Reloaded from disk with the IVF index
+        reloaded = LocalIndex(index.path, ivf_threshold=1000)
+        assert reloaded.index_type == 'IVF_FLAT'
+        assert reloaded.search(queries, k=5, nprobe=16)[0] == index.search(queries, k=5, nprobe=16)[0]
+
+    def test_ivf_probe(self):
+        # Clusters of different norms, the query is nearer to the small one but has a larger dot product with the other
+        rng = np.random.default_rng(0)
+        data = np.concatenate([
+            [10, 0] + rng.standard_normal((600, 2)) * 0.1,
+            [1, 0] + rng.standard_normal((600, 2)) * 0.1
+        ]).astype(np.float32)
+        index = LocalIndex(os.path.join(self.data_dir, self.project), metric_type='L2', nlist=2, ivf_threshold=1000)
+        index.add(data, [{'text': str(i)} for i in range(len(data))])
+        assert index.index_type == 'IVF_FLAT'
+
+        query = np.asarray([[1, 0]], dtype=np.float32)
+        nearest = int(np.argmin(((data - query) ** 2).sum(axis=1)))
+        assert index.search(query, k=1, nprobe=1)[0][0][0] == nearest
+
+    def test_interrupted_add(self):
+        path = os.path.join(self.data_dir, self.project)
+        embeddings = MockArrayEmbeddings()
+        index = LocalIndex(path)
+        index.add(embeddings.embed_documents_array(['a', 'b']), [{'text': 'a'}, {'text': 'b'}])
+        # Crashed after the vector of c is written, with a torn row
+        with open(os.path.join(path, 'vectors.f32'), 'ab') as f:
+            f.write(embeddings.embed_documents_array(['c']).tobytes())
+        with open(os.path.join(path, 'rows.jsonl'), 'ab') as f:
+            f.write(b'{"text": ')
+
+        index = LocalIndex(path)
+        assert index.count() == 2
+        assert index.add(embeddings.embed_documents_array(['d']), [{'text': 'd'}]) == [2]
+        index = LocalIndex(path)
+        assert [row['text'] for row in index.rows] == ['a', 'b', 'd']
+        assert index.search(embeddings.embed_documents_array(['d']), k=1)[0][0][0] == 2
+
+    def test_empty(self):
+        store = VectorStore(table_name=self.project, embedding_func=MockEmbeddings(), data_dir=self.data_dir)
+        assert store.insert_embeddings([], []) == 0
+        assert VectorStore.count_entities(self.project, data_dir=self.data_dir) == 0
+        assert not VectorStore.has_project(self.project, data_dir=self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
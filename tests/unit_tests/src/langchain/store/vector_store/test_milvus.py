@@ -0,0 +1,112 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from src.langchain.store.vector_store.milvus import VectorStore, project_expr
+from src.catalog import catalog
+from src.search_tuner import search_tuner
+
+
+class TestSharedCollection(unittest.TestCase):
+    '''Projects in a shared Milvus collection test'''
+    project = 'akcio_ut'
+    shared_collection = 'akcio_shared'
+
+    def test_project_expr(self):
+        assert project_expr(self.project) == 'project == "akcio_ut"'
+        assert project_expr(self.project, 'pk in [1,2]') == '(project == "akcio_ut") and (pk in [1,2])'
+
+    def test_with_project(self):
+        store = VectorStore.__new__(VectorStore)
+        store.project = self.project
+        store.shared = True
+        metadatas = store._with_project([{'doc': 'answer'}, {}], 2)  # pylint: disable=W0212
+        assert metadatas == [{'doc': 'answer', 'project': self.project}, {'doc': '', 'project': self.project}]
+        assert store._with_project(None, 1) == [{'doc': '', 'project': self.project}]  # pylint: disable=W0212
+
+    def test_find_texts(self):
+        store = VectorStore.__new__(VectorStore)
+        store.project = self.project
+        store.shared = True
+        store._text_field = 'text'  # pylint: disable=W0212
+        store._primary_field = 'pk'  # pylint: disable=W0212
+        store.col = MagicMock()
+        store.col.query.return_value = [{'pk': 1}, {'pk': 2}]
+        assert store.find_texts(['say "hi"', 'say "hi"']) == [1, 2]
+        store.col.query.assert_called_once_with(
+            expr=project_expr(self.project, 'text in ["say \\"hi\\""]'), output_fields=['pk'])
+
+    def test_static_ops(self):
+        collection = MagicMock()
+        collection.query.side_effect = lambda expr, output_fields, **kwargs: \
+            [{'count(*)': 3}] if output_fields == ['count(*)'] else [{'pk': 1}]
+        with patch('src.langchain.store.vector_store.milvus.milvus_registry') as registry:
+            registry.has_collection.return_value = True
+            registry.get_collection.return_value = collection
+
+            assert VectorStore.has_project(self.project, shared_collection=self.shared_collection)
+            assert VectorStore.count_entities(self.project, shared_collection=self.shared_collection) == 3
+            VectorStore.drop(self.project, shared_collection=self.shared_collection)
+            collection.delete.assert_called_once_with(expr=project_expr(self.project))
+            collection.drop.assert_not_called()
+            assert all(c[0][0] == self.shared_collection for c in registry.get_collection.call_args_list)
+
+
+class TestTuning(unittest.TestCase):
+    '''Index & search params tuning test'''
+    collection_name = 'akcio_ut_tune'
+
+    def _store(self):
+        store = VectorStore.__new__(VectorStore)
+        store.project = self.collection_name
+        store.collection_name = self.collection_name
+        store.search_params = {'metric_type': 'IP', 'params': {}}
+        store._vector_field = 'vector'  # pylint: disable=W0212
+        store._primary_field = 'pk'  # pylint: disable=W0212
+        store.col = MagicMock()
+        store.col.num_entities = 100000
+        iterator = MagicMock()
+        iterator.next.side_effect = [[{'pk': 1}, {'pk': 2}], []]
+        store.col.query_iterator.return_value = iterator
+        store.col.query.return_value = [{'pk': 2, 'vector': [0.0, 1.0]}, {'pk': 1, 'vector': [1.0, 0.0]}]
+        hits = [MagicMock(id=1), MagicMock(id=2)]
+        store.col.search.return_value = [hits, hits[::-1]]
+        index_params = {'metric_type': 'IP', 'index_type': 'FLAT', 'params': {}}
+        store.describe = MagicMock(return_value={'index_type': 'FLAT', 'index_params': index_params})
+        return store
+
+    def tearDown(self):
+        search_tuner.invalidate(self.collection_name)
+        catalog.invalidate(self.collection_name)
+
+    def test_no_online_rebuild(self):
+        store = self._store()
+        with patch('src.langchain.store.vector_store.milvus.AUTO_INDEX', True), \
+                patch('src.langchain.store.vector_store.milvus.AUTO_TUNE', False):
+            assert store._tune() == {'params': None}  # pylint: disable=W0212
+            assert store._tune() == {'params': None}  # pylint: disable=W0212
+        # Index params are described once, then read from the catalog
+        store.describe.assert_called_once()
+        store.col.release.assert_not_called()
+        store.col.drop_index.assert_not_called()
+
+    def test_rebuild_index(self):
+        store = self._store()
+        other = self._store()
+        res = store.rebuild_index()
+        store.col.release.assert_called_once()
+        _, kwargs = store.col.create_index.call_args
+        assert kwargs['index_params']['index_type'] == 'IVF_FLAT'
+        assert store.describe.call_count == 2
+        # Search params are tuned for the new index, and shared by other stores of the collection
+        assert res['params'] == {'nprobe': 1}
+        # Sampled vectors are searched as queries, with the next hit after themselves
+        _, kwargs = store.col.search.call_args
+        assert kwargs['data'] == [[1.0, 0.0], [0.0, 1.0]] and kwargs['limit'] == search_tuner.k + 1
+        store.col.query_iterator.return_value.close.assert_called_once()
+        assert other._search_params() == {'metric_type': 'IP', 'params': {'nprobe': 1}}  # pylint: disable=W0212
+        with patch('src.langchain.store.vector_store.milvus.AUTO_TUNE', False):
+            assert other._tune() == {'params': {'nprobe': 1}}  # pylint: disable=W0212
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from langchain.docstore.document import Document
+
+os.environ.setdefault('OPENAI_API_KEY', 'mock-key')
+
+
+class MockMemoryStore:
+    def __init__(self):
+        self.history = []
+
+    def add_history(self, messages):
+        self.history += messages
+
+
+class TestOperations(unittest.TestCase):
+    '''LangChain operations test'''
+
+    def test_abatch_chat(self):
+        from src.langchain import operations  # pylint: disable=C0415
+
+        loop_thread = threading.get_ident()
+        threads = []
+        memory_db = MockMemoryStore()
+
+        def _get_doc_store(project):
+            doc_db = MagicMock()
+            doc_db.batch_search.side_effect = lambda queries, embeddings: [
+                [Document(page_content=f'{project} {q}')] for q in queries]
+            return doc_db
+
+        def _get_chain(project):
+            threads.append(threading.get_ident())
+            qa = MagicMock()
+
+            async def _arun(input_documents, question):
+                return input_documents[0].page_content
+            qa.combine_docs_chain.arun = _arun
+            return qa
+
+        def _get_memory_store(project, session_id):
+            threads.append(threading.get_ident())
+            return memory_db
+
+        items = [
+            {'session_id': 's0', 'project': 'p0', 'question': 'q0'},
+            {'session_id': 's1', 'project': 'p1', 'question': 'q1'},
+            {'session_id': 's0', 'project': 'p0', 'question': 'q2'}
+        ]
+        with patch.object(operations, 'get_doc_store', _get_doc_store), \
+                patch.object(operations, 'get_chain', _get_chain), \
+                patch.object(operations, 'get_memory_store', _get_memory_store), \
+                patch.object(type(operations.encoder), 'embed_queries', return_value=[[0.0], [1.0], [2.0]]) as mock_queries, \
+                patch.object(type(operations.encoder), 'embed_documents') as mock_documents:
+            results = asyncio.run(operations.abatch_chat(items))
+
+        assert results == [('q0', 'p0 q0'), ('q1', 'p1 q1'), ('q2', 'p0 q2')]
+        mock_queries.assert_called_once_with(['q0', 'q1', 'q2'])
+        mock_documents.assert_not_called()
+        # Store lookups do not block the event loop
+        assert len(threads) == 6 and loop_thread not in threads
+        assert len(memory_db.history) == 3
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import time
+import unittest
+
+from src.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    '''LRU cache test'''
+
+    def test_evict(self):
+        evicted = []
+        cache = LRUCache(maxsize=2, on_evict=lambda k, v: evicted.append(k))
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        assert 'b' not in cache
+        assert evicted == ['b']
+        assert len(cache) == 2
+
+    def test_get_or_create(self):
+        cache = LRUCache(maxsize=2)
+        assert cache.get_or_create('a', lambda: 1) == 1
+        assert cache.get_or_create('a', lambda: 2) == 1
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_pop_if(self):
+        cache = LRUCache(maxsize=4)
+        cache.put(('p1', 's1'), 1)
+        cache.put(('p1', 's2'), 2)
+        cache.put(('p2', 's1'), 3)
+        removed = cache.pop_if(lambda k: k[0] == 'p1')
+        assert len(removed) == 2
+        assert len(cache) == 1
+
+    def test_disabled(self):
+        cache = LRUCache(maxsize=0)
+        assert cache.get_or_create('a', lambda: 1) == 1
+        assert len(cache) == 0
+
+    def test_ttl(self):
+        cache = LRUCache(maxsize=2, ttl=0.05)
+        cache.put('a', 1)
+        assert cache.get('a') == 1
+        time.sleep(0.06)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+
+    def test_maxweight(self):
+        cache = LRUCache(maxsize=10, maxweight=5)
+        cache.put('a', 'xx')
+        cache.put('b', 'yyy')
+        assert cache.stats()['weight'] == 5
+        cache.put('c', 'z')
+        assert 'a' not in cache
+        assert cache.stats()['weight'] == 4
+        cache.pop('b')
+        assert cache.stats()['weight'] == 1
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from src.catalog import ProjectCatalog
+
+
+class TestProjectCatalog(unittest.TestCase):
+    '''Project catalog test'''
+
+    def test_get(self):
+        calls = []
+
+        def _check():
+            calls.append(1)
+            return True
+
+        catalog = ProjectCatalog(maxsize=4, ttl=30)
+        assert catalog.get('akcio_ut', 'store', _check)
+        assert catalog.get('akcio_ut', 'store', _check)
+        assert len(calls) == 1
+        assert catalog.get('akcio_ut', 'memory') is None
+
+    def test_update(self):
+        catalog = ProjectCatalog(maxsize=4, ttl=30)
+        catalog.update('akcio_ut', store=True, memory=True, dim=768, index_type='FLAT')
+        catalog.update('akcio_ut', store=False)
+        assert catalog.get('akcio_ut', 'store') is False
+        assert catalog.get('akcio_ut', 'memory') is True
+        assert catalog.get('akcio_ut', 'dim') == 768
+        assert catalog.update('akcio_ut', only_missing=True, store=True, schema=['pk'])['store'] is False
+        assert catalog.get('akcio_ut', 'schema') == ['pk']
+        catalog.invalidate('akcio_ut')
+        assert catalog.get('akcio_ut', 'store', lambda: True)
+
+    def test_get_race(self):
+        catalog = ProjectCatalog(maxsize=4, ttl=30)
+
+        def _check():
+            # Dropped while checking, the stale value loaded before is not cached
+            catalog.update('akcio_ut', store=False)
+            return True
+
+        assert catalog.get('akcio_ut', 'store', _check) is False
+        assert catalog.get('akcio_ut', 'store') is False
+
+    def test_update_expiry(self):
+        catalog = ProjectCatalog(maxsize=4, ttl=0.2)
+        catalog.update('akcio_ut', store=True)
+        time.sleep(0.15)
+        catalog.update('akcio_ut', memory=True)
+        time.sleep(0.1)
+        # Expired by the time of its creation, not extended by the update
+        assert catalog.get('akcio_ut', 'memory') is None
+
+    def test_concurrent_update(self):
+        catalog = ProjectCatalog(maxsize=4, ttl=30)
+        fields = [f'field_{i}' for i in range(32)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda field: catalog.update('akcio_ut', **{field: True}), fields))
+        assert all(catalog.get('akcio_ut', field) for field in fields)
+
+
+if __name__ == '__main__':
+    unittest.main()
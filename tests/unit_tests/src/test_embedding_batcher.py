@@ -0,0 +1,62 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from src.embedding_batcher import EmbeddingBatcher, get_batcher
+from tests.unit_tests.src.test_onnx_embedding import make_text_encoder
+
+
+def embed_batch(texts):
+    return np.array([[len(t), 1] for t in texts], dtype=np.float32)
+
+
+class TestEmbeddingBatcher(unittest.TestCase):
+    '''Embedding batcher test'''
+
+    def test_coalesce(self):
+        batch_sizes = []
+
+        def embed(texts):
+            batch_sizes.append(len(texts))
+            return embed_batch(texts)
+
+        batcher = EmbeddingBatcher(embed, max_batch_size=4, max_wait=0.2)
+        futures = [batcher.submit('a' * i) for i in range(1, 7)]
+        assert [f.result().tolist() for f in futures] == [[i, 1] for i in range(1, 7)]
+        assert batch_sizes == [4, 2]
+        assert batcher.stats() == {'batches': 2, 'requests': 6, 'mean_batch_size': 3.0}
+        batcher.close()
+        with self.assertRaises(RuntimeError):
+            batcher.submit('a')
+
+    def test_concurrent_callers(self):
+        batcher = EmbeddingBatcher(embed_batch, max_batch_size=8, max_wait=0.05)
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            res = list(executor.map(batcher, ['a' * i for i in range(1, 33)]))
+        assert [x[0] for x in res] == list(range(1, 33))
+        assert batcher.stats()['batches'] < 32
+        batcher.close()
+
+    def test_error(self):
+        batcher = EmbeddingBatcher(MagicMock(side_effect=ValueError('mock error')), max_wait=0)
+        with self.assertRaises(ValueError):
+            batcher.embed('a')
+        batcher.close()
+
+    def test_get_batcher(self):
+        make = MagicMock(return_value=embed_batch)
+        batcher = get_batcher('ut', make)
+        assert get_batcher('ut', make) is batcher
+        assert make.call_count == 1
+        assert batcher('abc').tolist() == [3, 1]
+
+    def test_text_encoder(self):
+        text_encoder = make_text_encoder(coalesce=True)
+        assert text_encoder.embed_query('abc', norm=False) == [3, 0]
+        assert text_encoder.embed_query_future('ab', norm=True).result().tolist() == [1, 0]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from langchain.schema import HumanMessage, AIMessage
+
+from src.history_window import window_size, trim_by_tokens
+
+
+def turn_text(turn):
+    return ' '.join(x for x in turn if x)
+
+
+class TestHistoryWindow(unittest.TestCase):
+    '''History window test'''
+
+    def test_window_size(self):
+        assert window_size(3) == 6
+        assert window_size(None) is None
+
+    def test_trim_messages(self):
+        messages = [HumanMessage(content='one two'), AIMessage(content='three'), HumanMessage(content='four five')]
+        assert trim_by_tokens(messages, 3, lambda m: m.content) == messages[1:]
+        assert trim_by_tokens(messages, None, lambda m: m.content) == messages
+
+    def test_trim_turns(self):
+        turns = [('one two', 'three'), ('four', None)]
+        assert trim_by_tokens(turns, 3, turn_text) == turns[1:]
+        assert trim_by_tokens(turns, 4, turn_text) == turns
+        assert trim_by_tokens(turns, 0, turn_text) == turns
+
+
+if __name__ == '__main__':
+    unittest.main()
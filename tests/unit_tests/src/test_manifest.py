@@ -0,0 +1,40 @@
+import os
+import unittest
+
+from src.manifest import Manifest
+
+
+class TestManifest(unittest.TestCase):
+    '''Ingestion manifest test'''
+    project = 'akcio_ut'
+    source = 'akcio_ut.txt'
+
+    db_path = os.path.join(os.path.dirname(__file__), 'manifest.db')
+    manifest = Manifest(connect_str=f'sqlite:///{db_path}')
+
+    def test_diff(self):
+        self.manifest.add(self.project, self.source, [
+            {'chunk_hash': Manifest.hash_chunk('chunk 1'), 'vector_pk': 1},
+            {'chunk_hash': Manifest.hash_chunk('chunk 2'), 'vector_pk': 2}
+        ])
+        assert self.manifest.sources(self.project) == [self.source]
+
+        entries = self.manifest.get(self.project, self.source)
+        new_chunks, stale, unchanged = Manifest.diff(entries, ['chunk 2', 'chunk 3', 'chunk 3'])
+        assert list(new_chunks.values()) == ['chunk 3']
+        assert [e['vector_pk'] for e in stale] == ['1']
+        assert unchanged == 1
+
+        self.manifest.remove(self.project, source=self.source, ids=[e['id'] for e in stale])
+        assert len(self.manifest.get(self.project, self.source)) == 1
+
+        self.manifest.remove(self.project)
+        assert self.manifest.get(self.project, self.source) == []
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.db_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
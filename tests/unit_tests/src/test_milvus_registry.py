@@ -0,0 +1,66 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from src.milvus_registry import MilvusRegistry
+
+
+CONNECTION_ARGS = {'uri': 'http://localhost:19530', 'token': None}
+
+
+class TestMilvusRegistry(unittest.TestCase):
+    '''Milvus registry test'''
+
+    def test_normalize_args(self):
+        assert MilvusRegistry.normalize_args(CONNECTION_ARGS) == {'uri': 'http://localhost:19530', 'secure': False}
+        assert MilvusRegistry.normalize_args({'host': 'localhost', 'port': 19530, 'user': 'u', 'password': 'p'}) == \
+            {'host': 'localhost', 'port': 19530, 'user': 'u', 'password': 'p', 'secure': True}
+        with self.assertRaises(AttributeError):
+            MilvusRegistry.normalize_args({})
+
+    @patch('pymilvus.connections.has_connection', return_value=True)
+    @patch('pymilvus.connections.connect')
+    def test_pool(self, mock_connect, _):
+        registry = MilvusRegistry(pool_size=2)
+        aliases = [registry.get_alias(CONNECTION_ARGS) for _ in range(6)]
+        assert len(set(aliases)) == 2
+        assert mock_connect.call_count == 2
+
+    @patch('pymilvus.Collection')
+    @patch('pymilvus.connections.has_connection', return_value=True)
+    @patch('pymilvus.connections.connect')
+    def test_collection(self, _, __, mock_collection):
+        registry = MilvusRegistry()
+        col = registry.get_collection('akcio_ut', CONNECTION_ARGS)
+        assert registry.get_collection('akcio_ut', CONNECTION_ARGS) is col
+        assert mock_collection.call_count == 1
+        registry.invalidate('akcio_ut')
+        registry.get_collection('akcio_ut', CONNECTION_ARGS)
+        assert mock_collection.call_count == 2
+
+    @patch('pymilvus.utility.get_server_version', side_effect=Exception('connection lost'))
+    @patch('pymilvus.connections.disconnect')
+    @patch('pymilvus.connections.has_connection', return_value=True)
+    @patch('pymilvus.connections.connect')
+    def test_reconnect(self, mock_connect, _, mock_disconnect, __):
+        registry = MilvusRegistry(health_check_interval=0)
+        alias = registry.get_alias(CONNECTION_ARGS)
+        assert registry.get_alias(CONNECTION_ARGS) == alias
+        mock_disconnect.assert_called_once_with(alias)
+        assert mock_connect.call_count == 2
+
+
+    def test_describe(self):
+        from pymilvus import DataType  # pylint: disable=C0415
+
+        collection = MagicMock()
+        collection.schema.fields = [MagicMock(dtype=DataType.INT64, params={}), MagicMock(dtype=DataType.FLOAT_VECTOR, params={'dim': 8})]
+        collection.schema.fields[0].name = 'pk'
+        collection.schema.fields[1].name = 'vector'
+        index_params = {'metric_type': 'IP', 'index_type': 'IVF_FLAT', 'params': {'nlist': 64}}
+        collection.indexes = [MagicMock(params=index_params)]
+        assert MilvusRegistry.describe(collection) == {
+            'schema': ['pk', 'vector'], 'dim': 8, 'index_type': 'IVF_FLAT', 'index_params': index_params}
+
+
+if __name__ == '__main__':
+    unittest.main()
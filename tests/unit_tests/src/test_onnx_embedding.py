@@ -0,0 +1,49 @@
+import copy
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from src.onnx_embedding import OnnxEncoder, cosine_drift
+from src.langchain.embedding.langchain_huggingface import TextEncoder
+
+
+def make_text_encoder(**kwargs) -> TextEncoder:
+    '''TextEncoder of onnx backend, whose model embeds a text to [length, 0]'''
+    mock_encoder = MagicMock()
+    mock_encoder.encode.side_effect = lambda texts, batch_size: np.array([[len(t), 0] for t in texts], dtype=np.float32)
+    with patch('src.onnx_embedding.get_encoder', return_value=mock_encoder):
+        return TextEncoder(model_name='BAAI/bge-base-en', backend='onnx', batch_tokens=0, **kwargs)
+
+
+class TestOnnxEmbedding(unittest.TestCase):
+    '''ONNX embedding backend test'''
+
+    def test_cosine_drift(self):
+        reference = np.array([[1, 0], [0, 1]], dtype=np.float32)
+        res = cosine_drift(reference, reference * 2)
+        assert abs(res['max']) < 1e-6
+        res = cosine_drift(reference, np.array([[1, 0], [1, 1]], dtype=np.float32))
+        assert abs(res['max'] - (1 - np.sqrt(0.5))) < 1e-6
+        assert abs(res['min_cosine'] - np.sqrt(0.5)) < 1e-6
+
+    def test_pool(self):
+        encoder = OnnxEncoder.__new__(OnnxEncoder)
+        hidden = np.array([[[1, 2], [3, 4], [100, 100]]], dtype=np.float32)
+        mask = np.array([[1, 1, 0]])
+        encoder.pooling = 'mean'
+        assert encoder._pool(hidden, mask).tolist() == [[2, 3]]  # pylint: disable=W0212
+        encoder.pooling = 'cls'
+        assert encoder._pool(hidden, mask).tolist() == [[1, 2]]  # pylint: disable=W0212
+        assert copy.deepcopy(encoder) is encoder
+
+    def test_text_encoder(self):
+        text_encoder = make_text_encoder()
+        assert text_encoder.client is None
+        assert text_encoder.model_tag == 'BAAI/bge-base-en@onnx-int8'
+        assert text_encoder.embed_documents(['ab', 'abc'], norm=False) == [[2, 0], [3, 0]]
+        assert text_encoder.embed_query('abc', norm=True) == [1, 0]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from src.search_tuner import SearchTuner
+
+
+class TestSearchTuner(unittest.TestCase):
+    '''Search params tuner test'''
+
+    def test_recommend_index(self):
+        tuner = SearchTuner(flat_threshold=10000)
+        assert tuner.recommend_index(100)['index_type'] == 'FLAT'
+        index_params = tuner.recommend_index(1000000)
+        assert index_params == {'metric_type': 'IP', 'index_type': 'IVF_FLAT', 'params': {'nlist': 4096}}
+        assert tuner.should_rebuild({'index_type': 'FLAT', 'params': {}}, index_params)
+        assert not tuner.should_rebuild({'index_type': 'IVF_FLAT', 'params': {'nlist': 2048}}, index_params)
+        assert tuner.should_rebuild({'index_type': 'IVF_FLAT', 'params': {'nlist': 1024}}, index_params)
+
+    def test_candidates(self):
+        tuner = SearchTuner(k=5)
+        assert tuner.candidates({'index_type': 'IVF_FLAT', 'params': {'nlist': 48}}) == \
+            [{'nprobe': x} for x in [1, 2, 4, 8, 16, 32, 48]]
+        assert tuner.candidates({'index_type': 'HNSW', 'params': {'M': 8}})[0] == {'ef': 16}
+        assert tuner.candidates({'index_type': 'FLAT'}) == [{}]
+
+    def test_tune(self):
+        tuner = SearchTuner(target_recall=0.9, k=10)
+        truth = [list(range(10))] * 4
+
+        def _search(params):
+            # Recall grows with nprobe: nprobe / 16 of true results are found
+            found = min(10, params['nprobe'] * 10 // 16)
+            return [ids[:found] + [-1] * (10 - found) for ids in truth]
+
+        res = tuner.tune(_search, {'index_type': 'IVF_FLAT', 'params': {'nlist': 64}})
+        assert res['params'] == {'nprobe': 16}
+        assert res['recall'] == 1.0
+        assert SearchTuner.recall([[1, 2, 3]], [[1, 2, 4]], k=3) == 2 / 3
+
+    def test_tune_exact(self):
+        tuner = SearchTuner(target_recall=0.9, k=2)
+        # Each query finds itself first, which is not counted
+        exact = [[0, 1, 2], [1, 0, 2]]
+
+        def _search(params):
+            return exact if params['nprobe'] >= 4 else [[0, 1, 3], [1, 3, 4]]
+
+        res = tuner.tune(_search, {'index_type': 'IVF_FLAT', 'params': {'nlist': 8}}, query_ids=[0, 1])
+        assert res['params'] == {'nprobe': 4}
+        # No exact search for HNSW
+        res = tuner.tune(lambda params: exact, {'index_type': 'HNSW', 'params': {'M': 8}})
+        assert res['params'] is None
+        res = tuner.tune(lambda params: exact, {'index_type': 'HNSW', 'params': {'M': 8}}, exact_search=lambda: exact)
+        assert res['params'] == {'ef': 16}
+
+    def test_sample(self):
+        tuner = SearchTuner(sample_size=10)
+        assert sorted(tuner.sample(range(5))) == list(range(5))
+        sample = tuner.sample(range(1000), seed=0)
+        assert len(set(sample)) == 10
+        # Not only the oldest ids
+        assert max(sample) >= 100
+
+    def test_schedule(self):
+        tuner = SearchTuner(growth=2.0)
+        assert tuner.get('akcio_ut') is None
+        tuner.schedule('akcio_ut', 100, lambda: {'params': {'nprobe': 8}}).result()
+        assert tuner.get('akcio_ut') == {'nprobe': 8}
+        assert tuner.schedule('akcio_ut', 150, lambda: {'params': {'nprobe': 16}}) is None
+        tuner.schedule('akcio_ut', 200, lambda: {'params': {'nprobe': 16}}).result()
+        assert tuner.get('akcio_ut') == {'nprobe': 16}
+        tuner.invalidate('akcio_ut')
+        assert tuner.get('akcio_ut') is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import unittest
+
+from src.summary import ConversationSummary
+
+
+class TestConversationSummary(unittest.TestCase):
+    '''Conversation summary test'''
+    project = 'akcio_ut'
+    session_id = 'test000'
+    db_path = os.path.join(os.path.dirname(__file__), 'summary.db')
+
+    def setUp(self):
+        self.prompts = []
+
+        def _summarize(prompt):
+            self.prompts.append(prompt)
+            return 'summary ' * 10
+
+        self.summaries = ConversationSummary(
+            summarize=_summarize, connect_str=f'sqlite:///{self.db_path}', max_tokens=5)
+
+    def test_refresh(self):
+        turns = [('q0', 'a0'), ('q1', 'a1')]
+        assert self.summaries.get(self.project, self.session_id) == ('', 0)
+
+        future = self.summaries.refresh(self.project, self.session_id, lambda covered: turns[covered:])
+        future.result()
+        summary, covered = self.summaries.get(self.project, self.session_id)
+        assert covered == 2
+        assert len(summary.split()) == 5
+        assert 'Human: q1\nAI: a1' in self.prompts[0]
+
+        # Nothing new to summarize
+        self.summaries.refresh(self.project, self.session_id, lambda covered: turns[covered:]).result()
+        assert len(self.prompts) == 1
+
+        self.summaries.remove(self.project, self.session_id)
+        assert self.summaries.get(self.project, self.session_id) == ('', 0)
+
+    def tearDown(self):
+        self.summaries.engine.dispose()
+        os.remove(self.db_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import os
 import unittest
+from unittest.mock import patch
 
 from src.towhee.base import BaseMemory
 from src.towhee.memory.sql import MemoryStore
@@ -42,6 +43,62 @@ class TestSql(unittest.TestCase):
         self.memory.drop(self.project)
         assert not self.memory.check(self.project)
 
+    def test_write_behind(self):
+        project = 'akcio_ut_wb'
+        memory = MemoryStore(configs={**self.test_config, 'flush_interval': 60})
+        assert memory.get_history(project, self.session_id) == []
+
+        memory.add_history(project, self.session_id, self.messages)
+        # Cached history includes pending messages before they are written
+        assert memory.get_history(project, self.session_id) == self.messages
+        assert MemoryStore(configs=self.test_config).get_history(project, self.session_id) == []
+
+        memory.flush()
+        assert MemoryStore(configs=self.test_config).get_history(project, self.session_id) == self.messages
+
+        memory.drop(project)
+        assert not memory.check(project)
+
+    def test_flush_failure(self):
+        project = 'akcio_ut_retry'
+        memory = MemoryStore(configs={**self.test_config, 'flush_interval': 60, 'flush_retries': 1})
+        memory.add_history(project, self.session_id, self.messages)
+        with patch.object(memory, '_create_table_if_not_exists', side_effect=RuntimeError('mock error')):
+            memory.flush()
+            # Rows failed to write are kept pending for the next flush
+            assert [p for p, _ in memory._pending] == [project]  # pylint: disable=W0212
+            memory.flush()
+            # Dropped after retries, and not served from cache any more
+            assert memory._pending == []  # pylint: disable=W0212
+        assert memory.get_history(project, self.session_id) == []
+
+        memory.add_history(project, self.session_id, self.messages)
+        with patch.object(memory, '_create_table_if_not_exists', side_effect=RuntimeError('mock error')):
+            memory.flush()
+        memory.flush()
+        assert MemoryStore(configs=self.test_config).get_history(project, self.session_id) == self.messages
+        memory.drop(project)
+
+        memory = MemoryStore(configs={**self.test_config, 'write_behind': False})
+        with patch.object(memory.engine, 'connect', side_effect=RuntimeError('mock error')):
+            with self.assertRaises(RuntimeError):
+                memory.add_history(project, self.session_id, self.messages)
+        memory.drop(project)
+
+    def test_window(self):
+        project = 'akcio_ut_window'
+        memory = MemoryStore(configs={**self.test_config, 'history_turns': 2, 'write_behind': False})
+        messages = [(f'question {i}', f'answer {i}') for i in range(3)]
+        memory.add_history(project, self.session_id, messages)
+
+        assert memory.get_history(project, self.session_id, limit=2) == messages[1:]
+        assert memory.get_history(project, self.session_id, limit=1, offset=1) == messages[1:2]
+        assert memory.get_history(project, self.session_id) == messages
+        assert memory.get_history(project, self.session_id, limit=2, max_tokens=4) == messages[2:]
+        assert memory.count_history(project, self.session_id) == 3
+
+        memory.drop(project)
+
     @classmethod
     def tearDownClass(cls):
         os.remove(cls.db_path)
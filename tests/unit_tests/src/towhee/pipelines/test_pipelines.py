@@ -345,6 +345,22 @@ class TestPipelines(unittest.TestCase):
             pipelines.drop(self.project)
             assert not pipelines.check(self.project)
 
+    def test_memoize(self):
+        pipelines = create_pipelines('openai')
+
+        search_pipeline = pipelines.search_pipeline
+        assert pipelines.search_pipeline is search_pipeline
+        assert pipelines.search_config is pipelines.search_config
+
+        # Another config holds another pipeline
+        other_pipeline = pipelines.get_search_pipeline(threshold=0.5)
+        assert other_pipeline is not search_pipeline
+        assert pipelines.get_search_pipeline(threshold=0.5) is other_pipeline
+        assert pipelines.search_pipeline is search_pipeline
+
+        pipelines.rebuild('search')
+        assert pipelines.search_pipeline is not search_pipeline
+
     @classmethod
     def tearDownClass(cls):
         os.remove(cls.data_src)
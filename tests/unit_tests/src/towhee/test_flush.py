@@ -0,0 +1,44 @@
+import time
+import unittest
+
+from src.towhee.flush import FlushScheduler
+
+
+class TestFlushScheduler(unittest.TestCase):
+    '''Flush scheduler test'''
+
+    def test_rate_limit(self):
+        flushed = []
+        flusher = FlushScheduler(flushed.append, interval=0.2)
+        flusher.request('akcio_ut')
+        time.sleep(0.05)
+        assert flushed == ['akcio_ut']
+
+        # Requests within the interval are merged into one flush
+        for _ in range(5):
+            flusher.request('akcio_ut')
+        time.sleep(0.05)
+        assert flushed == ['akcio_ut']
+        time.sleep(0.25)
+        assert flushed == ['akcio_ut', 'akcio_ut']
+        flusher.stop()
+
+    def test_stop(self):
+        flushed = []
+        flusher = FlushScheduler(flushed.append, interval=10)
+        flusher.request('p1')
+        time.sleep(0.05)
+        flusher.request('p1')
+        flusher.stop(flush=True)
+        assert flushed == ['p1', 'p1']
+
+    def test_disabled(self):
+        flushed = []
+        flusher = FlushScheduler(flushed.append, interval=-1)
+        flusher.request('p1')
+        flusher.stop()
+        assert not flushed
+
+
+if __name__ == '__main__':
+    unittest.main()
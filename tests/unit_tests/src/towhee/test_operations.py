@@ -21,6 +21,13 @@ class MockStore:
         return len(self.memory) > 0
 
 
+class MockMutationResult:
+    '''Result of a Milvus insert by the osschat_milvus op, one per chunk'''
+    def __init__(self, primary_keys):
+        self.primary_keys = primary_keys
+        self.insert_count = len(primary_keys)
+
+
 class MockPipeline:
     def __init__(self, *args, **kwargs):
         self.search_que = DataQueue([('answer', ColumnType.SCALAR)])
@@ -45,9 +52,15 @@ class MockPipeline:
         if not self.check(project):
             self.projects[project] = ''
 
-    def count_entities(self, project):
+    def describe(self, project):
+        return {'schema': ['id', 'text_id', 'text', 'embedding'], 'dim': 2, 'index_type': 'FLAT', 'index_params': {}}
+
+    def count_entities(self, project, flush=False, exists=None):
         return {'vector store': len(self.projects[project]), 'scalar store': None}
 
+    def tune_index(self, project):
+        return None
+
     def drop(self, project):
         del self.projects[project]
 
@@ -119,6 +132,23 @@ class TestOperations(unittest.TestCase):
                 assert not status['store']
                 assert not status['memory']
 
+    def test_count_inserted(self):
+
+        with patch('src.towhee.pipelines.TowheePipelines') as mock_pipelines, \
+                patch('src.towhee.memory.MemoryStore') as mock_memory:
+            mock_pipelines.return_value = MockPipeline()
+            mock_memory.return_value = MockStore()
+
+            from src.towhee.operations import count_inserted
+
+            # Rows output by the osschat-insert pipeline of Towhee hub
+            rows = [{'milvus': MockMutationResult([i]), 'es': None, 'token_count': 2} for i in range(3)]
+            assert sum(count_inserted(r) for r in rows) == 3
+            # Rows output by the generate_questions pipeline
+            assert count_inserted({'milvus_res': MockMutationResult([0, 1]), 'es_res': None}, key='milvus_res') == 2
+            with self.assertLogs('src.towhee.operations', level='WARNING'):
+                assert count_inserted({'res': 1}) is None
+
 
 if __name__ == '__main__':
     unittest.main()